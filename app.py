@@ -1,9 +1,11 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine, text
-import requests
+from sqlalchemy import text
 import time
 import re
+import html
+import base64
+import mimetypes
 from datetime import datetime, timedelta
 
 # --- CONFIGURAÇÃO ---
@@ -24,244 +26,308 @@ st.markdown("""
         float: right; clear: both; box-shadow: 0 1px 1px rgba(0,0,0,0.1); text-align: left;
     }
     .chat-time { display: block; font-size: 11px; color: #999; margin-top: 4px; text-align: right; }
+    .chat-thumb { display: block; max-width: 200px; border-radius: 8px; margin-top: 6px; }
+    .chat-media { display: block; font-size: 12px; color: #555; margin-top: 4px; }
+    .chat-fim { clear: both; }
     .stChatInputContainer { padding-bottom: 20px !important; }
     div[data-testid="stExpander"] { border: none; box-shadow: none; background-color: transparent; }
 </style>
 """, unsafe_allow_html=True)
 
 # --- BANCO ---
+# engine/API/disparo ficam em módulos próprios para o worker.py usar fora do Streamlit
 try:
-    if "DATABASE_URL" in st.secrets:
-        db_url = st.secrets["DATABASE_URL"].replace("postgres://", "postgresql://")
-        engine = create_engine(db_url)
-    else: st.error("⚠️ Configure DATABASE_URL nos Secrets."); st.stop()
+    from banco import conexao, iniciar_rerun, finalizar_rerun, liberar_no_fim, telemetria
+    from metricas import metricas, medir, LIMITES_MS
+    from meta_api import get_media_bytes, previa_midia, registrar_midia
+    from envios import enviar_template, enviar_arquivo
+    from fila import fila_compartilhada, buscar_fila
+    from busca import buscar_mensagens
+    from exportar import exportar_conversa, exportar_mensagens, exportar_fila, exportar_contatos, exportar_custos, EXPORTAR_MAX_MB
+    from arquivo import mensagens_arquivadas, arquivar, resumo_arquivo, garantir_particoes, particionada
+    from cache import versao, invalidar, obter, chave_sql, backend as backend_cache
+    from migracoes import aplicar_migracoes, pendentes, verificar_indices, reparar_indices, checar_planos, salvar_referencia
+    from custos import custos_por_vendedora, custos_por_template, custos_por_dia, reconciliar
+    from disparo import preparar_lista, enfileirar_disparo, listar_jobs, cancelar_job, formatar_eta
+except RuntimeError as e: st.error(str(e)); st.stop()
 except Exception as e: st.error(f"Erro Conexão DB: {e}"); st.stop()
+iniciar_rerun()
+# Tempo do rerun inteiro, por página; helpers, SQL e Graph são somados dentro dele (metricas.py)
+metricas.iniciar_rerun(st.session_state.get("pagina", "chat") if st.session_state.get("usuario") else "login")
 
 # --- FUNÇÕES ---
 
-@st.cache_data(ttl=5) 
+# Tabelas de configuração: compartilhadas entre sessões e só relidas quando um CRUD muda a versão (cache.py)
+@st.cache_data(show_spinner=False, max_entries=32)
+def _ler_config(tabela, versao, sql):
+    # st.cache_data é o cache do processo; obter() divide o resultado com as outras réplicas
+    def carregar():
+        with conexao() as conn: return pd.read_sql(text(sql), conn)
+    return obter(f"cfg:{tabela}:{versao}:{chave_sql(sql)}", carregar)
+
+@medir("ler_config")
+def ler_config(tabela, sql):
+    return _ler_config(tabela, versao(tabela), sql)
+
 def listar_todos_usuarios():
-    with engine.connect() as conn: return pd.read_sql(text("SELECT id, nome, email, funcao, ativo, bloqueado_envio FROM usuarios ORDER BY id"), conn)
+    return ler_config("usuarios", "SELECT id, nome, email, funcao, ativo, bloqueado_envio FROM usuarios ORDER BY id")
 
-@st.cache_data(ttl=60)
 def listar_usuarios_ativos():
-    with engine.connect() as conn: return pd.read_sql(text("SELECT id, nome FROM usuarios WHERE ativo=TRUE ORDER BY nome"), conn)
+    return ler_config("usuarios", "SELECT id, nome FROM usuarios WHERE ativo=TRUE ORDER BY nome")
 
-@st.cache_data(ttl=2) 
+@medir("carregar_fila")
 def carregar_fila(admin=False, usuario_id=None):
-    with engine.connect() as conn:
-        filtro = "" if admin else f"AND (c.vendedora_id = {usuario_id} OR c.vendedora_id IS NULL)"
-        query = text(f"""
-            SELECT c.id, c.nome, c.whatsapp_id, c.status_atendimento, u.nome as vendedora, c.codigo_cliente
-            FROM contatos c
-            LEFT JOIN usuarios u ON c.vendedora_id = u.id
-            WHERE c.status_atendimento != 'encerrado' {filtro}
-            ORDER BY c.ultima_interacao DESC
-        """)
-        return pd.read_sql(query, conn)
-
-def carregar_mensagens(cid):
-    with engine.connect() as conn: return pd.read_sql(text("SELECT id, remetente, texto, tipo, url_media, data_envio FROM mensagens WHERE contato_id = :cid ORDER BY data_envio ASC"), conn, params={"cid":cid})
-
+    # Snapshot único por processo (fila.py), atualizado por LISTEN/NOTIFY; o filtro por agente é em memória
+    return fila_compartilhada().filtrar(admin, usuario_id)
+
+ROTULOS_STATUS = {"fila": "Na fila", "em_andamento": "Em andamento"}
+
+@medir("pagina_da_fila")
+def pagina_da_fila(admin, usuario_id, termo, status, pagina, por_pagina):
+    # Só o que aparece na tela: snapshot paginado, ou busca paginada no servidor quando há termo
+    if termo.strip(): return buscar_fila(termo, admin, usuario_id, status, pagina, por_pagina)
+    return fila_compartilhada().pagina(admin, usuario_id, status, pagina, por_pagina)
+
+MSGS_POR_PAGINA = 50
+
+@medir("carregar_mensagens")
+def carregar_mensagens(cid, limite=MSGS_POR_PAGINA, antes=None, depois_id=None):
+    # Keyset em (data_envio, id): página mais recente, página anterior a `antes` = (data_envio, id), ou só as novas após depois_id
+    cols = "id, remetente, texto, tipo, url_media, data_envio"
+    with conexao() as conn:
+        if depois_id is not None:
+            return pd.read_sql(text(f"SELECT {cols} FROM mensagens WHERE contato_id = :cid AND id > :i ORDER BY data_envio ASC, id ASC"), conn, params={"cid":cid, "i":int(depois_id)})
+        params = {"cid":cid, "n":limite}
+        filtro = ""
+        if antes is not None:
+            filtro = "AND (data_envio, id) < (:d, :i)"
+            params.update(d=pd.Timestamp(antes[0]).to_pydatetime(), i=int(antes[1]))
+        df = pd.read_sql(text(f"SELECT {cols} FROM mensagens WHERE contato_id = :cid {filtro} ORDER BY data_envio DESC, id DESC LIMIT :n"), conn, params=params)
+    df = df.iloc[::-1].reset_index(drop=True)
+    if len(df) < limite:
+        # Acabou o que está no banco: o resto da página vem do arquivo Parquet (conversa encerrada e arquivada)
+        corte = (df['data_envio'].iloc[0], df['id'].iloc[0]) if not df.empty else antes
+        arq = mensagens_arquivadas(cid, corte, limite - len(df))
+        if not arq.empty: df = pd.concat([arq[df.columns], df], ignore_index=True) if not df.empty else arq[df.columns]
+    return df
+
+def mensagens_da_conversa(cid):
+    # Mantém a conversa aberta na sessão; nos reruns só busca o que chegou depois do último id
+    conv = st.session_state.get("conversa")
+    if not conv or conv["cid"] != cid or conv["msgs"].empty:
+        df = carregar_mensagens(cid)
+        conv = st.session_state.conversa = {"cid": cid, "msgs": df, "tem_mais": len(df) == MSGS_POR_PAGINA}
+    else:
+        novas = carregar_mensagens(cid, depois_id=conv["msgs"]['id'].max())
+        if not novas.empty: conv["msgs"] = pd.concat([conv["msgs"], novas], ignore_index=True)
+    return conv
+
+def carregar_anteriores(conv):
+    primeira = conv["msgs"].iloc[0]
+    antigas = carregar_mensagens(conv["cid"], antes=(primeira['data_envio'], primeira['id']))
+    conv["tem_mais"] = len(antigas) == MSGS_POR_PAGINA
+    if not antigas.empty: conv["msgs"] = pd.concat([antigas, conv["msgs"]], ignore_index=True)
+
+def envios_da_conversa(conv):
+    # Envios em segundo plano (envios.py) desta conversa. O enviado sai da lista quando a mensagem real já está
+    # na conversa; se o id dele ficou para trás do último carregado (gravou depois de outra), entra direto nela.
+    ids = set(conv["msgs"]['id'].tolist()) if not conv["msgs"].empty else set()
+    ultimo = max(ids) if ids else 0
+    atrasados = [e for e in st.session_state.get("envios", []) if e["cid"] == conv["cid"] and e["status"] == "enviado" and e["msg_id"] not in ids and e["msg_id"] < ultimo]
+    if atrasados:
+        novas = pd.DataFrame([{"id": e["msg_id"], "remetente": "empresa", "texto": e["texto"], "tipo": e["tipo"], "url_media": e["url_media"], "data_envio": e["data_envio"]} for e in atrasados])
+        conv["msgs"] = pd.concat([conv["msgs"], novas[conv["msgs"].columns]], ignore_index=True).sort_values(['data_envio', 'id'], ignore_index=True)
+        ids.update(e["msg_id"] for e in atrasados)
+    st.session_state.envios = [e for e in st.session_state.get("envios", []) if not (e["status"] == "enviado" and e["msg_id"] in ids)]
+    return [e for e in st.session_state.envios if e["cid"] == conv["cid"]]
+
+@medir("carregar_info_cliente")
 def carregar_info_cliente(cid):
-    with engine.connect() as conn: return conn.execute(text("SELECT nome, whatsapp_id, codigo_cliente, cpf_cnpj, notas_internas FROM contatos WHERE id=:id"), {"id":cid}).fetchone()
+    with conexao() as conn: return conn.execute(text("SELECT nome, whatsapp_id, codigo_cliente, cpf_cnpj, notas_internas FROM contatos WHERE id=:id"), {"id":cid}).fetchone()
 
+@medir("verificar_bloqueio_usuario")
 def verificar_bloqueio_usuario(uid):
-    with engine.connect() as conn: 
+    with conexao() as conn: 
         res = conn.execute(text("SELECT bloqueado_envio FROM usuarios WHERE id=:id"), {"id":uid}).fetchone()
         return res[0] if res else False
 
+@medir("gerar_relatorio_custos")
 def gerar_relatorio_custos(dias=30):
-    try:
-        with engine.connect() as conn:
-            query = text("""
-                SELECT 
-                    u.nome AS Vendedora,
-                    COUNT(m.id) AS Qtd_Mensagens,
-                    SUM(m.custo) AS Custo_Total
-                FROM mensagens m
-                JOIN contatos c ON m.contato_id = c.id
-                LEFT JOIN usuarios u ON c.vendedora_id = u.id
-                WHERE m.remetente = 'empresa' 
-                  AND m.data_envio >= CURRENT_DATE - INTERVAL :d DAY
-                  AND m.custo > 0
-                GROUP BY u.nome
-                ORDER BY Custo_Total DESC
-            """)
-            return pd.read_sql(query, conn, params={"d": f"{dias} days"})
+    # Lê do rollup diário (custos.py), não varre mensagens
+    try: return custos_por_vendedora(dias)
     except: return pd.DataFrame()
 
 # --- CRUD ---
 def criar_usuario(n, e, s, f):
     try:
-        with engine.connect() as conn:
+        with conexao() as conn:
             conn.execute(text("INSERT INTO usuarios (nome, email, senha, funcao, ativo, bloqueado_envio) VALUES (:n, :e, :s, :f, TRUE, FALSE)"), {"n":n, "e":e, "s":s, "f":f})
             conn.commit()
-        listar_todos_usuarios.clear(); return True, "Criado!"
+        invalidar("usuarios"); return True, "Criado!"
     except Exception as er: return False, str(er)
 
 def editar_usuario(uid, nn, ne, nf, ns=None, bloqueado=False):
-    with engine.connect() as conn:
+    with conexao() as conn:
         try:
             conn.execute(text("UPDATE usuarios SET nome=:n, email=:e, funcao=:f, bloqueado_envio=:b WHERE id=:id"), {"n":nn, "e":ne, "f":nf, "b":bloqueado, "id":uid})
             if ns: conn.execute(text("UPDATE usuarios SET senha=:s WHERE id=:id"), {"s":ns, "id":uid})
             conn.commit()
-            listar_todos_usuarios.clear(); listar_usuarios_ativos.clear()
+            invalidar("usuarios")
             return True, "Salvo!"
         except Exception as e: return False, f"Erro: {str(e)}"
 
 def excluir_usuario(uid):
-    with engine.connect() as conn:
+    with conexao() as conn:
         conn.execute(text("UPDATE contatos SET vendedora_id = NULL WHERE vendedora_id = :id"), {"id":uid})
         conn.execute(text("DELETE FROM usuarios WHERE id = :id"), {"id":uid})
         conn.commit()
-    listar_todos_usuarios.clear()
+    invalidar("usuarios")
 
 def atualizar_cliente_completo(cid, nome, codigo, notas):
-    with engine.connect() as conn:
+    with conexao() as conn:
         conn.execute(text("UPDATE contatos SET nome=:nm, codigo_cliente=:c, notas_internas=:n WHERE id=:id"), {"nm":nome, "c":codigo, "n":notas, "id":cid})
         conn.commit()
-    carregar_fila.clear()
+    fila_compartilhada().recarregar()  # as outras réplicas recebem o NOTIFY do trigger
 
 def transferir_atendimento(cid, vid):
-    with engine.connect() as conn:
+    with conexao() as conn:
         conn.execute(text("UPDATE contatos SET vendedora_id=:vid, status_atendimento='em_andamento' WHERE id=:cid"), {"vid":vid, "cid":cid})
         conn.commit()
-    carregar_fila.clear()
+    fila_compartilhada().recarregar()
 
 def encerrar_atendimento(cid):
-    with engine.connect() as conn:
+    with conexao() as conn:
         conn.execute(text("UPDATE contatos SET status_atendimento='encerrado', contexto_bot=NULL WHERE id=:cid"), {"cid":cid})
         conn.commit()
-    carregar_fila.clear()
+    fila_compartilhada().recarregar()
 
+@medir("pegar_msg_boas_vindas")
 def pegar_msg_boas_vindas():
     try:
-        with engine.connect() as conn:
-            res = conn.execute(text("SELECT valor FROM configuracoes WHERE chave='msg_boas_vindas'")).fetchone()
-            return res[0] if res else ""
+        df = ler_config("configuracoes", "SELECT valor FROM configuracoes WHERE chave='msg_boas_vindas'")
+        return df.iloc[0, 0] if not df.empty else ""
     except: return "" 
 
 def salvar_msg_boas_vindas(txt):
     try:
-        with engine.connect() as conn:
+        with conexao() as conn:
             conn.execute(text("INSERT INTO configuracoes (chave, valor) VALUES ('msg_boas_vindas', :v) ON CONFLICT (chave) DO UPDATE SET valor = :v"), {"v":txt})
             conn.commit()
+        invalidar("configuracoes")
         return True, "Salvo!"
     except Exception as e: return False, f"Erro: {e}"
 
 # --- REGRAS BOT ---
 def criar_regra_bot(gatilho, resposta):
     try:
-        with engine.connect() as conn:
+        with conexao() as conn:
             conn.execute(text("INSERT INTO bot_regras (template_gatilho, resposta_texto) VALUES (:g, :r) ON CONFLICT (template_gatilho) DO UPDATE SET resposta_texto = :r"), {"g":gatilho, "r":resposta})
             conn.commit()
+        invalidar("bot_regras")
         return True, "Salvo!"
     except Exception as e: return False, str(e)
 
+@medir("listar_regras_bot")
 def listar_regras_bot():
     try:
-        with engine.connect() as conn: return pd.read_sql(text("SELECT * FROM bot_regras"), conn)
+        return ler_config("bot_regras", "SELECT * FROM bot_regras")
     except: return pd.DataFrame()
 
 def excluir_regra_bot(rid):
-    with engine.connect() as conn:
+    with conexao() as conn:
         conn.execute(text("DELETE FROM bot_regras WHERE id=:id"), {"id":rid})
         conn.commit()
-
-def garantir_contato(whatsapp_id, vendedora_id):
-    tel = ''.join(filter(str.isdigit, str(whatsapp_id)))
-    if len(tel) < 10: return None
-    if len(tel) == 11 and not tel.startswith("55"): tel = "55" + tel
-    
-    with engine.connect() as conn:
-        res = conn.execute(text("SELECT id FROM contatos WHERE whatsapp_id = :w"), {"w":tel}).fetchone()
-        if res:
-            cid = res[0]
-            conn.execute(text("UPDATE contatos SET vendedora_id=:v WHERE id=:id AND vendedora_id IS NULL"), {"v":vendedora_id, "id":cid})
-            conn.commit()
-            return cid
-        else:
-            try:
-                r = conn.execute(text("INSERT INTO contatos (whatsapp_id, nome, status_atendimento, vendedora_id) VALUES (:w, 'Lead Importado', 'fila', :v) RETURNING id"), {"w":tel, "v":vendedora_id}).fetchone()
-                conn.commit()
-                return r[0]
-            except: return None
+    invalidar("bot_regras")
 
 # --- TEMPLATES ---
 def criar_template(nome_tecnico, custo):
     try:
-        with engine.connect() as conn:
+        with conexao() as conn:
             conn.execute(text("INSERT INTO templates (nome_tecnico, idioma, custo_estimado) VALUES (:n, 'pt_BR', :c)"), {"n":nome_tecnico, "c":custo})
             conn.commit()
+        invalidar("templates")
         return True, "Cadastrado!"
     except Exception as e: return False, str(e)
 
+@medir("listar_templates")
 def listar_templates():
     try:
-        with engine.connect() as conn: return pd.read_sql(text("SELECT * FROM templates ORDER BY nome_tecnico"), conn)
+        return ler_config("templates", "SELECT * FROM templates ORDER BY nome_tecnico")
     except: return pd.DataFrame()
 
 def excluir_template(tid):
-    with engine.connect() as conn:
+    with conexao() as conn:
         conn.execute(text("DELETE FROM templates WHERE id=:id"), {"id":tid})
         conn.commit()
-
-# --- API ---
-def upload_para_meta(uploaded_file, mime_type):
-    url = f"https://graph.facebook.com/v18.0/{st.secrets['META_PHONE_ID']}/media"
-    headers = {"Authorization": f"Bearer {st.secrets['META_TOKEN']}"}
-    files = {'file': (uploaded_file.name, uploaded_file.getvalue(), mime_type)}
-    data = {'messaging_product': 'whatsapp'}
-    try:
-        response = requests.post(url, headers=headers, files=files, data=data)
-        if response.status_code == 200: return response.json()['id']
-    except: pass
-    return None
-
-def get_media_bytes(media_id):
-    try:
-        url = f"https://graph.facebook.com/v18.0/{media_id}"
-        headers = {"Authorization": f"Bearer {st.secrets['META_TOKEN']}"}
-        r = requests.get(url, headers=headers).json()
-        if 'url' in r: return requests.get(r['url'], headers=headers).content
-    except: pass
-    return None
-
-def enviar_mensagem_api(telefone, conteudo, tipo="text", template_name=None, variaveis=None):
-    tel = ''.join(filter(str.isdigit, str(telefone)))
-    if len(tel) == 13 and tel.startswith("55"): tel = tel[:4] + tel[5:]
-    
-    url = f"https://graph.facebook.com/v18.0/{st.secrets['META_PHONE_ID']}/messages"
-    headers = {"Authorization": f"Bearer {st.secrets['META_TOKEN']}", "Content-Type": "application/json"}
-    payload = {"messaging_product": "whatsapp", "to": tel, "type": tipo}
-    
-    if tipo == 'text': payload['text'] = {"body": conteudo}
-    elif tipo == 'template': 
-        components = []
-        if variaveis and len(variaveis) > 0:
-            params = [{"type": "text", "text": str(v)} for v in variaveis]
-            components.append({"type": "body", "parameters": params})
-        payload['template'] = {"name": template_name, "language": {"code": "pt_BR"}, "components": components}
-    elif tipo == 'image': payload['image'] = {"id": conteudo}
-    elif tipo == 'document': payload['document'] = {"id": conteudo, "filename": "Anexo"}
-    elif tipo == 'audio': payload['audio'] = {"id": conteudo}
-        
-    try:
-        resp = requests.post(url, headers=headers, json=payload)
-        return resp.status_code, resp.json()
-    except Exception as e: return 500, str(e)
+    invalidar("templates")
 
 def criar_rr(t, tx, uid):
-    with engine.connect() as conn:
+    with conexao() as conn:
         conn.execute(text("INSERT INTO respostas_rapidas (titulo, texto, criado_por) VALUES (:t, :tx, :u)"), {"t":t, "tx":tx, "u":uid})
         conn.commit()
+    invalidar("respostas_rapidas")
+@medir("listar_rr")
 def listar_rr():
-    with engine.connect() as conn: return pd.read_sql(text("SELECT * FROM respostas_rapidas"), conn)
+    return ler_config("respostas_rapidas", "SELECT * FROM respostas_rapidas")
 def excluir_rr(rid):
-    with engine.connect() as conn:
+    with conexao() as conn:
         conn.execute(text("DELETE FROM respostas_rapidas WHERE id=:id"), {"id":rid})
         conn.commit()
+    invalidar("respostas_rapidas")
+
+# --- MÍDIA NA CONVERSA ---
+ROTULOS_MIDIA = {'image': ("🖼️ Imagem", "🔍 Ver"), 'audio': ("🎵 Áudio", "▶️ Ouvir"), 'voice': ("🎵 Áudio", "▶️ Ouvir"), 'document': ("📄 Documento", "📂 Abrir")}
+
+def formatar_tamanho(n):
+    try: n = float(n)
+    except (TypeError, ValueError): return ""
+    for u in ("B", "KB", "MB"):
+        if n < 1024: return f"{n:.0f} {u}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+def selo_midia(tipo, meta):
+    return " · ".join(x for x in [ROTULOS_MIDIA[tipo][0], (meta or {}).get("mime_type") or "", formatar_tamanho((meta or {}).get("file_size"))] if x)
+
+def renderizar_midia(r):
+    # Selo/miniatura leves por padrão; o arquivo inteiro só é buscado quando o agente abre o item
+    mid, tipo = str(r['url_media']), r['tipo']
+    abertas = st.session_state.setdefault("midias_abertas", set())
+    acao = ROTULOS_MIDIA[tipo][1]
+    mini, meta = previa_midia(mid, tipo)
+    selo = selo_midia(tipo, meta)
+    if mid in abertas:
+        dt = get_media_bytes(mid)
+        if not dt: st.caption(f"{selo} · indisponível"); return
+        if tipo == 'image': st.image(dt, width=400)
+        elif tipo in ('audio', 'voice'): st.audio(dt)
+        else:
+            ext = mimetypes.guess_extension((meta or {}).get("mime_type") or "") or ".pdf"
+            st.download_button("📄 Baixar", dt, file_name=f"anexo{ext}", key=f"f_{r['id']}")
+    else:
+        if mini: st.image(mini, width=200)
+        st.caption(selo)
+        if st.button(acao, key=f"m_{r['id']}"): abertas.add(mid); st.rerun()
+
+def eh_midia(r): return r['tipo'] in ROTULOS_MIDIA and bool(r['url_media'])
+
+def html_bolha(r, previa=None, selo=""):
+    cls = "chat-bubble-cliente" if r['remetente']=='cliente' else "chat-bubble-empresa"
+    h = r['data_envio'].strftime('%H:%M')
+    cnt = f"<span>{html.escape(str(r['texto'])).replace(chr(10), '<br>')}</span>" if r['texto'] and r['texto']!="None" else ""
+    if previa is not None:
+        mini, meta = previa
+        if mini: cnt += f'<img class="chat-thumb" src="data:image/jpeg;base64,{base64.b64encode(mini).decode()}"/>'
+        cnt += f'<span class="chat-media">{html.escape(selo_midia(r["tipo"], meta))}</span>'
+    return f"""<div class="{cls}">{cnt}<span class="chat-time">{h}{selo}</span></div>"""
+
+@medir("montar_html_conversa")
+@st.cache_data(max_entries=200, show_spinner=False)
+def montar_html_conversa(cid, primeiro_id, ultimo_id, qtd, previas_prontas, _msgs, _previas):
+    # Uma página de mensagens vira um único bloco HTML. Chave: contato + faixa de ids + quantidade + prévias já geradas;
+    # _msgs/_previas não entram no hash (o prefixo _ faz o st.cache_data ignorá-los).
+    corpo = "".join(html_bolha(r, _previas.get(str(r['url_media'])) if eh_midia(r) else None) for r in _msgs.to_dict('records'))
+    return f'<div class="chat-transcricao">{corpo}<div class="chat-fim"></div></div>'
 
 # =======================
 # 🖥️ INTERFACE
@@ -279,7 +345,7 @@ if st.session_state.usuario is None:
             senha = st.text_input("Senha", type="password")
             if st.form_submit_button("Entrar"):
                 def verif(e, s):
-                    with engine.connect() as conn: return conn.execute(text("SELECT id, nome, funcao FROM usuarios WHERE email=:e AND senha=:s AND ativo=TRUE"), {"e":e,"s":s}).fetchone()
+                    with conexao() as conn: return conn.execute(text("SELECT id, nome, funcao FROM usuarios WHERE email=:e AND senha=:s AND ativo=TRUE"), {"e":e,"s":s}).fetchone()
                 try:
                     u = verif(email, senha)
                     if u: st.session_state.usuario = {"id":u[0], "nome":u[1], "funcao":u[2]}; st.rerun()
@@ -292,6 +358,7 @@ else:
         if st.button("💬 Chat", use_container_width=True): st.session_state.pagina = "chat"; st.rerun()
         if st.session_state.usuario['funcao'] == 'admin':
             if st.button("📢 Disparos", use_container_width=True): st.session_state.pagina = "disparos"; st.rerun()
+        if st.button("🔎 Buscar Mensagens", use_container_width=True): st.session_state.pagina = "busca"; st.rerun()
         if st.button("⚡ Respostas", use_container_width=True): st.session_state.pagina = "respostas"; st.rerun()
         if st.session_state.usuario['funcao'] == 'admin':
             if st.button("⚙️ Admin", use_container_width=True): st.session_state.pagina = "admin"; st.rerun()
@@ -300,15 +367,30 @@ else:
         if st.session_state.pagina == "chat":
             st.subheader("📥 Fila")
             is_adm = st.session_state.usuario['funcao']=='admin'
+            termo = st.text_input("🔎 Buscar", placeholder="Nome, código ou telefone", key="fila_busca")
+            c_st, c_pp = st.columns([2, 1])
+            por_pagina = c_pp.selectbox("Por pág.", [20, 50, 100], key="fila_por_pagina", label_visibility="collapsed")
+            filtro = (termo, st.session_state.get("fila_status"), por_pagina)
+            if st.session_state.get("fila_filtro") != filtro: st.session_state.fila_filtro, st.session_state.fila_pagina = filtro, 0
             try:
-                df = carregar_fila(is_adm, st.session_state.usuario['id'])
-                if df.empty: st.info("Vazia")
+                pag = st.session_state.get("fila_pagina", 0)
+                df, total, contagem = pagina_da_fila(is_adm, st.session_state.usuario['id'], termo, st.session_state.get("fila_status"), pag, por_pagina)
+                opcoes = [None] + sorted(set(contagem) | {st.session_state.get("fila_status")} - {None})
+                c_st.selectbox("Status", opcoes, key="fila_status", label_visibility="collapsed",
+                               format_func=lambda s: f"Todos ({sum(contagem.values())})" if s is None else f"{ROTULOS_STATUS.get(s, s)} ({contagem.get(s, 0)})")
+                if df.empty: st.info("Nada encontrado" if termo.strip() else "Vazia")
                 for _, r in df.iterrows():
                     d = f"🟢 {r['nome']}"
                     if is_adm and r['vendedora']: d = f"🔒 {r['vendedora']} | {r['nome']}"
                     if r['codigo_cliente']: d += f" ({r['codigo_cliente']})"
                     if st.button(d, key=f"c_{r['id']}", use_container_width=True):
                         st.session_state.chat_ativo = r['id']; st.rerun()
+                paginas = max(1, -(-total // por_pagina))
+                if paginas > 1:
+                    b1, b2, b3 = st.columns([1, 2, 1])
+                    if b1.button("◀", key="fila_ant", disabled=pag == 0): st.session_state.fila_pagina = pag - 1; st.rerun()
+                    b2.caption(f"pág. {pag + 1}/{paginas} · {total}")
+                    if b3.button("▶", key="fila_prox", disabled=pag >= paginas - 1): st.session_state.fila_pagina = pag + 1; st.rerun()
             except: st.error("Erro Fila")
 
     if st.session_state.pagina == "disparos":
@@ -318,10 +400,11 @@ else:
             st.title("📢 Disparos em Massa (Variáveis)")
             c1, c2 = st.columns([2, 1])
             with c1:
-                st.subheader("1. Lista de Contatos (CSV)")
-                st.info("Cole os dados no formato: **Telefone, Var1, Var2, Var3...**")
-                st.caption("Aceita Vírgula (,), Ponto e Vírgula (;) ou TAB (copiado do Excel).")
-                raw_data = st.text_area("Dados:", height=250, placeholder="3199999999, João, Belo Horizonte\n3188888888, Maria, Contagem")
+                st.subheader("1. Lista de Contatos (CSV/XLSX)")
+                st.info("Formato: **Telefone, Var1, Var2, Var3...** (uma linha por contato)")
+                arq_lista = st.file_uploader("Arquivo", type=['csv', 'txt', 'xlsx'])
+                st.caption("Aceita Vírgula (,), Ponto e Vírgula (;) ou TAB (copiado do Excel). Para listas grandes, prefira o arquivo.")
+                raw_data = st.text_area("...ou cole os dados:", height=150, placeholder="3199999999, João, Belo Horizonte\n3188888888, Maria, Contagem", disabled=arq_lista is not None)
             with c2:
                 st.subheader("2. Configuração")
                 us = listar_usuarios_ativos()
@@ -335,52 +418,76 @@ else:
                     tpl_sel = st.selectbox("Template:", tpl_list)
                     custo_estimado = df_tpl[df_tpl['nome_tecnico']==tpl_sel]['custo_estimado'].values[0]
                     st.caption(f"Custo: R$ {custo_estimado:.2f}/envio")
+                    arq_cabecalho = st.file_uploader("Mídia do cabeçalho (se o template tiver)", type=['png', 'jpg', 'jpeg', 'mp4', 'pdf'])
                 else:
                     st.error("Sem templates.")
-                    tpl_sel = None
+                    tpl_sel = arq_cabecalho = None
 
             st.divider()
             
-            if st.button("🚀 Disparar Lote", type="primary", disabled=(tpl_sel is None or not raw_data)):
-                lines = raw_data.strip().split('\n')
-                total = len(lines)
-                if total == 0:
+            itens, pular_divergentes, esperado = [], False, 0
+            fonte = arq_lista if arq_lista is not None else raw_data.strip()
+            if fonte:
+                # Parse/validação só roda de novo quando a lista muda
+                chave = (arq_lista.name, arq_lista.size) if arq_lista is not None else hash(fonte)
+                if st.session_state.get("lista_chave") != chave:
+                    with st.spinner("Validando lista..."):
+                        st.session_state.lista_disparo = preparar_lista(fonte, arq_lista.name if arq_lista is not None else "")
+                        st.session_state.lista_chave = chave
+                itens, rel = st.session_state.lista_disparo
+                
+                st.subheader("Pré-envio")
+                m1, m2, m3, m4 = st.columns(4)
+                m1.metric("Linhas", rel['total']); m2.metric("Válidos", rel['validos'])
+                m3.metric("Inválidos", rel['invalidos']); m4.metric("Duplicados", rel['duplicados'])
+                esperado = st.number_input("Variáveis do template", min_value=0, max_value=20, value=rel['moda_vars'])
+                divergentes = sum(v for k, v in rel['contagem_vars'].items() if k != esperado)
+                if divergentes:
+                    st.warning(f"{divergentes} contato(s) com quantidade de variáveis diferente de {esperado}.")
+                    pular_divergentes = st.checkbox("Não enviar esses contatos", value=True)
+                a_enviar = rel['validos'] - (divergentes if pular_divergentes else 0)
+                if tpl_sel: st.info(f"**{a_enviar}** envios · custo estimado **R$ {a_enviar * float(custo_estimado):.2f}**")
+                if not rel['problemas'].empty:
+                    with st.expander(f"⚠️ Linhas com problema ({rel['invalidos'] + rel['duplicados']})"):
+                        st.dataframe(rel['problemas'], use_container_width=True, hide_index=True)
+            
+            if st.button("🚀 Disparar Lote", type="primary", disabled=(tpl_sel is None or not itens)):
+                if pular_divergentes: itens = [it for it in itens if len(it[1]) == esperado]
+                if not itens:
                     st.warning("Lista vazia.")
                 else:
-                    st.info(f"Processando {total} linhas...")
-                    bar = st.progress(0)
-                    sucesso = 0
-                    erro = 0
-                    
-                    for i, line in enumerate(lines):
-                        if not line.strip(): continue
-                        
-                        # Tenta detectar separador (TAB, PontoVirgula ou Virgula)
-                        parts = line.split('\t') # Excel
-                        if len(parts) == 1: parts = line.split(';') # CSV pt-BR
-                        if len(parts) == 1: parts = line.split(',') # CSV Comum
-                        
-                        raw_phone = parts[0].strip()
-                        vars_list = [p.strip() for p in parts[1:]] # Pega todas as colunas seguintes como variaveis
-                        
-                        cid = garantir_contato(raw_phone, id_vend_sel)
-                        if cid:
-                            code, resp = enviar_mensagem_api(raw_phone, "", "template", tpl_sel, variaveis=vars_list)
-                            if code in [200, 201]:
-                                sucesso += 1
-                                with engine.connect() as conn:
-                                    msg_log = f"[DISPARO: {tpl_sel}] Vars: {vars_list}"
-                                    conn.execute(text("INSERT INTO mensagens (contato_id, remetente, texto, tipo, custo) VALUES (:cid,'empresa',:t,'template',:c)"), {"cid":cid, "t":msg_log, "c":custo_estimado})
-                                    conn.execute(text("UPDATE contatos SET contexto_bot = :ctx WHERE id = :id"), {"ctx":tpl_sel, "id":cid})
-                                    conn.commit()
-                            else: erro += 1
-                        else: erro += 1
-                        
-                        bar.progress((i + 1) / total)
-                        time.sleep(0.1)
-                    
-                    st.success(f"Fim! ✅ {sucesso} Enviados | ❌ {erro} Falhas")
-                    st.balloons()
+                    cabecalho, ok_cab = None, True
+                    if arq_cabecalho is not None:
+                        # Um upload só para o lote; validade folgada porque o job pode demorar a terminar
+                        mt = "image" if "image" in arq_cabecalho.type else "video" if "video" in arq_cabecalho.type else "document"
+                        with st.spinner("Enviando mídia do cabeçalho..."):
+                            try: mid_cab = registrar_midia(arq_cabecalho, arq_cabecalho.name, arq_cabecalho.type, validade_minima_dias=7)[0]
+                            except Exception: mid_cab = None
+                        if mid_cab: cabecalho = (mt, mid_cab)
+                        else: ok_cab = False; st.error("Falha ao enviar a mídia do cabeçalho.")
+                    if ok_cab:
+                        jid = enfileirar_disparo(itens, tpl_sel, custo_estimado, id_vend_sel, st.session_state.usuario['id'], cabecalho=cabecalho)
+                        st.success(f"Job #{jid} na fila com {len(itens)} contatos. O envio segue mesmo se fechar a página.")
+            
+            st.divider()
+            st.subheader("3. Acompanhamento")
+            
+            @st.fragment(run_every=3)
+            @liberar_no_fim
+            def painel_jobs():
+                # Só lê a linha de progresso de cada job; quem envia é o worker.py
+                jobs = listar_jobs()
+                if jobs.empty: st.caption("Nenhum disparo ainda."); return
+                for _, j in jobs.iterrows():
+                    feitos = int(j['enviados'] + j['falhas'])
+                    txt = f"#{j['id']} {j['template']} · {j['status']} · ✅ {j['enviados']} | ❌ {j['falhas']} de {j['total']}"
+                    if j['status'] == 'executando' and j['taxa'] > 0: txt += f" · {j['taxa']:.1f} msg/s · ETA {formatar_eta((j['total'] - feitos) / j['taxa'])}"
+                    c1, c2 = st.columns([5, 1])
+                    with c1:
+                        st.progress(min(1.0, feitos / j['total']) if j['total'] else 1.0, text=txt)
+                    with c2:
+                        if j['status'] in ('pendente', 'executando') and st.button("⏹️ Cancelar", key=f"cj_{j['id']}"): cancelar_job(int(j['id'])); st.rerun()
+            painel_jobs()
 
     elif st.session_state.pagina == "chat":
         if "chat_ativo" in st.session_state:
@@ -405,44 +512,66 @@ else:
                     nc = st.text_input("Código/CPF", value=cli[2] if cli[2] else "")
                     nn = st.text_area("Notas", value=cli[4] if cli[4] else "")
                     if st.form_submit_button("Salvar"): atualizar_cliente_completo(st.session_state.chat_ativo, ncli, nc, nn); st.success("Salvo!"); st.rerun()
+                cid_exp = st.session_state.chat_ativo
+                st.download_button("⬇️ Exportar conversa (CSV)", lambda: exportar_conversa(cid_exp), file_name=f"conversa_{cid_exp}.csv",
+                                   mime="text/csv", on_click="ignore", key="exp_conv")
 
             st.divider()
 
-            msgs = carregar_mensagens(st.session_state.chat_ativo)
+            conv = mensagens_da_conversa(st.session_state.chat_ativo)
+            envios = envios_da_conversa(conv)
+            msgs = conv["msgs"]
+            rapido = st.toggle("⚡ Renderização rápida", value=True, key="render_rapido", help="Conversa inteira num só bloco HTML; mídias abrem na lista abaixo.")
             with st.container(height=400):
                 if msgs.empty: st.info("Início da conversa.")
-                for _, r in msgs.iterrows():
-                    cls = "chat-bubble-cliente" if r['remetente']=='cliente' else "chat-bubble-empresa"
-                    h = r['data_envio'].strftime('%H:%M')
-                    cnt = f"<span>{r['texto']}</span>" if r['texto'] and r['texto']!="None" else ""
-                    st.markdown(f"""<div class="{cls}">{cnt}<span class="chat-time">{h}</span></div>""", unsafe_allow_html=True)
-                    if r['tipo'] in ['image','audio','voice','document'] and r['url_media']:
-                        dt = get_media_bytes(r['url_media'])
-                        if dt:
+                if conv["tem_mais"] and st.button("⬆️ Mensagens anteriores", key="msgs_antigas", use_container_width=True):
+                    carregar_anteriores(conv); st.rerun()
+                if rapido and not msgs.empty:
+                    com_midia = [r for r in msgs.to_dict('records') if eh_midia(r)]
+                    previas = {str(r['url_media']): previa_midia(r['url_media'], r['tipo']) for r in com_midia}
+                    prontas = tuple(sorted(mid for mid, (mini, meta) in previas.items() if mini or meta))
+                    st.markdown(montar_html_conversa(conv["cid"], int(msgs['id'].iloc[0]), int(msgs['id'].iloc[-1]), len(msgs), prontas, msgs, previas), unsafe_allow_html=True)
+                else:
+                    for _, r in msgs.iterrows():
+                        st.markdown(html_bolha(r), unsafe_allow_html=True)
+                        if eh_midia(r):
                             cl_a, cl_b, cl_c = st.columns([1,2,1])
                             tc = cl_c if r['remetente']=='empresa' else cl_a
-                            with tc:
-                                if r['tipo']=='image': st.image(dt, width=200)
-                                elif r['tipo']=='audio': st.audio(dt)
-                                elif r['tipo']=='document': st.download_button("📄 Baixar", dt, file_name="anexo.pdf", key=f"f_{r['id']}")
+                            with tc: renderizar_midia(r)
+
+                # Bolhas dos envios em andamento: só este pedaço se atualiza até a Meta responder
+                aguardando = any(e["status"] == "pendente" for e in envios)
+                @st.fragment(run_every=1 if aguardando else None)
+                @liberar_no_fim
+                def bolhas_envio(cid, aguardando):
+                    for e in [e for e in st.session_state.get("envios", []) if e["cid"] == cid]:
+                        selo = {"pendente": " · ⏳ enviando", "enviado": " · ✓", "falha": " · ⚠️ não enviado"}[e["status"]]
+                        st.markdown(html_bolha({"remetente": "empresa", "texto": e["texto"], "data_envio": e["data_envio"]}, selo=selo), unsafe_allow_html=True)
+                        if e["status"] == "falha":
+                            f1, f2, f3 = st.columns([3, 1, 1])
+                            f1.caption(e["erro"])
+                            if e["repetir"] and f2.button("↻ Repetir", key=f"rep_{e['id']}"):
+                                st.session_state.envios.remove(e); st.session_state.envios.append(e["repetir"]()); st.rerun()
+                            if f3.button("✕", key=f"desc_{e['id']}", help="Descartar"): st.session_state.envios.remove(e); st.rerun(scope="fragment")
+                    # Tudo respondido: um rerun normal traz as mensagens gravadas pelo carregamento incremental e para o polling
+                    if aguardando and not any(e["status"] == "pendente" for e in st.session_state.get("envios", []) if e["cid"] == cid): st.rerun()
+                bolhas_envio(conv["cid"], aguardando)
+            if rapido and not msgs.empty and com_midia:
+                with st.expander(f"🗂️ Mídias da conversa ({len(com_midia)})"):
+                    for r in reversed(com_midia):
+                        st.caption(f"{'Cliente' if r['remetente']=='cliente' else 'Empresa'} · {r['data_envio'].strftime('%d/%m %H:%M')}")
+                        renderizar_midia(r)
 
             with st.expander("📎 Anexar"):
                 uploaded_file = st.file_uploader("Arquivo", type=['png', 'jpg', 'pdf', 'mp3', 'ogg', 'wav'])
                 if uploaded_file and st.button("Enviar Arq"):
-                    with st.spinner("Enviando..."):
-                        mime = uploaded_file.type
-                        tmsg = "document"
-                        if "image" in mime: tmsg = "image"
-                        elif "audio" in mime: tmsg = "audio"
-                        mid = upload_para_meta(uploaded_file, mime)
-                        if mid:
-                            c, r = enviar_mensagem_api(cli[1], mid, tipo=tmsg)
-                            if c in [200, 201]:
-                                with engine.connect() as conn:
-                                    conn.execute(text("INSERT INTO mensagens (contato_id, remetente, texto, tipo, url_media) VALUES (:cid, 'empresa', :txt, :tipo, :url)"), {"cid":st.session_state.chat_ativo, "txt":f"Arq: {uploaded_file.name}", "tipo":tmsg, "url":mid})
-                                    conn.commit()
-                                st.rerun()
-                            else: st.error(f"Erro Meta: {r}")
+                    mime = uploaded_file.type
+                    tmsg = "document"
+                    if "image" in mime: tmsg = "image"
+                    elif "audio" in mime: tmsg = "audio"
+                    # Upload + envio em segundo plano (envios.py); a bolha aparece já, como "enviando"
+                    st.session_state.setdefault("envios", []).append(enviar_arquivo(st.session_state.chat_ativo, cli[1], uploaded_file, uploaded_file.name, mime, tmsg))
+                    st.rerun()
 
             with st.expander("📢 Enviar Template"):
                 bloqueado = verificar_bloqueio_usuario(st.session_state.usuario['id'])
@@ -467,18 +596,45 @@ else:
                                 if var1: vars_to_send.append(var1)
                                 if var2: vars_to_send.append(var2)
 
-                                c,r = enviar_mensagem_api(cli[1], "", "template", tpl_sel, variaveis=vars_to_send)
-                                if c in [200,201]:
-                                    with engine.connect() as conn:
-                                        msg_txt = f"[TPL: {tpl_sel}] Vars: {vars_to_send}"
-                                        conn.execute(text("INSERT INTO mensagens (contato_id, remetente, texto, tipo, custo) VALUES (:cid,'empresa',:t,'template',:c)"), {"cid":st.session_state.chat_ativo, "t":msg_txt, "c":custo_tpl})
-                                        conn.execute(text("UPDATE contatos SET contexto_bot = :ctx WHERE id = :id"), {"ctx":tpl_sel, "id":st.session_state.chat_ativo})
-                                        conn.commit()
-                                    st.success("Enviado"); st.rerun()
-                                else: st.error(f"Erro: {r}")
+                                st.session_state.setdefault("envios", []).append(enviar_template(st.session_state.chat_ativo, cli[1], tpl_sel, vars_to_send, float(custo_tpl)))
+                                st.rerun()
                     else: st.warning("Sem templates.")
         else: st.info("👈 Selecione um cliente.")
 
+    elif st.session_state.pagina == "busca":
+        st.header("🔎 Buscar Mensagens")
+        st.caption('Busca por palavras no histórico, incluindo plural e flexões ("pedido" acha "pedidos"). Use "frase exata", -excluir e OR.')
+        with st.form("fbusca"):
+            b1, b2 = st.columns([4, 1])
+            consulta = b1.text_input("Buscar", value=st.session_state.get("busca_termo", ""), placeholder='ex.: pedido 4512 OR "nota fiscal"')
+            periodo = b2.selectbox("Período", [None, 7, 30, 90, 365], format_func=lambda d: "Tudo" if d is None else f"{d} dias")
+            if st.form_submit_button("Buscar"): st.session_state.busca_termo, st.session_state.busca_dias, st.session_state.busca_pagina = consulta, periodo, 0
+        termo = st.session_state.get("busca_termo", "")
+        if termo.strip():
+            pag = st.session_state.get("busca_pagina", 0)
+            try:
+                hits, total = buscar_mensagens(termo, st.session_state.usuario['funcao'] == 'admin', st.session_state.usuario['id'],
+                                               st.session_state.get("busca_dias"), pag, 20)
+                st.caption(f"{total}{'+' if total >= 1000 else ''} mensagens encontradas")
+                if hits.empty: st.info("Nada encontrado.")
+                for _, h in hits.iterrows():
+                    with st.container(border=True):
+                        t1, t2 = st.columns([5, 1])
+                        quem = "🧑 Cliente" if h['remetente'] == 'cliente' else "🏢 Empresa"
+                        t1.markdown(f"**{html.escape(str(h['nome'] or h['whatsapp_id']))}** · {quem} · {h['data_envio']:%d/%m/%Y %H:%M}")
+                        trecho = html.escape(h['trecho']).replace("[[[", "<mark>").replace("]]]", "</mark>")
+                        t1.markdown(trecho, unsafe_allow_html=True)
+                        if t2.button("Abrir", key=f"bh_{h['id']}"):
+                            st.session_state.chat_ativo = int(h['contato_id']); st.session_state.pagina = "chat"; st.rerun()
+                paginas = max(1, -(-min(total, 1000) // 20))
+                if paginas > 1:
+                    n1, n2, n3 = st.columns([1, 2, 1])
+                    if n1.button("◀ Anteriores", disabled=pag == 0): st.session_state.busca_pagina = pag - 1; st.rerun()
+                    n2.caption(f"pág. {pag + 1}/{paginas}")
+                    if n3.button("Próximas ▶", disabled=pag >= paginas - 1): st.session_state.busca_pagina = pag + 1; st.rerun()
+            except Exception as e: st.error(f"Erro na busca: {e}")
+        if st.button("Voltar"): st.session_state.pagina="chat"; st.rerun()
+
     elif st.session_state.pagina == "respostas":
         st.header("⚡ Gerenciar Respostas")
         with st.form("nrr"):
@@ -493,7 +649,7 @@ else:
 
     elif st.session_state.pagina == "admin":
         st.header("⚙️ Admin")
-        tab1, tab2, tab3, tab4, tab5 = st.tabs(["➕ Usuários", "📝 Editar", "🤖 Config Robô", "📢 Templates", "💰 Custos"])
+        tab1, tab2, tab3, tab4, tab5, tab6, tab7, tab8, tab9 = st.tabs(["➕ Usuários", "📝 Editar", "🤖 Config Robô", "📢 Templates", "💰 Custos", "🔌 Conexões", "🩺 Banco", "📤 Exportar", "⏱️ Performance"])
         
         with tab1:
             with st.form("nu"):
@@ -529,13 +685,12 @@ else:
         with tab3:
             st.subheader("🤖 Mensagens Automáticas")
             with st.expander("🛠️ Reparar Banco (Use se der erro)"):
-                if st.button("Forçar Criação Tabela 'bot_regras'"):
+                st.caption("Aplica as migrações pendentes (tabelas, colunas e índices). Detalhes na aba 🩺 Banco.")
+                if st.button("Aplicar Migrações"):
                     try:
-                        with engine.connect() as conn:
-                            conn.execute(text("CREATE TABLE IF NOT EXISTS bot_regras (id SERIAL PRIMARY KEY, template_gatilho TEXT UNIQUE, resposta_texto TEXT);"))
-                            conn.execute(text("ALTER TABLE contatos ADD COLUMN IF NOT EXISTS contexto_bot TEXT;"))
-                            conn.commit()
-                        st.success("Tabela criada!"); time.sleep(2); st.rerun()
+                        feitas = aplicar_migracoes()
+                        invalidar("bot_regras")
+                        st.success(f"{len(feitas)} migração(ões) aplicada(s)." if feitas else "Banco já está em dia."); time.sleep(2); st.rerun()
                     except Exception as e: st.error(f"Erro: {e}")
 
             msg = pegar_msg_boas_vindas()
@@ -591,8 +746,118 @@ else:
             dias = st.slider("Dias", 1, 90, 30)
             df_fin = gerar_relatorio_custos(dias)
             if not df_fin.empty:
+                st.metric("Total no período", f"R$ {df_fin['custo_total'].sum():.2f}", f"{int(df_fin['qtd_mensagens'].sum())} mensagens", delta_color="off")
                 st.dataframe(df_fin.style.format({"custo_total": "R$ {:.2f}"}), use_container_width=True)
                 st.bar_chart(df_fin, x="vendedora", y="custo_total")
+                cc1, cc2 = st.columns(2)
+                with cc1:
+                    st.caption("Por template")
+                    df_tp = custos_por_template(dias)
+                    st.dataframe(df_tp.style.format({"custo_total": "R$ {:.2f}"}), use_container_width=True, hide_index=True)
+                with cc2:
+                    st.caption("Por dia")
+                    st.line_chart(custos_por_dia(dias), x="dia", y="custo_total")
             else: st.info("Sem custos.")
+            if st.button("🔄 Recalcular últimos dias", help="Refaz o resumo diário a partir das mensagens (útil após correções manuais de custo)"):
+                st.toast(f"{reconciliar(dias)} linhas recalculadas")
+
+        with tab6:
+            st.subheader("🔌 Pool de Conexões (este processo)")
+            tp = telemetria.resumo()
+            m1, m2, m3, m4 = st.columns(4)
+            m1.metric("Em uso", f"{tp['em_uso']}/{tp['tamanho']}", f"+{tp['overflow']} overflow" if tp['overflow'] > 0 else None)
+            m2.metric("Checkouts", tp['checkouts'])
+            m3.metric("Espera média", f"{tp['espera_media_ms']} ms", f"máx {tp['espera_max_ms']} ms", delta_color="off")
+            m4.metric("Conexões novas/min", tp['conexoes_abertas_por_min'])
+            st.dataframe(pd.DataFrame([tp]).T.rename(columns={0: "valor"}), use_container_width=True)
+            st.caption(f"Cache compartilhado: **{backend_cache.nome}** · fila atualizada há {int(time.time() - fila_compartilhada().atualizado_em)}s")
+
+        with tab7:
+            st.subheader("🩺 Saúde do Banco")
+            try:
+                pend = pendentes()
+                if pend: st.warning("Migrações pendentes: " + ", ".join(f"{v} ({n})" for v, n in pend))
+                else: st.success("Schema em dia.")
+                if st.button("Aplicar migrações pendentes", disabled=not pend):
+                    with st.spinner("Criando índices (CONCURRENTLY, sem travar o chat)..."): feitas = aplicar_migracoes()
+                    st.toast(f"{len(feitas)} aplicada(s)"); st.rerun()
+                st.caption("Índices das consultas quentes")
+                df_idx = verificar_indices()
+                st.dataframe(df_idx, use_container_width=True, hide_index=True)
+                if (df_idx['status'] != 'ok').any() and st.button("Refazer índices ausentes/inválidos"):
+                    with st.spinner("Refazendo..."): reparar_indices()
+                    st.rerun()
+                st.caption("Planos de execução (EXPLAIN)")
+                analisar = st.checkbox("Medir tempo real (EXPLAIN ANALYZE)", value=False)
+                df_pl = checar_planos(analisar)
+                st.dataframe(df_pl, use_container_width=True, hide_index=True)
+                if (df_pl['status'] != 'ok').any(): st.error("Há consultas com Seq Scan em tabela grande ou custo acima da referência.")
+                if st.button("Salvar custos atuais como referência"): salvar_referencia(df_pl); st.toast("Referência salva")
+                st.caption("Arquivo de conversas encerradas (Parquet)")
+                try:
+                    ac, am, aa = resumo_arquivo()
+                    a1, a2, a3 = st.columns(3)
+                    a1.metric("Contatos arquivados", ac); a2.metric("Mensagens arquivadas", am); a3.metric("Arquivos", aa)
+                    if st.button("Arquivar agora", help="Move para Parquet as conversas encerradas sem mensagens recentes"):
+                        with st.spinner("Arquivando..."):
+                            if particionada(): garantir_particoes()
+                            st.toast(f"{arquivar()} mensagens arquivadas")
+                except Exception: st.info("Arquivo ainda não configurado (aplique as migrações).")
+            except Exception as e: st.error(f"Erro: {e}")
+
+        with tab8:
+            st.subheader("📤 Exportar")
+            st.caption(f"O arquivo é gerado só ao clicar. Limite de {EXPORTAR_MAX_MB} MB por arquivo: para mais que isso, reduza o período.")
+            e1, e2, e3 = st.columns([2, 1, 1])
+            tipos_exp = {"Mensagens": "mensagens", "Fila (agora)": "fila", "Contatos": "contatos", "Custos diários": "custos"}
+            o_exp = e1.selectbox("O quê", list(tipos_exp))
+            formato = e2.radio("Formato", ["csv", "parquet"], horizontal=True)
+            dias_exp = e3.number_input("Últimos dias", 1, 3650, 30, disabled=tipos_exp[o_exp] in ("fila", "contatos"))
+            geradores = {
+                "mensagens": lambda: exportar_mensagens(dias_exp, formato), "fila": lambda: exportar_fila(formato),
+                "contatos": lambda: exportar_contatos(formato), "custos": lambda: exportar_custos(dias_exp, formato),
+            }
+            if tipos_exp[o_exp] == "mensagens": st.caption("Conversas já arquivadas ficam de fora (estão em Parquet na pasta do arquivo).")
+            st.download_button(f"⬇️ Baixar {o_exp}", geradores[tipos_exp[o_exp]], file_name=f"{tipos_exp[o_exp]}_{datetime.now():%Y%m%d_%H%M}.{formato}",
+                               mime="text/csv" if formato == "csv" else "application/vnd.apache.parquet", on_click="ignore", type="primary")
+
+        with tab9:
+            st.subheader("⏱️ Performance (este processo)")
+            reruns = metricas.ultimos_reruns()
+            df_pg = pd.DataFrame(metricas.tabela("rerun"))
+            if reruns:
+                df_rr = pd.DataFrame(reruns)
+                p1, p2, p3, p4 = st.columns(4)
+                p1.metric("Reruns medidos", int(df_pg['n'].sum()))
+                p2.metric("Rerun p95", f"{df_rr['total_ms'].quantile(0.95):.0f} ms", f"mediana {df_rr['total_ms'].median():.0f} ms", delta_color="off")
+                p3.metric("SQL por rerun", f"{df_rr['sql_ms'].mean():.0f} ms", f"{df_rr['sql_n'].mean():.1f} consultas", delta_color="off")
+                p4.metric("Graph por rerun", f"{df_rr['graph_ms'].mean():.0f} ms", f"{df_rr['graph_n'].mean():.1f} chamadas", delta_color="off")
+                st.caption("Por página")
+                st.dataframe(df_pg, use_container_width=True, hide_index=True)
+                st.caption("Últimos reruns: onde foi o tempo (helpers incluem o SQL/Graph que disparam)")
+                st.bar_chart(df_rr.tail(40).reset_index(), x="index", y=["helpers_ms", "interface_ms"], stack=True)
+                st.dataframe(df_rr.iloc[::-1], use_container_width=True, hide_index=True)
+            else: st.info("Nenhum rerun medido ainda.")
+            g1, g2 = st.columns(2)
+            with g1:
+                st.caption("Helpers do app")
+                st.dataframe(pd.DataFrame(metricas.tabela("helper")), use_container_width=True, hide_index=True)
+                st.caption("SQL por helper")
+                st.dataframe(pd.DataFrame(metricas.tabela("sql")), use_container_width=True, hide_index=True)
+            with g2:
+                st.caption("Graph API por endpoint")
+                st.dataframe(pd.DataFrame(metricas.tabela("graph")), use_container_width=True, hide_index=True)
+                st.caption("Consultas que mais somam tempo")
+                st.dataframe(pd.DataFrame(metricas.top_consultas()), use_container_width=True, hide_index=True)
+            st.caption("Log de lentidão · limites: " + ", ".join(f"{k} ≥ {v:.0f} ms" for k, v in LIMITES_MS.items()))
+            lentos = metricas.ultimos_lentos()
+            if lentos: st.dataframe(pd.DataFrame(lentos), use_container_width=True, hide_index=True)
+            else: st.success("Nada acima dos limites.")
+            b1, b2 = st.columns(2)
+            b1.download_button("⬇️ Métricas (Prometheus)", metricas.texto_prometheus, file_name="semprechat.prom", mime="text/plain", on_click="ignore")
+            if b2.button("Zerar métricas"): metricas.zerar(); st.rerun()
 
         if st.button("Voltar"): st.session_state.pagina="chat"; st.rerun()
+
+metricas.finalizar_rerun()
+finalizar_rerun()
@@ -0,0 +1,129 @@
+# Partições mensais de mensagens e arquivamento das conversas encerradas em Parquet.
+#   python arquivo.py             (cria partições à frente e arquiva o que estiver vencido)
+import datetime as dt
+import functools
+import logging
+import os
+import sys
+import pandas as pd
+from sqlalchemy import text
+from banco import segredo, conexao
+
+# Pasta local; com réplicas em máquinas diferentes precisa ser um volume compartilhado
+PASTA = str(segredo("MSG_ARCHIVE_DIR", os.path.join(os.path.expanduser("~"), ".local", "share", "semprechat", "arquivo")))
+DIAS_ARQUIVAR = int(segredo("MSG_ARCHIVE_DAYS", 90))  # encerradas sem mensagem há mais que isso
+CONTATOS_POR_ARQUIVO = 500
+MESES_A_FRENTE = 2
+PADRAO = "mensagens_padrao"
+COLUNAS = ["id", "contato_id", "remetente", "texto", "tipo", "url_media", "data_envio", "custo"]
+
+
+def inicio_mes(d, n=0):
+    m = d.year * 12 + d.month - 1 + n
+    return dt.date(m // 12, m % 12 + 1, 1)
+
+def particionada():
+    with conexao() as conn:
+        return bool(conn.execute(text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('mensagens')")).fetchone())
+
+def garantir_particoes(meses=MESES_A_FRENTE):
+    # Partição do mês corrente e dos próximos `meses`; a primeira depois da legada começa onde ela termina.
+    # A DEFAULT segura os INSERTs se o worker ficar parado e o mês virar sem partição; o que cair nela
+    # vai para a partição do mês quando esta for criada.
+    criadas = []
+    with conexao() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {PADRAO} PARTITION OF mensagens DEFAULT"))
+        conn.commit()
+        limite = conn.execute(text("""
+            SELECT MAX(substring(pg_get_expr(c.relpartbound, c.oid) from 'TO \\(''([0-9-]+)')::date)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = to_regclass('mensagens')
+        """)).scalar()
+        alvo = inicio_mes(dt.date.today(), meses + 1)
+        while limite and limite < alvo:
+            fim = inicio_mes(limite, 1)
+            nome = f"mensagens_p{limite:%Y_%m}"
+            faixa = {"a": limite, "b": fim}
+            criar = text(f"CREATE TABLE IF NOT EXISTS {nome} PARTITION OF mensagens FOR VALUES FROM ('{limite}') TO ('{fim}')")
+            if conn.execute(text(f"SELECT 1 FROM {PADRAO} WHERE data_envio >= :a AND data_envio < :b LIMIT 1"), faixa).fetchone():
+                # Direto na partição: o trigger de custos (por comando, no pai) não soma de novo
+                logging.warning("arquivo: movendo mensagens de %s da partição padrão para %s", limite, nome)
+                conn.execute(text(f"CREATE TEMP TABLE mover_particao ON COMMIT DROP AS SELECT * FROM {PADRAO} WHERE data_envio >= :a AND data_envio < :b"), faixa)
+                conn.execute(text(f"DELETE FROM {PADRAO} WHERE data_envio >= :a AND data_envio < :b"), faixa)
+                conn.execute(criar)
+                conn.execute(text(f"INSERT INTO {nome} SELECT * FROM mover_particao"))
+            else: conn.execute(criar)
+            conn.commit()
+            criadas.append(nome)
+            limite = fim
+    return criadas
+
+
+# --- ARQUIVAMENTO ---
+def arquivar(dias=DIAS_ARQUIVAR, contatos_por_arquivo=CONTATOS_POR_ARQUIVO, max_lotes=None):
+    # Um Parquet (zstd) por lote de contatos; o índice arquivo_mensagens diz onde está cada contato.
+    # Ordem: grava o arquivo, depois índice + DELETE numa transação; queda no meio só deixa arquivo órfão.
+    os.makedirs(PASTA, exist_ok=True)
+    total, lotes = 0, 0
+    while max_lotes is None or lotes < max_lotes:
+        lotes += 1
+        with conexao() as conn:
+            ids = [r[0] for r in conn.execute(text("""
+                SELECT c.id FROM contatos c
+                WHERE c.status_atendimento = 'encerrado'
+                  AND EXISTS (SELECT 1 FROM mensagens m WHERE m.contato_id = c.id)
+                  AND NOT EXISTS (SELECT 1 FROM mensagens m WHERE m.contato_id = c.id AND m.data_envio >= NOW() - make_interval(days => :d))
+                ORDER BY c.id LIMIT :n
+            """), {"d": dias, "n": contatos_por_arquivo})]
+            if not ids: break
+            df = pd.read_sql(text(f"SELECT {', '.join(COLUNAS)} FROM mensagens WHERE contato_id = ANY(:ids) ORDER BY contato_id, data_envio, id"),
+                             conn, params={"ids": ids})
+        caminho = os.path.join(PASTA, f"{dt.datetime.now():%Y%m}", f"msgs_{ids[0]}_{ids[-1]}_{dt.datetime.now():%Y%m%d%H%M%S%f}.parquet")
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        df.to_parquet(caminho + ".tmp", engine="pyarrow", compression="zstd", index=False, row_group_size=20_000)
+        os.replace(caminho + ".tmp", caminho)
+        resumo = df.groupby("contato_id").agg(qtd=("id", "size"), primeira=("data_envio", "min"), ultima=("data_envio", "max")).reset_index()
+        try:
+            with conexao() as conn:
+                conn.execute(text("INSERT INTO arquivo_mensagens (contato_id, caminho, qtd, primeira, ultima) VALUES (:c, :p, :q, :a, :b)"),
+                             [{"c": int(r.contato_id), "p": os.path.relpath(caminho, PASTA), "q": int(r.qtd), "a": r.primeira, "b": r.ultima} for r in resumo.itertuples()])
+                conn.execute(text("DELETE FROM mensagens WHERE id = ANY(:ids) AND contato_id = ANY(:cids)"), {"ids": df["id"].tolist(), "cids": ids})
+                conn.commit()
+        except Exception:
+            os.remove(caminho)
+            raise
+        total += len(df)
+        logging.info("arquivo: %d mensagens de %d contatos em %s", len(df), len(ids), caminho)
+    return total
+
+@functools.lru_cache(maxsize=128)
+def _ler(caminho, contato_id):
+    return pd.read_parquet(os.path.join(PASTA, caminho), engine="pyarrow", filters=[("contato_id", "==", contato_id)])
+
+def mensagens_arquivadas(contato_id, antes=None, limite=None):
+    # Mensagens arquivadas do contato, em ordem cronológica; `antes` = (data_envio, id) como no keyset do chat
+    with conexao() as conn:
+        # Antes da migração 11 não há arquivo (nem tabela): conversa só com o que está no banco
+        if not conn.execute(text("SELECT to_regclass('arquivo_mensagens')")).scalar(): return pd.DataFrame(columns=COLUNAS)
+        caminhos = [r[0] for r in conn.execute(text("SELECT caminho FROM arquivo_mensagens WHERE contato_id = :c ORDER BY primeira"), {"c": int(contato_id)})]
+    if not caminhos: return pd.DataFrame(columns=COLUNAS)
+    partes = []
+    for p in caminhos:
+        try: partes.append(_ler(p, int(contato_id)))
+        except Exception: logging.exception("arquivo: não consegui ler %s (pasta %s)", p, PASTA)
+    if not partes: return pd.DataFrame(columns=COLUNAS)
+    df = pd.concat(partes, ignore_index=True).sort_values(["data_envio", "id"])
+    if antes is not None:
+        d, i = pd.Timestamp(antes[0]), int(antes[1])
+        df = df[(df["data_envio"] < d) | ((df["data_envio"] == d) & (df["id"] < i))]
+    if limite: df = df.tail(limite)
+    return df.reset_index(drop=True)
+
+def resumo_arquivo():
+    with conexao() as conn:
+        return conn.execute(text("SELECT COUNT(DISTINCT contato_id), COALESCE(SUM(qtd), 0), COUNT(DISTINCT caminho) FROM arquivo_mensagens")).fetchone()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if particionada(): print("partições criadas:", garantir_particoes())
+    print("mensagens arquivadas:", arquivar(int(sys.argv[1]) if len(sys.argv) > 1 else DIAS_ARQUIVAR))
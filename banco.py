@@ -0,0 +1,142 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+import streamlit as st
+from sqlalchemy import create_engine, event
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+
+def segredo(chave, padrao=None):
+    # Secrets do Streamlit primeiro; fora do `streamlit run` (worker, scripts) cai para variáveis de ambiente
+    try:
+        if chave in st.secrets: return st.secrets[chave]
+    except Exception: pass
+    return os.environ.get(chave, padrao)
+
+
+# Módulo importado uma vez por processo: o engine (e o pool) não é recriado a cada rerun do app.py
+db_url = segredo("DATABASE_URL")
+if not db_url: raise RuntimeError("⚠️ Configure DATABASE_URL nos Secrets.")
+engine = create_engine(
+    db_url.replace("postgres://", "postgresql://"),
+    pool_size=int(segredo("DB_POOL_SIZE", 10)),
+    max_overflow=int(segredo("DB_MAX_OVERFLOW", 20)),
+    pool_timeout=float(segredo("DB_POOL_TIMEOUT", 10)),
+    pool_recycle=int(segredo("DB_POOL_RECYCLE", 1800)),
+    pool_pre_ping=True,
+    connect_args={
+        "connect_timeout": int(segredo("DB_CONNECT_TIMEOUT", 10)),
+        "application_name": str(segredo("DB_APP_NAME", "semprechat")),
+        "options": f"-c statement_timeout={int(segredo('DB_STATEMENT_TIMEOUT_MS', 30000))}",
+    },
+)
+
+
+# --- TELEMETRIA DO POOL ---
+class TelemetriaPool:
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.contadores = {"conexoes_abertas": 0, "conexoes_fechadas": 0, "invalidadas": 0, "checkouts": 0, "checkins": 0}
+        self.espera_total = 0.0
+        self.espera_max = 0.0
+        self.esperas = 0
+        self.inicio = time.time()
+
+    def contar(self, nome):
+        with self.trava: self.contadores[nome] += 1
+
+    def registrar_espera(self, segundos):
+        with self.trava:
+            self.esperas += 1
+            self.espera_total += segundos
+            self.espera_max = max(self.espera_max, segundos)
+
+    def resumo(self):
+        pool = engine.pool
+        with self.trava:
+            minutos = max((time.time() - self.inicio) / 60, 1e-6)
+            return {
+                **self.contadores,
+                "em_uso": pool.checkedout(), "ociosas": pool.checkedin(), "overflow": pool.overflow(), "tamanho": pool.size(),
+                "espera_media_ms": round(1000 * self.espera_total / self.esperas, 2) if self.esperas else 0.0,
+                "espera_max_ms": round(1000 * self.espera_max, 2),
+                "conexoes_abertas_por_min": round(self.contadores["conexoes_abertas"] / minutos, 2),
+            }
+
+telemetria = TelemetriaPool()
+event.listen(engine, "connect", lambda *a: telemetria.contar("conexoes_abertas"))
+event.listen(engine, "close", lambda *a: telemetria.contar("conexoes_fechadas"))
+event.listen(engine, "invalidate", lambda *a: telemetria.contar("invalidadas"))
+event.listen(engine, "checkout", lambda *a: telemetria.contar("checkouts"))
+event.listen(engine, "checkin", lambda *a: telemetria.contar("checkins"))
+
+
+# --- CONEXÃO POR RERUN ---
+# Dentro de um rerun do Streamlit, todos os helpers reaproveitam a mesma conexão da sessão;
+# fora dele (worker, threads de fundo) cada uso pega e devolve uma conexão do pool.
+_por_sessao = {}
+_por_sessao_trava = threading.Lock()
+OCIOSA_MAX = 300
+
+def _sessao_atual():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx else None
+
+def _conectar():
+    inicio = time.perf_counter()
+    conn = engine.connect()
+    telemetria.registrar_espera(time.perf_counter() - inicio)
+    return conn
+
+def _fechar(conn):
+    try: conn.close()
+    except Exception: pass
+
+def iniciar_rerun():
+    # Chamado no topo do app.py: devolve ao pool o que sobrou do rerun anterior (st.stop, exceção)
+    # e de sessões que ficaram ociosas.
+    sid, agora, velhas = _sessao_atual(), time.time(), []
+    with _por_sessao_trava:
+        for k, (conn, uso) in list(_por_sessao.items()):
+            if k == sid or agora - uso > OCIOSA_MAX: velhas.append(_por_sessao.pop(k)[0])
+    for conn in velhas: _fechar(conn)
+
+def finalizar_rerun():
+    with _por_sessao_trava: item = _por_sessao.pop(_sessao_atual(), None)
+    if item: _fechar(item[0])
+
+def liberar_no_fim(fragmento):
+    # Para funções com @st.fragment: o rerun só do fragmento (run_every, botão dentro dele) não passa pelo
+    # finalizar_rerun do fim do app.py, então devolve a conexão aqui. Dentro do rerun completo não mexe.
+    @wraps(fragmento)
+    def rodar(*args, **kwargs):
+        try: return fragmento(*args, **kwargs)
+        finally:
+            ctx = get_script_run_ctx(suppress_warning=True)
+            if ctx and ctx.fragment_ids_this_run: finalizar_rerun()
+    return rodar
+
+@contextmanager
+def conexao():
+    sid = _sessao_atual()
+    if sid is None:
+        with _conectar() as conn: yield conn
+        return
+    with _por_sessao_trava:
+        item = _por_sessao.get(sid)
+        if item: _por_sessao[sid] = (item[0], time.time())
+    if item is None:
+        conn = _conectar()
+        with _por_sessao_trava: _por_sessao[sid] = (conn, time.time())
+    else: conn = item[0]
+    try: yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # Não deixa transação aberta entre um helper e outro (helpers de leitura não fazem commit)
+        if conn.in_transaction():
+            try: conn.commit()
+            except Exception: conn.rollback()
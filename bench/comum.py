@@ -0,0 +1,36 @@
+# Preparação comum dos scripts de benchmark: aponta o app para o banco de benchmark ANTES de importar
+# qualquer módulo do repositório (banco.py cria o engine no import) e junta as estatísticas.
+import os
+import subprocess
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if RAIZ not in sys.path: sys.path.insert(0, RAIZ)
+
+
+def preparar_ambiente(graph_url=None):
+    # Só roda contra BENCH_DATABASE_URL: o seeder apaga tabelas, nunca deve pegar o DATABASE_URL de produção por engano
+    url = os.environ.get("BENCH_DATABASE_URL")
+    if not url: sys.exit("Defina BENCH_DATABASE_URL (banco descartável, ex.: postgresql://postgres@127.0.0.1:5432/semprechat_bench)")
+    os.environ["DATABASE_URL"] = url
+    os.environ.setdefault("DB_APP_NAME", "semprechat-bench")
+    os.environ.setdefault("DB_STATEMENT_TIMEOUT_MS", "0")
+    if graph_url:
+        os.environ.update(META_GRAPH_URL=graph_url, META_TOKEN="bench", META_PHONE_ID="100000000000000")
+
+
+def resumo(segundos):
+    # Lista de durações (s) -> estatísticas em ms
+    v = sorted(segundos)
+    if not v: return {"n": 0}
+    q = lambda p: round(1000 * v[min(len(v) - 1, int(p * len(v)))], 2)
+    return {"n": len(v), "media_ms": round(1000 * sum(v) / len(v), 2), "p50_ms": q(0.5), "p95_ms": q(0.95),
+            "p99_ms": q(0.99), "min_ms": round(1000 * v[0], 2), "max_ms": round(1000 * v[-1], 2)}
+
+
+def commit_atual():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ, capture_output=True, text=True).stdout.strip()
+        sujo = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=RAIZ, capture_output=True, text=True).stdout.strip())
+        return rev or "desconhecido", sujo
+    except Exception: return "desconhecido", False
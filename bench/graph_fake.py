@@ -0,0 +1,127 @@
+# Graph API de mentira para o benchmark: /{phone}/messages, /{phone}/media, /{media_id} e o download da mídia,
+# com latência, erros 5xx e limites (429 / código 130429) configuráveis.
+#   python bench/graph_fake.py --porta 8765 --latencia 80 --jitter 40 --erro 0.01 --limite 0.02
+# No app: META_GRAPH_URL=http://127.0.0.1:8765/v18.0
+import argparse
+import io
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _imagem(lado=640):
+    # JPEG de verdade para a miniatura ter o que decodificar; sem Pillow vai qualquer coisa
+    try:
+        from PIL import Image
+        buf = io.BytesIO(); Image.new("RGB", (lado, lado), (90, 140, 200)).save(buf, "JPEG", quality=85)
+        return buf.getvalue()
+    except Exception: return b"\xff\xd8" + b"0" * 50_000
+
+
+class GraphFake:
+    def __init__(self, porta=0, latencia_ms=50, jitter_ms=20, erro=0.0, limite=0.0, latencia_download_ms=None, semente=None):
+        self.latencia_ms, self.jitter_ms = latencia_ms, jitter_ms
+        self.latencia_download_ms = latencia_ms if latencia_download_ms is None else latencia_download_ms
+        self.erro, self.limite = erro, limite
+        self.aleatorio = random.Random(semente)
+        self.trava = threading.Lock()
+        self.contadores = {}
+        self.imagem = _imagem()
+        self.servidor = ThreadingHTTPServer(("127.0.0.1", porta), self._handler())
+        self.servidor.daemon_threads = True
+        self.porta = self.servidor.server_address[1]
+
+    @property
+    def url(self): return f"http://127.0.0.1:{self.porta}/v18.0"
+
+    def contar(self, nome):
+        with self.trava: self.contadores[nome] = self.contadores.get(nome, 0) + 1
+
+    def zerar(self):
+        with self.trava: self.contadores = {}
+
+    def resumo(self):
+        with self.trava: return dict(self.contadores)
+
+    def _sortear(self):
+        with self.trava:
+            atraso = max(0.0, self.aleatorio.gauss(self.latencia_ms, self.jitter_ms)) / 1000
+            r = self.aleatorio.random()
+        return atraso, "limite" if r < self.limite else "erro" if r < self.limite + self.erro else "ok"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive, como a Graph de verdade
+            def log_message(self, *a): pass
+
+            def _json(self, dados, status=200):
+                corpo = json.dumps(dados).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers(); self.wfile.write(corpo)
+
+            def _falhar(self, resultado, endpoint):
+                fake.contar(f"{endpoint}_{resultado}")
+                if resultado == "limite":
+                    self._json({"error": {"message": "(#130429) Rate limit hit", "code": 130429}}, 400)
+                else: self._json({"error": {"message": "Service temporarily unavailable", "code": 2}}, 503)
+
+            def do_POST(self):
+                n = int(self.headers.get("Content-Length") or 0)
+                restante = n
+                while restante > 0: restante -= len(self.rfile.read(min(restante, 1 << 16)))  # upload em streaming
+                atraso, resultado = fake._sortear()
+                endpoint = "media" if self.path.rstrip("/").endswith("/media") else "messages"
+                time.sleep(atraso)
+                if resultado != "ok": return self._falhar(resultado, endpoint)
+                fake.contar(f"{endpoint}_ok")
+                if endpoint == "media": return self._json({"id": f"bench{uuid.uuid4().hex[:16]}"})
+                self._json({"messaging_product": "whatsapp", "messages": [{"id": f"wamid.{uuid.uuid4().hex}"}]})
+
+            def do_GET(self):
+                partes = self.path.split("?")[0].strip("/").split("/")
+                if partes[0] == "dl":
+                    time.sleep(fake.latencia_download_ms / 1000)
+                    fake.contar("download_ok")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/jpeg")
+                    self.send_header("Content-Length", str(len(fake.imagem)))
+                    self.end_headers(); self.wfile.write(fake.imagem)
+                    return
+                atraso, resultado = fake._sortear()
+                time.sleep(atraso)
+                if resultado == "erro": return self._falhar(resultado, "media_info")
+                fake.contar("media_info_ok")
+                mid = partes[-1]
+                self._json({"url": f"http://127.0.0.1:{fake.porta}/dl/{mid}", "mime_type": "image/jpeg",
+                            "file_size": len(fake.imagem), "id": mid, "messaging_product": "whatsapp"})
+
+        return Handler
+
+    def iniciar(self):
+        threading.Thread(target=self.servidor.serve_forever, daemon=True, name="graph-fake").start()
+        return self
+
+    def parar(self):
+        self.servidor.shutdown(); self.servidor.server_close()
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Graph API de mentira")
+    ap.add_argument("--porta", type=int, default=8765)
+    ap.add_argument("--latencia", type=float, default=50, help="ms, média")
+    ap.add_argument("--jitter", type=float, default=20, help="ms, desvio padrão")
+    ap.add_argument("--erro", type=float, default=0.0, help="fração de respostas 503")
+    ap.add_argument("--limite", type=float, default=0.0, help="fração de respostas de limite (130429)")
+    a = ap.parse_args()
+    g = GraphFake(a.porta, a.latencia, a.jitter, a.erro, a.limite).iniciar()
+    print(f"Graph fake em {g.url} (Ctrl+C para sair)")
+    try:
+        while True: time.sleep(60); print(g.resumo())
+    except KeyboardInterrupt: g.parar()
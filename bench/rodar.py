@@ -0,0 +1,234 @@
+# Cenários de benchmark contra o banco semeado (bench/semear.py) e a Graph fake (bench/graph_fake.py).
+#   BENCH_DATABASE_URL=postgresql://... python bench/rodar.py                      (todos os cenários)
+#   python bench/rodar.py --cenarios fila,custos --latencia 120 --limite 0.02
+#   python bench/rodar.py --comparar bench/resultados/A.json bench/resultados/B.json
+# Cada execução grava bench/resultados/<data>-<commit>.json para comparar entre commits.
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import warnings
+from datetime import datetime
+from comum import RAIZ, preparar_ambiente, resumo, commit_atual
+from graph_fake import GraphFake
+
+CENARIOS = ("disparo", "fila", "chat", "custos")
+PREFIXO_DISPARO = "5598"  # contatos criados pelo cenário de disparo, apagados no fim
+
+
+def medir(fn, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        t = time.perf_counter(); fn(); tempos.append(time.perf_counter() - t)
+    return resumo(tempos)
+
+
+# --- DISPARO ---
+# Caminho do "🚀 Disparar Lote": preparar_lista -> enfileirar_disparo -> worker (reivindicar_job + executar_job)
+def cenario_disparo(graph, itens=2000, workers=(4, 8, 16), taxa=1000):
+    from sqlalchemy import text
+    from banco import conexao
+    from disparo import preparar_lista, enfileirar_disparo, reivindicar_job, executar_job
+    from custos import reconciliar
+    csv = "\n".join(f"{PREFIXO_DISPARO}{i:09d};Cliente {i};Cidade {i % 50}" for i in range(itens))
+    with conexao() as conn:
+        # Job pendente de outra rodada passaria na frente do nosso no reivindicar_job
+        conn.execute(text("UPDATE disparo_jobs SET status='cancelado' WHERE status IN ('pendente','executando')"))
+        conn.commit()
+    resultados = []
+    for w in workers:
+        t = time.perf_counter(); lista, _ = preparar_lista(csv); preparar = time.perf_counter() - t
+        t = time.perf_counter(); jid = enfileirar_disparo(lista, "promo_mensal", 0.35, 2, 1); enfileirar = time.perf_counter() - t
+        job = reivindicar_job("bench")
+        graph.zerar()
+        t = time.perf_counter(); executar_job(job, "bench", taxa_meta=taxa, workers=w); executar = time.perf_counter() - t
+        with conexao() as conn:
+            enviados, falhas = conn.execute(text("SELECT enviados, falhas FROM disparo_jobs WHERE id=:j"), {"j": jid}).fetchone()
+            conn.execute(text("DELETE FROM mensagens WHERE contato_id IN (SELECT id FROM contatos WHERE whatsapp_id LIKE :p)"), {"p": PREFIXO_DISPARO + "%"})
+            conn.execute(text("DELETE FROM disparo_jobs WHERE id=:j"), {"j": jid})
+            conn.commit()
+        resultados.append({"workers": w, "itens": itens, "preparar_s": round(preparar, 3), "enfileirar_s": round(enfileirar, 3),
+                           "executar_s": round(executar, 3), "msg_por_s": round(itens / executar, 1),
+                           "enviados": enviados, "falhas": falhas, "graph": graph.resumo()})
+        print(f"  disparo workers={w}: {itens / executar:.1f} msg/s ({enviados} ok, {falhas} falhas)")
+    with conexao() as conn:
+        conn.execute(text("DELETE FROM contatos WHERE whatsapp_id LIKE :p"), {"p": PREFIXO_DISPARO + "%"})
+        conn.commit()
+    reconciliar(dias=1)  # o rollup somou os envios apagados acima
+    return resultados
+
+
+# --- FILA ---
+# carregar_fila = fila_compartilhada().filtrar(); com K agentes olhando a fila ao mesmo tempo
+def cenario_fila(agentes=(1, 5, 20, 50), repeticoes=30):
+    from sqlalchemy import text
+    from banco import conexao
+    from fila import fila_compartilhada, buscar_fila
+    fila = fila_compartilhada()
+    with conexao() as conn:
+        vendedoras = [r[0] for r in conn.execute(text("SELECT id FROM usuarios WHERE funcao <> 'admin' ORDER BY id"))]
+    res = {"recarregar": medir(fila.recarregar, 5), "linhas_snapshot": len(fila.filtrar(True, None)),
+           "admin_filtrar": medir(lambda: fila.filtrar(True, None), repeticoes),
+           "busca_nome": medir(lambda: buscar_fila("Cliente 123", True), 10),
+           "busca_telefone": medir(lambda: buscar_fila("55310001", True), 10), "por_agentes": []}
+    for k in agentes:
+        tempos, trava, largada = [], threading.Lock(), threading.Barrier(k)
+        def agente(i):
+            uid = vendedoras[i % len(vendedoras)]
+            largada.wait()
+            for _ in range(repeticoes):
+                t = time.perf_counter()
+                fila.filtrar(False, uid); fila.pagina(False, uid, None, 0, 50)
+                d = time.perf_counter() - t
+                with trava: tempos.append(d)
+        threads = [threading.Thread(target=agente, args=(i,)) for i in range(k)]
+        t = time.perf_counter()
+        for th in threads: th.start()
+        for th in threads: th.join()
+        total = time.perf_counter() - t
+        res["por_agentes"].append({"agentes": k, **resumo(tempos), "chamadas_por_s": round(len(tempos) / total, 1)})
+        print(f"  fila {k} agentes: p95 {res['por_agentes'][-1]['p95_ms']} ms")
+    return res
+
+
+# --- CHAT ---
+# Rerun completo da página de chat (AppTest) para as conversas-fixture: frio, quente, e subindo o histórico
+def cenario_chat(graph, paginas_anteriores=10, espera_previas=10):
+    import streamlit as st
+    from streamlit.testing.v1 import AppTest
+    from sqlalchemy import text
+    from banco import conexao
+    from metricas import metricas
+    from semear import FIXTURES, fixture_whatsapp
+    with conexao() as conn:
+        admin = conn.execute(text("SELECT id, nome FROM usuarios WHERE funcao='admin' ORDER BY id LIMIT 1")).fetchone()
+    resultados = []
+    for n, m in FIXTURES:
+        with conexao() as conn:
+            cid = conn.execute(text("SELECT id FROM contatos WHERE whatsapp_id=:w"), {"w": fixture_whatsapp(n, m)}).scalar()
+        if cid is None: print(f"  chat: fixture {n}/{m}% ausente, rode o semear.py"); continue
+        st.cache_data.clear(); graph.zerar()
+        at = AppTest.from_file(os.path.join(RAIZ, "app.py"), default_timeout=120)
+        at.session_state.usuario = {"id": admin[0], "nome": admin[1], "funcao": "admin"}
+        at.session_state.pagina, at.session_state.chat_ativo = "chat", cid
+
+        def rodar(acao=None):
+            t = time.perf_counter()
+            (acao or at).run()
+            d = time.perf_counter() - t
+            if at.exception: raise RuntimeError(at.exception[0].value)
+            return d, (metricas.ultimos_reruns() or [{}])[-1]
+
+        frio, decomposicao = rodar()
+        quente, _ = rodar()
+        # prévias de mídia são geradas em segundo plano; o rerun seguinte já as encontra no cache
+        limite, antes = time.time() + espera_previas, -1
+        while m and time.time() < limite:
+            agora = graph.resumo().get("download_ok", 0)
+            if agora == antes and agora > 0: break
+            antes = agora; time.sleep(0.5)
+        com_previas, _ = rodar()
+        anteriores = []
+        for _ in range(paginas_anteriores):
+            botoes = [b for b in at.button if b.key == "msgs_antigas"]
+            if not botoes: break
+            anteriores.append(rodar(botoes[0].click())[0])
+        resultados.append({"mensagens": n, "midia_pct": m, "frio_ms": round(1000 * frio, 1), "quente_ms": round(1000 * quente, 1),
+                           "com_previas_ms": round(1000 * com_previas, 1), "anteriores": resumo(anteriores),
+                           "decomposicao_frio": {k: v for k, v in decomposicao.items() if k.endswith(("_ms", "_n"))}, "graph": graph.resumo()})
+        print(f"  chat {n} msgs {m}% mídia: frio {1000 * frio:.0f} ms, quente {1000 * quente:.0f} ms")
+    return resultados
+
+
+# --- CUSTOS ---
+# gerar_relatorio_custos (app.py) é custos_por_vendedora; as outras leituras da aba Custos vêm junto
+def cenario_custos(janelas=(7, 30, 90, 365), repeticoes=10):
+    from custos import custos_por_vendedora, custos_por_template, custos_por_dia, reconciliar
+    res = {"por_vendedora": [{"dias": d, **medir(lambda: custos_por_vendedora(d), repeticoes)} for d in janelas],
+           "por_template_30d": medir(lambda: custos_por_template(30), repeticoes),
+           "por_dia_30d": medir(lambda: custos_por_dia(30), repeticoes),
+           "reconciliar_2d": medir(lambda: reconciliar(2), 3)}
+    print("  custos: " + ", ".join(f"{r['dias']}d p50 {r['p50_ms']} ms" for r in res["por_vendedora"]))
+    return res
+
+
+def info_banco():
+    from sqlalchemy import text
+    from banco import conexao
+    with conexao() as conn:
+        return {"versao": conn.execute(text("SHOW server_version")).scalar(),
+                **{t: conn.execute(text(f"SELECT COUNT(*) FROM {t}")).scalar() for t in ("usuarios", "contatos", "mensagens")}}
+
+
+def rodar(a):
+    # Só o resultado na saída: sem avisos do Streamlit em modo AppTest nem o log de lentidão do metricas.py
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+    logging.basicConfig(level=logging.ERROR)
+    warnings.simplefilter("ignore", FutureWarning)
+    graph = GraphFake(latencia_ms=a.latencia, jitter_ms=a.jitter, erro=a.erro, limite=a.limite, semente=a.semente).iniciar()
+    preparar_ambiente(graph.url)
+    os.environ["MEDIA_CACHE_DIR"] = tempfile.mkdtemp(prefix="semprechat-bench-")
+    commit, sujo = commit_atual()
+    saida = {"commit": commit, "sujo": sujo, "quando": datetime.now().isoformat(timespec="seconds"), "config": vars(a).copy(),
+             "banco": info_banco(), "cenarios": {}}
+    saida["config"].pop("comparar", None)
+    for c in a.cenarios.split(","):
+        print(f"{c}...")
+        t = time.perf_counter()
+        if c == "disparo": saida["cenarios"][c] = cenario_disparo(graph, a.itens, tuple(int(w) for w in a.workers.split(",")))
+        elif c == "fila": saida["cenarios"][c] = cenario_fila(tuple(int(k) for k in a.agentes.split(",")))
+        elif c == "chat": saida["cenarios"][c] = cenario_chat(graph)
+        elif c == "custos": saida["cenarios"][c] = cenario_custos()
+        else: sys.exit(f"cenário desconhecido: {c} (use {', '.join(CENARIOS)})")
+        print(f"  ({time.perf_counter() - t:.1f}s)")
+    graph.parar()
+    os.makedirs(a.saida, exist_ok=True)
+    caminho = os.path.join(a.saida, f"{datetime.now():%Y%m%d-%H%M%S}-{commit}{'-sujo' if sujo else ''}.json")
+    with open(caminho, "w", encoding="utf-8") as f: json.dump(saida, f, ensure_ascii=False, indent=2)
+    print(f"resultado em {caminho}")
+
+
+# --- COMPARAÇÃO ---
+def _folhas(d, prefixo=""):
+    # Achata o JSON em {caminho: número}; listas de cenários viram caminho pelo primeiro campo (workers, agentes, ...)
+    if isinstance(d, dict):
+        for k, v in d.items():
+            if k not in ("graph", "config"): yield from _folhas(v, f"{prefixo}.{k}" if prefixo else k)
+    elif isinstance(d, list):
+        for i, v in enumerate(d):
+            rotulo = "/".join(f"{k}={v[k]}" for k in ("workers", "agentes", "dias", "mensagens", "midia_pct") if isinstance(v, dict) and k in v) or str(i)
+            yield from _folhas(v, f"{prefixo}[{rotulo}]")
+    elif isinstance(d, (int, float)) and not isinstance(d, bool): yield prefixo, d
+
+def comparar(a, b):
+    ra, rb = (json.load(open(p, encoding="utf-8")) for p in (a, b))
+    fa, fb = dict(_folhas(ra["cenarios"])), dict(_folhas(rb["cenarios"]))
+    print(f"{'métrica':70} {ra['commit']:>12} {rb['commit']:>12}   variação")
+    for k in fa:
+        if k not in fb or not k.endswith(("_ms", "_s", "msg_por_s", "chamadas_por_s")): continue
+        var = (fb[k] - fa[k]) / fa[k] * 100 if fa[k] else 0.0
+        # tempo: subir é pior; vazão: subir é melhor
+        pior = var > 10 if not k.endswith("_por_s") else var < -10
+        print(f"{k:70} {fa[k]:>12} {fb[k]:>12}   {var:+6.1f}%{'  ⚠️' if pior else ''}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Benchmark do SempreChat")
+    ap.add_argument("--cenarios", default=",".join(CENARIOS))
+    ap.add_argument("--latencia", type=float, default=80, help="latência média da Graph fake (ms)")
+    ap.add_argument("--jitter", type=float, default=30)
+    ap.add_argument("--erro", type=float, default=0.005, help="fração de 503 na Graph fake")
+    ap.add_argument("--limite", type=float, default=0.01, help="fração de limite de taxa (130429)")
+    ap.add_argument("--itens", type=int, default=2000, help="tamanho do lote de disparo")
+    ap.add_argument("--workers", default="4,8,16", help="threads de envio testadas no disparo")
+    ap.add_argument("--agentes", default="1,5,20,50", help="agentes simultâneos no cenário da fila")
+    ap.add_argument("--semente", type=int, default=42)
+    ap.add_argument("--saida", default=os.path.join(RAIZ, "bench", "resultados"))
+    ap.add_argument("--comparar", nargs=2, metavar=("ANTES", "DEPOIS"))
+    a = ap.parse_args()
+    if a.comparar: comparar(*a.comparar)
+    else: rodar(a)
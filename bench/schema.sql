@@ -0,0 +1,7 @@
+-- Tabelas base do app (o resto vem das migrações em migracoes.py e dos garantir_* de cada módulo)
+CREATE TABLE IF NOT EXISTS usuarios (id SERIAL PRIMARY KEY, nome TEXT, email TEXT UNIQUE, senha TEXT, funcao TEXT, ativo BOOLEAN DEFAULT TRUE, bloqueado_envio BOOLEAN DEFAULT FALSE);
+CREATE TABLE IF NOT EXISTS contatos (id SERIAL PRIMARY KEY, whatsapp_id TEXT, nome TEXT, status_atendimento TEXT DEFAULT 'fila', vendedora_id INTEGER REFERENCES usuarios(id), codigo_cliente TEXT, cpf_cnpj TEXT, notas_internas TEXT, contexto_bot TEXT, ultima_interacao TIMESTAMP DEFAULT NOW());
+CREATE TABLE IF NOT EXISTS mensagens (id SERIAL PRIMARY KEY, contato_id INTEGER REFERENCES contatos(id), remetente TEXT, texto TEXT, tipo TEXT DEFAULT 'text', url_media TEXT, data_envio TIMESTAMP DEFAULT NOW(), custo NUMERIC DEFAULT 0);
+CREATE TABLE IF NOT EXISTS templates (id SERIAL PRIMARY KEY, nome_tecnico TEXT, idioma TEXT, custo_estimado NUMERIC DEFAULT 0);
+CREATE TABLE IF NOT EXISTS configuracoes (chave TEXT PRIMARY KEY, valor TEXT);
+CREATE TABLE IF NOT EXISTS respostas_rapidas (id SERIAL PRIMARY KEY, titulo TEXT, texto TEXT, criado_por INTEGER);
@@ -0,0 +1,125 @@
+# Enche o banco de benchmark com volume realista e determinístico (mesma --semente, mesmos dados).
+#   BENCH_DATABASE_URL=postgresql://... python bench/semear.py --usuarios 20 --contatos 100000 --mensagens 2000000
+#   (--apagar para refazer do zero um banco já semeado)
+# Além do volume aleatório, cria as conversas-fixture "Bench Conversa" usadas no cenário de chat.
+import argparse
+import os
+import time
+from comum import RAIZ, preparar_ambiente
+
+LOTE = 250_000
+STATUS = (("encerrado", 0.60), ("em_andamento", 0.25), ("fila", 0.15))
+TEMPLATES = (("promo_mensal", 0.35), ("boleto_vencendo", 0.08), ("boas_vindas", 0.0), ("pesquisa_nps", 0.05), ("reengajamento", 0.35))
+# (mensagens, % com mídia) das conversas-fixture
+FIXTURES = [(n, m) for n in (50, 500, 5000) for m in (0, 20)]
+PALAVRAS = ("boleto pedido entrega prazo valor desconto parcela nota fiscal troca produto cliente obrigado "
+            "bom dia tarde noite amanhã hoje quando segue anexo comprovante pagamento pix cartão endereço "
+            "frete atraso cancelar confirmar orçamento proposta contrato visita técnico garantia").split()
+TABELAS_APAGAR = ("disparo_itens", "disparo_jobs", "arquivo_mensagens", "midias_meta", "custos_diarios",
+                  "mensagens", "contatos", "respostas_rapidas", "templates", "usuarios")
+
+
+def fixture_whatsapp(n, m): return f"5599{n:07d}{m:02d}"
+
+
+def semear(usuarios, contatos, mensagens, dias, fracao_midia, semente, apagar):
+    from sqlalchemy import text
+    from banco import engine
+    from migracoes import aplicar_migracoes
+    from custos import reconciliar
+
+    t0 = time.time()
+    with engine.begin() as conn:
+        conn.exec_driver_sql(open(os.path.join(RAIZ, "bench", "schema.sql"), encoding="utf-8").read())
+    for v, n in aplicar_migracoes(): print(f"migração {v} ({n})")
+
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT EXISTS (SELECT 1 FROM contatos)")).scalar():
+            if not apagar: raise SystemExit("Banco já tem contatos; use --apagar para semear do zero.")
+            existentes = [t for t in TABELAS_APAGAR if conn.execute(text("SELECT to_regclass(:t)"), {"t": t}).scalar()]
+            conn.execute(text(f"TRUNCATE {', '.join(existentes)} RESTART IDENTITY CASCADE"))
+            print("tabelas apagadas")
+
+    with engine.begin() as conn:
+        conn.execute(text("SELECT setseed(:s)"), {"s": (semente % 1000) / 1000})
+        conn.execute(text("INSERT INTO usuarios (nome, email, senha, funcao) VALUES ('Bench Admin', 'bench_admin', 'bench', 'admin')"))
+        conn.execute(text("""INSERT INTO usuarios (nome, email, senha, funcao)
+                             SELECT 'Vendedora ' || g, 'bench_vend_' || g, 'bench', 'vendedor' FROM generate_series(1, :n) g"""), {"n": max(1, usuarios - 1)})
+        conn.execute(text("INSERT INTO templates (nome_tecnico, idioma, custo_estimado) VALUES (:n, 'pt_BR', :c)"),
+                     [{"n": n, "c": c} for n, c in TEMPLATES])
+        conn.execute(text("INSERT INTO configuracoes (chave, valor) VALUES ('msg_boas_vindas', 'Olá! Em que posso ajudar?') ON CONFLICT DO NOTHING"))
+        # Contatos: status e vendedora sorteados; fila sem vendedora
+        conn.execute(text("""
+            INSERT INTO contatos (whatsapp_id, nome, status_atendimento, vendedora_id, codigo_cliente, ultima_interacao)
+            SELECT '5531' || lpad(g::text, 9, '0'), 'Cliente ' || g, status,
+                   CASE WHEN status = 'fila' THEN NULL ELSE 2 + floor(random() * :nv)::int END,
+                   CASE WHEN random() < 0.4 THEN 'C' || lpad(g::text, 6, '0') END,
+                   NOW() - random() * make_interval(days => :d)
+            FROM (SELECT g, CASE WHEN r < :p1 THEN 'encerrado' WHEN r < :p2 THEN 'em_andamento' ELSE 'fila' END AS status
+                  FROM (SELECT g, random() AS r FROM generate_series(1, :n) g) x) s
+        """), {"n": contatos, "nv": max(1, usuarios - 1), "d": dias, "p1": STATUS[0][1], "p2": STATUS[0][1] + STATUS[1][1]})
+    print(f"{usuarios} usuários, {contatos} contatos ({time.time() - t0:.0f}s)")
+
+    # Mensagens em lotes (um commit por lote): contato com distribuição de cauda longa (poucos com muitas mensagens)
+    feitas = 0
+    while feitas < mensagens:
+        n = min(LOTE, mensagens - feitas)
+        with engine.begin() as conn:
+            conn.execute(text("SELECT setseed(:s)"), {"s": ((semente + feitas) % 997) / 997})
+            conn.execute(text("""
+                INSERT INTO mensagens (contato_id, remetente, texto, tipo, url_media, data_envio, custo)
+                SELECT x.cid, CASE WHEN x.tpl IS NOT NULL THEN 'empresa' ELSE x.remetente END,
+                       CASE WHEN x.tpl IS NOT NULL THEN '[DISPARO: ' || (:tpls)[x.tpl] || '] Vars: [''Cliente ' || x.cid || ''']'
+                            WHEN x.tipo <> 'text' THEN NULL
+                            ELSE (:pal)[1 + floor(random() * :np)::int] || ' ' || (:pal)[1 + floor(random() * :np)::int] || ' '
+                                 || (:pal)[1 + floor(random() * :np)::int] || ' ' || (:pal)[1 + floor(random() * :np)::int] END,
+                       CASE WHEN x.tpl IS NOT NULL THEN 'template' ELSE x.tipo END,
+                       CASE WHEN x.tipo IN ('image', 'document', 'audio') AND x.tpl IS NULL THEN 'bench' || x.g END,
+                       NOW() - random() * make_interval(days => :d),
+                       CASE WHEN x.tpl IS NOT NULL THEN (:custos)[x.tpl] ELSE 0 END
+                FROM (
+                    SELECT g, 1 + floor(:nc * power(random(), 3))::int AS cid,
+                           CASE WHEN random() < 0.5 THEN 'cliente' ELSE 'empresa' END AS remetente,
+                           CASE WHEN r < :fm * 0.6 THEN 'image' WHEN r < :fm * 0.85 THEN 'document' WHEN r < :fm THEN 'audio' ELSE 'text' END AS tipo,
+                           CASE WHEN random() < 0.08 THEN 1 + floor(random() * :nt)::int END AS tpl
+                    FROM (SELECT g, random() AS r FROM generate_series(:a, :b) g) s
+                ) x
+            """), {"a": feitas + 1, "b": feitas + n, "nc": contatos, "d": dias, "fm": fracao_midia, "pal": list(PALAVRAS), "np": len(PALAVRAS),
+                   "tpls": [t for t, _ in TEMPLATES], "custos": [c for _, c in TEMPLATES], "nt": len(TEMPLATES)})
+        feitas += n
+        print(f"  {feitas}/{mensagens} mensagens ({time.time() - t0:.0f}s)")
+
+    # Conversas-fixture com tamanho e mídia exatos, atribuídas à primeira vendedora
+    with engine.begin() as conn:
+        for n, m in FIXTURES:
+            cid = conn.execute(text("""INSERT INTO contatos (whatsapp_id, nome, status_atendimento, vendedora_id)
+                                       VALUES (:w, :nome, 'em_andamento', 2) RETURNING id"""),
+                               {"w": fixture_whatsapp(n, m), "nome": f"Bench Conversa {n} ({m}% mídia)"}).scalar()
+            conn.execute(text("""
+                INSERT INTO mensagens (contato_id, remetente, texto, tipo, url_media, data_envio)
+                SELECT :cid, CASE WHEN g % 2 = 0 THEN 'cliente' ELSE 'empresa' END,
+                       CASE WHEN midia THEN NULL ELSE 'Mensagem ' || g || ' da conversa de teste' END,
+                       CASE WHEN midia THEN 'image' ELSE 'text' END, CASE WHEN midia THEN 'benchfix' || :cid || '_' || g END,
+                       NOW() - make_interval(mins => :n - g)
+                FROM (SELECT g, :m > 0 AND g % GREATEST(1, 100 / GREATEST(:m, 1)) = 0 AS midia FROM generate_series(1, :n) g) s
+            """), {"cid": cid, "n": n, "m": m})
+        conn.execute(text("""UPDATE contatos c SET ultima_interacao = u.ultima
+                             FROM (SELECT contato_id, MAX(data_envio) AS ultima FROM mensagens GROUP BY contato_id) u
+                             WHERE u.contato_id = c.id"""))
+    reconciliar(dias=dias + 1)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn: conn.execute(text("VACUUM ANALYZE"))
+    print(f"pronto em {time.time() - t0:.0f}s")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Semeia o banco de benchmark")
+    ap.add_argument("--usuarios", type=int, default=20)
+    ap.add_argument("--contatos", type=int, default=100_000)
+    ap.add_argument("--mensagens", type=int, default=2_000_000)
+    ap.add_argument("--dias", type=int, default=365, help="janela de datas das mensagens")
+    ap.add_argument("--midia", type=float, default=0.08, help="fração de mensagens com mídia")
+    ap.add_argument("--semente", type=int, default=42)
+    ap.add_argument("--apagar", action="store_true", help="apaga os dados existentes antes de semear")
+    a = ap.parse_args()
+    preparar_ambiente()
+    semear(a.usuarios, a.contatos, a.mensagens, a.dias, a.midia, a.semente, a.apagar)
@@ -0,0 +1,37 @@
+import pandas as pd
+from sqlalchemy import text
+from banco import conexao
+
+# Busca textual no histórico: mensagens.texto_busca (tsvector em português, mantido por trigger) + índice GIN (migração 8)
+IDIOMA = "portuguese"
+MAX_CONTAGEM = 1000  # acima disso mostra "1000+" em vez de contar tudo
+
+def buscar_mensagens(consulta, admin=False, usuario_id=None, dias=None, pagina=0, por_pagina=20):
+    # Aceita a sintaxe de busca web: "frase exata", -excluir, OR. Devolve (hits da página, total limitado).
+    conds = ["m.texto_busca @@ q"]
+    params = {"q": consulta, "lim": por_pagina, "off": pagina * por_pagina, "max": MAX_CONTAGEM}
+    if dias:
+        conds.append("m.data_envio >= NOW() - make_interval(days => :dias)")
+        params["dias"] = int(dias)
+    if not admin:
+        conds.append("(c.vendedora_id = :uid OR c.vendedora_id IS NULL)")
+        params["uid"] = usuario_id
+    base = f"""
+        FROM mensagens m JOIN contatos c ON c.id = m.contato_id, websearch_to_tsquery('{IDIOMA}', :q) q
+        WHERE {' AND '.join(conds)}
+    """
+    with conexao() as conn:
+        total = conn.execute(text(f"SELECT COUNT(*) FROM (SELECT 1 {base} LIMIT :max) t"), params).scalar()
+        # ts_headline é caro: só para as linhas da página
+        df = pd.read_sql(text(f"""
+            SELECT h.*, ts_headline('{IDIOMA}', m.texto, websearch_to_tsquery('{IDIOMA}', :q),
+                                    'StartSel=[[[, StopSel=]]], MaxWords=30, MinWords=12, MaxFragments=2') AS trecho
+            FROM (
+                SELECT m.id, m.contato_id, c.nome, c.whatsapp_id, m.remetente, m.data_envio, ts_rank_cd(m.texto_busca, q) AS relevancia
+                {base}
+                ORDER BY relevancia DESC, m.data_envio DESC
+                LIMIT :lim OFFSET :off
+            ) h JOIN mensagens m ON m.id = h.id
+            ORDER BY h.relevancia DESC, h.data_envio DESC
+        """), conn, params=params)
+    return df, total
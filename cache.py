@@ -0,0 +1,204 @@
+import hashlib
+import logging
+import pickle
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from banco import segredo
+
+# Cache compartilhado com backends trocáveis (CACHE_BACKEND):
+#   memoria              -> só o st.cache_data do processo (padrão, uma réplica)
+#   sqlite:///caminho.db -> réplicas na mesma máquina
+#   redis://host:6379/0  -> réplicas em máquinas diferentes (qualquer servidor que fale o protocolo Redis)
+# Cada tabela tem uma versão; invalidar() incrementa a versão em todas as réplicas e avisa os assinantes
+# (ex.: a fila), e os helpers de leitura usam a versão como parte da chave.
+PREFIXO = "semprechat:"
+CANAL = PREFIXO + "invalidar"
+TTL_PADRAO = 3600
+
+
+class BackendCache:
+    nome = "base"
+
+    def __init__(self):
+        self._assinantes = []
+
+    def assinar(self, fn):
+        self._assinantes.append(fn)
+
+    def _avisar(self, tabela):
+        for fn in list(self._assinantes):
+            try: fn(tabela)
+            except Exception: logging.exception("cache: erro em assinante de %s", tabela)
+
+    # ler/gravar recebem e devolvem o objeto: quem guarda fora do processo serializa (o memoria não paga o pickle)
+    def ler(self, chave): return None
+    def gravar(self, chave, valor, ttl): pass
+
+    def obter(self, chave, carregar, ttl=TTL_PADRAO):
+        # Valor compartilhado entre réplicas; se o backend falhar, lê direto da fonte
+        try: valor = self.ler(chave)
+        except Exception: logging.exception("cache: falha ao ler %s", chave); valor = None
+        if valor is not None: return valor
+        valor = carregar()
+        try: self.gravar(chave, valor, ttl)
+        except Exception: logging.exception("cache: falha ao gravar %s", chave)
+        return valor
+
+
+class BackendMemoria(BackendCache):
+    # Nada a compartilhar: o st.cache_data já é o cache do processo
+    nome = "memoria"
+
+    def __init__(self):
+        super().__init__()
+        self._versoes = {}
+        self._trava = threading.Lock()
+
+    def versao(self, tabela):
+        return self._versoes.get(tabela, 0)
+
+    def invalidar(self, tabela):
+        with self._trava: self._versoes[tabela] = self._versoes.get(tabela, 0) + 1
+        self._avisar(tabela)
+
+
+class BackendSQLite(BackendCache):
+    nome = "sqlite"
+    INTERVALO_VIGIA = 1.0
+
+    def __init__(self, caminho):
+        super().__init__()
+        self.caminho = caminho
+        self._vigia = None
+        with closing(self._conn()) as c:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("CREATE TABLE IF NOT EXISTS kv (chave TEXT PRIMARY KEY, valor BLOB, expira REAL)")
+            c.execute("CREATE TABLE IF NOT EXISTS versoes (tabela TEXT PRIMARY KEY, versao INTEGER NOT NULL)")
+
+    def _conn(self):
+        return sqlite3.connect(self.caminho, timeout=10, isolation_level=None)
+
+    def ler(self, chave):
+        with closing(self._conn()) as c:
+            row = c.execute("SELECT valor FROM kv WHERE chave=? AND expira>?", (chave, time.time())).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def gravar(self, chave, valor, ttl):
+        bruto = pickle.dumps(valor)
+        with closing(self._conn()) as c:
+            c.execute("INSERT OR REPLACE INTO kv (chave, valor, expira) VALUES (?, ?, ?)", (chave, bruto, time.time() + ttl))
+            c.execute("DELETE FROM kv WHERE expira<?", (time.time(),))
+
+    def versao(self, tabela):
+        with closing(self._conn()) as c:
+            row = c.execute("SELECT versao FROM versoes WHERE tabela=?", (tabela,)).fetchone()
+            return row[0] if row else 0
+
+    def invalidar(self, tabela):
+        # Chamado depois do COMMIT no banco: falha aqui só deixa o cache velho até o TTL, não derruba quem gravou
+        try:
+            with closing(self._conn()) as c:
+                c.execute("INSERT INTO versoes (tabela, versao) VALUES (?, 1) ON CONFLICT (tabela) DO UPDATE SET versao = versao + 1", (tabela,))
+        except Exception: logging.exception("cache: falha ao invalidar %s", tabela)
+        self._avisar(tabela)
+
+    def assinar(self, fn):
+        # Outros processos só enxergam a mudança de versão: um vigia compara a tabela de versões
+        super().assinar(fn)
+        if self._vigia is None:
+            self._vigia = threading.Thread(target=self._vigiar, daemon=True, name="cache-vigia")
+            self._vigia.start()
+
+    def _vigiar(self):
+        vistas = None
+        while True:
+            try:
+                with closing(self._conn()) as c: atuais = dict(c.execute("SELECT tabela, versao FROM versoes").fetchall())
+                if vistas is not None:
+                    for tabela, v in atuais.items():
+                        if vistas.get(tabela) != v: self._avisar(tabela)
+                vistas = atuais
+            except Exception: logging.exception("cache: erro no vigia sqlite")
+            time.sleep(self.INTERVALO_VIGIA)
+
+
+class BackendRedis(BackendCache):
+    nome = "redis"
+    HASH_VERSOES = PREFIXO + "versoes"
+
+    def __init__(self, url):
+        super().__init__()
+        try: import redis
+        except ImportError: raise RuntimeError("CACHE_BACKEND=redis requer o pacote 'redis' (pip install redis)")
+        self.r = redis.Redis.from_url(url)
+        self._versoes = {}
+        self._conectado = False
+        threading.Thread(target=self._ouvir, daemon=True, name="cache-pubsub").start()
+
+    def ler(self, chave):
+        bruto = self.r.get(PREFIXO + chave)
+        return pickle.loads(bruto) if bruto is not None else None
+
+    def gravar(self, chave, valor, ttl): self.r.set(PREFIXO + chave, pickle.dumps(valor), ex=int(ttl))
+
+    def versao(self, tabela):
+        # Espelho local mantido pelo pub/sub; sem a assinatura ativa, pergunta ao servidor
+        if self._conectado and tabela in self._versoes: return self._versoes[tabela]
+        try: v = int(self.r.hget(self.HASH_VERSOES, tabela) or 0)
+        except Exception: logging.exception("cache: redis indisponível"); return self._versoes.get(tabela, 0)
+        self._versoes[tabela] = v
+        return v
+
+    def invalidar(self, tabela):
+        # Chamado depois do COMMIT no banco: com o redis fora, pelo menos este processo troca de versão
+        try:
+            self._versoes[tabela] = self.r.hincrby(self.HASH_VERSOES, tabela, 1)
+            self.r.publish(CANAL, tabela)
+        except Exception:
+            logging.exception("cache: falha ao invalidar %s", tabela)
+            self._versoes[tabela] = self._versoes.get(tabela, 0) + 1
+        self._avisar(tabela)
+
+    def _ouvir(self):
+        espera = 1
+        while True:
+            try:
+                ps = self.r.pubsub(ignore_subscribe_messages=True)
+                ps.subscribe(CANAL)
+                self._versoes = {k.decode(): int(v) for k, v in self.r.hgetall(self.HASH_VERSOES).items()}
+                self._conectado, espera = True, 1
+                for msg in ps.listen():
+                    tabela = msg["data"].decode()
+                    self._versoes[tabela] = int(self.r.hget(self.HASH_VERSOES, tabela) or 0)
+                    self._avisar(tabela)
+            except Exception: logging.exception("cache: pub/sub do redis caiu, reconectando")
+            self._conectado = False
+            time.sleep(espera)
+            espera = min(30, espera * 2)
+
+
+def criar_backend(url):
+    url = (url or "memoria").strip()
+    if url.startswith("sqlite:///"): return BackendSQLite(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://")): return BackendRedis(url)
+    return BackendMemoria()
+
+backend = criar_backend(segredo("CACHE_BACKEND", "memoria"))
+
+
+def versao(tabela):
+    return backend.versao(tabela)
+
+def invalidar(*tabelas):
+    for t in tabelas: backend.invalidar(t)
+
+def assinar(fn):
+    backend.assinar(fn)
+
+def obter(chave, carregar, ttl=TTL_PADRAO):
+    return backend.obter(chave, carregar, ttl)
+
+def chave_sql(sql):
+    return hashlib.sha1(sql.encode()).hexdigest()[:16]
@@ -0,0 +1,103 @@
+import datetime as dt
+import logging
+import pandas as pd
+from sqlalchemy import text
+from banco import conexao
+
+# Rollup diário de custos por (dia, vendedora, template). Tabela, coluna e triggers vêm da migração 14
+# (migracoes.py): o trigger em mensagens soma cada INSERT; o worker soma o histórico (backfill) e
+# reconciliar() recalcula dias inteiros. Aqui o app só lê custos_diarios.
+# A vendedora é a do contato no momento do envio, gravada em mensagens.vendedora_id por um trigger BEFORE INSERT
+# (mensagens anteriores à coluna ficam com a vendedora atual); 0 = sem vendedora, '' = custo fora de template.
+# Trigger e reconciliar() usam a mesma regra e a mesma trava por dia (advisory, compartilhada no trigger).
+DIAS_RECONCILIAR = 2
+SQL_TEMPLATE = r"COALESCE((regexp_match(m.texto, '^\[(DISPARO|TPL): ([^\]]+)\]'))[2], '')"
+SQL_VENDEDORA = "COALESCE(m.vendedora_id, c.vendedora_id, 0)"
+MARCA_BACKFILL = "custos_backfill"  # em configuracoes: próximo dia do histórico a somar; 'completo' no fim
+TRAVA_CUSTOS = 72_310_002  # (TRAVA_CUSTOS, dias desde 2000-01-01)
+
+def _marcar(conn, valor):
+    conn.execute(text("INSERT INTO configuracoes (chave, valor) VALUES (:k, :v) ON CONFLICT (chave) DO UPDATE SET valor = :v"),
+                 {"k": MARCA_BACKFILL, "v": valor})
+
+def backfill():
+    # Chamado pelo worker. Histórico dia a dia, com o progresso em configuracoes no mesmo commit de cada dia:
+    # se cair no meio (timeout, deploy), a próxima chamada continua de onde parou em vez de achar que já terminou
+    with conexao() as conn:
+        marca = conn.execute(text("SELECT valor FROM configuracoes WHERE chave = :k"), {"k": MARCA_BACKFILL}).scalar()
+        if marca == "completo": return
+        vivo = _primeiro_dia_vivo(conn)
+        hoje = conn.execute(text("SELECT CURRENT_DATE")).scalar()
+        dia = dt.date.fromisoformat(marca) if marca else conn.execute(text("SELECT MIN(data_envio)::date FROM mensagens WHERE remetente = 'empresa'")).scalar()
+    if dia: logging.info("custos: backfill do rollup a partir de %s", dia)
+    while dia and dia <= hoje:
+        with conexao() as conn:
+            _recalcular_dia(conn, dia, vivo)
+            _marcar(conn, (dia + dt.timedelta(days=1)).isoformat())
+            conn.commit()
+        dia += dt.timedelta(days=1)
+    with conexao() as conn:
+        _marcar(conn, "completo"); conn.commit()
+
+def _primeiro_dia_vivo(conn):
+    # Até o dia da última mensagem arquivada parte do custo só existe no Parquet (arquivo.py):
+    # recalcular esses dias a partir de mensagens apagaria essa parte
+    if not conn.execute(text("SELECT to_regclass('arquivo_mensagens')")).scalar(): return None
+    return conn.execute(text("SELECT MAX(ultima)::date + 1 FROM arquivo_mensagens")).scalar()
+
+def _recalcular_dia(conn, dia, vivo):
+    # Um dia, uma transação curta (sem o statement_timeout do app: o backfill pega dias cheios). A trava
+    # exclusiva do dia espera os INSERTs em andamento nesse dia terminarem e segura os próximos até o COMMIT,
+    # então nenhum envio é contado duas vezes nem perdido; envios de outros dias não esperam.
+    # Recalcula numa tabela temporária e só então troca o dia. Dia com mensagem arquivada só é preenchido
+    # se ainda estiver vazio no rollup.
+    conn.execute(text("SET LOCAL statement_timeout = 0"))
+    conn.execute(text("SELECT pg_advisory_xact_lock(:k, :d - DATE '2000-01-01')"), {"k": TRAVA_CUSTOS, "d": dia})
+    if vivo and dia < vivo and conn.execute(text("SELECT 1 FROM custos_diarios WHERE dia = :d LIMIT 1"), {"d": dia}).fetchone(): return 0
+    conn.execute(text("CREATE TEMP TABLE IF NOT EXISTS custos_recalculo (LIKE custos_diarios) ON COMMIT DELETE ROWS"))
+    conn.execute(text(f"""
+        INSERT INTO custos_recalculo (dia, vendedora_id, template, qtd, custo)
+        SELECT m.data_envio::date, {SQL_VENDEDORA}, {SQL_TEMPLATE}, COUNT(*), SUM(m.custo)
+        FROM mensagens m LEFT JOIN contatos c ON c.id = m.contato_id
+        WHERE m.remetente = 'empresa' AND m.custo > 0 AND m.data_envio >= :d AND m.data_envio < :d + 1
+        GROUP BY 1, 2, 3
+    """), {"d": dia})
+    conn.execute(text("DELETE FROM custos_diarios WHERE dia = :d"), {"d": dia})
+    return conn.execute(text("INSERT INTO custos_diarios SELECT * FROM custos_recalculo")).rowcount
+
+def reconciliar(dias=DIAS_RECONCILIAR):
+    # Recalcula os últimos `dias`, um dia por transação
+    with conexao() as conn:
+        vivo = _primeiro_dia_vivo(conn)
+        hoje = conn.execute(text("SELECT CURRENT_DATE")).scalar()
+    n = 0
+    for i in range(dias, -1, -1):
+        with conexao() as conn:
+            n += _recalcular_dia(conn, hoje - dt.timedelta(days=i), vivo)
+            conn.commit()
+    return n
+
+def _consultar(sql, dias):
+    with conexao() as conn: return pd.read_sql(text(sql), conn, params={"d": dias})
+
+def custos_por_vendedora(dias=30):
+    return _consultar("""
+        SELECT COALESCE(u.nome, '(sem vendedora)') AS Vendedora, SUM(cd.qtd) AS Qtd_Mensagens, SUM(cd.custo) AS Custo_Total
+        FROM custos_diarios cd LEFT JOIN usuarios u ON u.id = cd.vendedora_id
+        WHERE cd.dia >= CURRENT_DATE - make_interval(days => :d)
+        GROUP BY 1 ORDER BY Custo_Total DESC
+    """, dias)
+
+def custos_por_template(dias=30):
+    return _consultar("""
+        SELECT COALESCE(NULLIF(template, ''), '(avulsas)') AS Template, SUM(qtd) AS Qtd_Mensagens, SUM(custo) AS Custo_Total
+        FROM custos_diarios WHERE dia >= CURRENT_DATE - make_interval(days => :d)
+        GROUP BY 1 ORDER BY Custo_Total DESC
+    """, dias)
+
+def custos_por_dia(dias=30):
+    return _consultar("""
+        SELECT dia AS Dia, SUM(qtd) AS Qtd_Mensagens, SUM(custo) AS Custo_Total
+        FROM custos_diarios WHERE dia >= CURRENT_DATE - make_interval(days => :d)
+        GROUP BY 1 ORDER BY 1
+    """, dias)
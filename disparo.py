@@ -0,0 +1,368 @@
+import csv
+import io
+import json
+import logging
+import random
+import threading
+import time
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import text
+from banco import conexao
+from meta_api import enviar_mensagem_api
+
+# Cloud API: 80 msg/s por número é o teto padrão; sobe conforme o tier da conta
+TAXA_META_PADRAO = 80
+WORKERS_PADRAO = 8
+
+# Códigos Graph de limite: 4 (app), 80007 (WABA), 130429 (throughput), 131056 (par remetente/destinatário)
+CODIGOS_LIMITE = {4, 80007, 130429, 131056}
+
+
+class LimitadorTaxa:
+    # Token bucket compartilhado entre as threads; a taxa cai pela metade a cada
+    # limite recebido e volta aos poucos (AIMD) até o teto configurado.
+    def __init__(self, taxa=TAXA_META_PADRAO, rajada=None):
+        self.taxa_max = float(taxa)
+        self.taxa = float(taxa)
+        self.capacidade = float(rajada or taxa)
+        self.tokens = self.capacidade
+        self.ultimo = time.monotonic()
+        self.trava = threading.Lock()
+
+    def adquirir(self):
+        while True:
+            with self.trava:
+                agora = time.monotonic()
+                self.tokens = min(self.capacidade, self.tokens + (agora - self.ultimo) * self.taxa)
+                self.ultimo = agora
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                espera = (1 - self.tokens) / self.taxa
+            time.sleep(espera)
+
+    def penalizar(self):
+        with self.trava:
+            self.taxa = max(1.0, self.taxa / 2)
+            self.tokens = 0
+
+    def recuperar(self):
+        with self.trava:
+            self.taxa = min(self.taxa_max, self.taxa + max(1.0, self.taxa_max * 0.05))
+
+
+def eh_limite_taxa(code, resp):
+    if code == 429: return True
+    if isinstance(resp, dict):
+        return (resp.get('error') or {}).get('code') in CODIGOS_LIMITE
+    return False
+
+
+def enviar_com_backoff(enviar, limitador, tentativas=5, base=1.0, teto=60.0):
+    # enviar() -> (status, resposta), mesmo contrato de enviar_mensagem_api
+    for t in range(tentativas):
+        limitador.adquirir()
+        code, resp = enviar()
+        if not eh_limite_taxa(code, resp):
+            limitador.recuperar()
+            return code, resp
+        limitador.penalizar()
+        if t < tentativas - 1:
+            time.sleep(min(teto, base * 2 ** t) * random.uniform(0.5, 1.0))
+    return code, resp
+
+
+def formatar_eta(segundos):
+    segundos = int(max(0, segundos))
+    h, r = divmod(segundos, 3600)
+    m, s = divmod(r, 60)
+    return f"{h}h{m:02d}m" if h else f"{m}m{s:02d}s"
+
+
+def executar_lote(itens, processar, workers=WORKERS_PADRAO):
+    # Roda processar(item) em paralelo e devolve, na ordem em que terminam,
+    # (indice, resultado, concluidos, msg_por_seg, eta_segundos).
+    total = len(itens)
+    inicio = time.monotonic()
+    concluidos = 0
+    # Se o consumidor interromper (ex.: job cancelado), itens ainda não iniciados são descartados
+    ex = ThreadPoolExecutor(max_workers=max(1, workers))
+    try:
+        futuros = {ex.submit(processar, item): i for i, item in enumerate(itens)}
+        for fut in as_completed(futuros):
+            concluidos += 1
+            try: res = fut.result()
+            except Exception: res = False
+            decorrido = max(time.monotonic() - inicio, 1e-6)
+            taxa = concluidos / decorrido
+            eta = (total - concluidos) / taxa if taxa else 0
+            yield futuros[fut], res, concluidos, taxa, eta
+    finally: ex.shutdown(wait=True, cancel_futures=True)
+
+
+# --- CONTATOS ---
+def normalizar_telefone(whatsapp_id):
+    tel = ''.join(filter(str.isdigit, str(whatsapp_id)))
+    if len(tel) < 10: return None
+    if len(tel) == 11 and not tel.startswith("55"): tel = "55" + tel
+    return tel
+
+def garantir_contato(whatsapp_id, vendedora_id):
+    tel = normalizar_telefone(whatsapp_id)
+    if not tel: return None
+    
+    with conexao() as conn:
+        res = conn.execute(text("SELECT id FROM contatos WHERE whatsapp_id = :w"), {"w":tel}).fetchone()
+        if res:
+            cid = res[0]
+            conn.execute(text("UPDATE contatos SET vendedora_id=:v WHERE id=:id AND vendedora_id IS NULL"), {"v":vendedora_id, "id":cid})
+            conn.commit()
+            return cid
+        else:
+            try:
+                r = conn.execute(text("INSERT INTO contatos (whatsapp_id, nome, status_atendimento, vendedora_id) VALUES (:w, 'Lead Importado', 'fila', :v) RETURNING id"), {"w":tel, "v":vendedora_id}).fetchone()
+                conn.commit()
+                return r[0]
+            except: return None
+
+def resolver_contatos(telefones, vendedora_id):
+    # Um único upsert para o lote inteiro: {telefone normalizado: contato_id}.
+    # Mesma regra do garantir_contato: contato novo entra na fila, existente só ganha vendedora se não tiver.
+    telefones = list(dict.fromkeys(t for t in telefones if t))
+    if not telefones: return {}
+    try:
+        with conexao() as conn:
+            rows = conn.execute(text("""
+                INSERT INTO contatos (whatsapp_id, nome, status_atendimento, vendedora_id)
+                SELECT w, 'Lead Importado', 'fila', :v FROM unnest(CAST(:ws AS TEXT[])) AS w
+                ON CONFLICT (whatsapp_id) DO UPDATE SET vendedora_id = COALESCE(contatos.vendedora_id, EXCLUDED.vendedora_id)
+                RETURNING id, whatsapp_id
+            """), {"ws":telefones, "v":vendedora_id}).fetchall()
+            conn.commit()
+        return {w: cid for cid, w in rows}
+    except Exception:
+        # Sem índice único em contatos.whatsapp_id o ON CONFLICT falha: volta ao caminho linha a linha
+        return {t: cid for t in telefones if (cid := garantir_contato(t, vendedora_id))}
+
+def gravar_resultados(conn, ok, falhas, tpl, custo):
+    # ok: [(item_id, contato_id, vars_list)] enviados; falhas: [item_id]. Tudo em executemany, mesma transação.
+    if ok:
+        conn.execute(text("INSERT INTO mensagens (contato_id, remetente, texto, tipo, custo) VALUES (:cid,'empresa',:t,'template',:c)"),
+                     [{"cid":cid, "t":f"[DISPARO: {tpl}] Vars: {vs}", "c":custo} for _, cid, vs in ok])
+        conn.execute(text("UPDATE contatos SET contexto_bot = :ctx WHERE id = :id"), [{"ctx":tpl, "id":cid} for cid in dict.fromkeys(cid for _, cid, _ in ok)])
+        conn.execute(text("UPDATE disparo_itens SET status='enviado', processado_em=NOW() WHERE id = ANY(:ids)"), {"ids":[i for i, _, _ in ok]})
+    if falhas:
+        conn.execute(text("UPDATE disparo_itens SET status='falha', processado_em=NOW() WHERE id = ANY(:ids)"), {"ids":falhas})
+
+# --- IMPORTAÇÃO DA LISTA ---
+LINHAS_POR_CHUNK = 20_000
+MAX_COLUNAS = 21  # telefone + até 20 variáveis; o que passar disso vai junto numa coluna extra, só para recusar a linha
+
+def normalizar_telefones(serie):
+    # Versão vetorizada do normalizar_telefone: None onde o número é inválido
+    tel = serie.astype(str).str.replace(r'\D', '', regex=True)
+    tel = tel.where(~((tel.str.len() == 11) & ~tel.str.startswith('55')), '55' + tel)
+    return tel.where(tel.str.len() >= 10)
+
+def _detectar_separador(linha):
+    # Mesma prioridade de antes (TAB do Excel, ; do CSV pt-BR, , comum), mas uma vez por arquivo
+    for sep in ('\t', ';', ','):
+        if sep in linha: return sep
+    return ','
+
+def _celula(v):
+    if v is None: return ""
+    if isinstance(v, float) and v.is_integer(): return str(int(v))  # telefone numérico no Excel
+    return str(v)
+
+def _blocos(linhas, chunksize):
+    # Toda linha vira exatamente MAX_COLUNAS + 1 colunas: a última junta o que passar de 20 variáveis,
+    # então nenhuma linha some no parser e a comprida é recusada com o número dela no preparar_lista
+    buf = []
+    for row in linhas:
+        if not any(str(v).strip() for v in row): continue
+        row = list(row)
+        buf.append(row[:MAX_COLUNAS] + [""] * (MAX_COLUNAS - len(row)) + ["".join(row[MAX_COLUNAS:])])
+        if len(buf) >= chunksize: yield pd.DataFrame(buf); buf = []
+    if buf: yield pd.DataFrame(buf)
+
+def ler_lista(fonte, nome="", chunksize=LINHAS_POR_CHUNK):
+    # Lê texto colado, CSV ou XLSX em blocos de strings (coluna 0 = telefone, demais = variáveis)
+    if nome.lower().endswith(('.xlsx', '.xlsm')):
+        from openpyxl import load_workbook
+        ws = load_workbook(fonte, read_only=True, data_only=True).active
+        yield from _blocos(([_celula(v) for v in row] for row in ws.iter_rows(values_only=True)), chunksize)
+        return
+    arq = io.StringIO(fonte) if isinstance(fonte, str) else io.TextIOWrapper(fonte, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        primeira = ""
+        while not primeira.strip():
+            primeira = arq.readline()
+            if not primeira: return
+        arq.seek(0)
+        yield from _blocos(csv.reader(arq, delimiter=_detectar_separador(primeira)), chunksize)
+    finally:
+        if isinstance(arq, io.TextIOWrapper): arq.detach()  # não fecha o arquivo enviado junto com o wrapper
+
+def preparar_lista(fonte, nome=""):
+    # Normaliza, valida e deduplica a lista inteira. Devolve (itens, relatorio), itens = [(telefone, vars_list)].
+    itens, problemas, vistos = [], [], set()
+    total = invalidos = duplicados = 0
+    contagem_vars = {}
+    for n, bloco in enumerate(ler_lista(fonte, nome)):
+        bloco = bloco.reindex(columns=range(MAX_COLUNAS + 1)).fillna("")
+        bloco = bloco.apply(lambda c: c.astype(str).str.strip())
+        if n == 0 and len(bloco) and not bloco.iat[0, 0].replace('+', '').replace(' ', '').isdigit() and any(ch.isalpha() for ch in bloco.iat[0, 0]):
+            bloco = bloco.iloc[1:]  # cabeçalho
+        bloco = bloco[bloco.ne("").any(axis=1)]
+        linhas = pd.RangeIndex(total + 1, total + len(bloco) + 1)
+        total += len(bloco)
+        tel = normalizar_telefones(bloco[0]).set_axis(linhas)
+        # Recusadas em vez de enviadas com variáveis faltando: mais de 20 variáveis (o resto seria cortado) ou
+        # separador diferente da 1ª linha (a linha inteira cai na coluna do telefone e só o número sobrevive)
+        excesso = bloco[MAX_COLUNAS].ne("").set_axis(linhas)
+        misturado = bloco[0].str.contains(r"[\t;,]").set_axis(linhas)
+        vars_df = bloco.iloc[:, 1:MAX_COLUNAS]
+        # qtd de variáveis = até a última coluna preenchida da linha
+        cheio = vars_df.ne("").to_numpy()
+        qtd = pd.Series(cheio.any(axis=1) * (cheio.shape[1] - cheio[:, ::-1].argmax(axis=1)), index=linhas)
+        recusado = excesso | misturado
+        valido = tel.notna() & ~recusado
+        dup = valido & (tel.where(valido).duplicated() | tel.isin(vistos))
+        invalidos += int((~valido).sum()); duplicados += int(dup.sum())
+        for linha, t in bloco[0].set_axis(linhas)[misturado].items(): problemas.append((linha, t, "separador diferente da 1ª linha"))
+        for linha, t in bloco[0].set_axis(linhas)[excesso & ~misturado].items(): problemas.append((linha, t, f"mais de {MAX_COLUNAS - 1} variáveis"))
+        for linha, t in bloco[0].set_axis(linhas)[~valido & ~recusado].items(): problemas.append((linha, t, "telefone inválido"))
+        for linha, t in tel[dup].items(): problemas.append((linha, t, "duplicado"))
+        ok = valido & ~dup
+        vistos.update(tel[ok])
+        for k, v in qtd[ok].value_counts().items(): contagem_vars[int(k)] = contagem_vars.get(int(k), 0) + int(v)
+        vals = vars_df.to_numpy()[ok.to_numpy()]
+        itens.extend((t, list(row[:q])) for t, row, q in zip(tel[ok], vals, qtd[ok]))
+    relatorio = {
+        "total": total, "validos": len(itens), "invalidos": invalidos, "duplicados": duplicados,
+        "contagem_vars": contagem_vars, "moda_vars": max(contagem_vars, key=contagem_vars.get) if contagem_vars else 0,
+        "problemas": pd.DataFrame(problemas[:1000], columns=["linha", "telefone", "motivo"]),
+    }
+    return itens, relatorio
+
+# --- JOBS ---
+# Status do job: pendente -> executando -> concluido | cancelado
+# Status do item: pendente -> enviando -> enviado | falha | incerto (caiu entre o envio e o checkpoint)
+HEARTBEAT_EXPIRA = 120
+HEARTBEAT_INTERVALO = 30  # thread própria: janela lenta (limite da Meta, backoff) não deixa o heartbeat vencer
+LOTE_ITENS = 500
+JANELA_ENVIO = 100  # itens marcados 'enviando' de uma vez; limita o que vira 'incerto' numa queda
+
+# Tabelas disparo_jobs / disparo_itens: migração 13 (migracoes.py)
+def enfileirar_disparo(itens, tpl, custo, vendedora_id, criado_por, cabecalho=None):
+    # cabecalho = (tipo, media_id) já registrado: um upload só para o lote inteiro
+    mt, mid = cabecalho or (None, None)
+    with conexao() as conn:
+        jid = conn.execute(text("INSERT INTO disparo_jobs (template, custo, vendedora_id, criado_por, total, midia_tipo, midia_id) VALUES (:t, :c, :v, :u, :n, :mt, :mid) RETURNING id"),
+                           {"t":tpl, "c":float(custo), "v":vendedora_id, "u":criado_por, "n":len(itens), "mt":mt, "mid":mid}).fetchone()[0]
+        conn.execute(text("INSERT INTO disparo_itens (job_id, linha, telefone, variaveis) VALUES (:j, :l, :t, :v)"),
+                     [{"j":jid, "l":i, "t":tel, "v":json.dumps(vs)} for i, (tel, vs) in enumerate(itens)])
+        conn.commit()
+    return jid
+
+def listar_jobs(limite=20):
+    try:
+        with conexao() as conn:
+            return pd.read_sql(text("SELECT id, template, status, total, enviados, falhas, taxa, criado_em, concluido_em FROM disparo_jobs ORDER BY id DESC LIMIT :l"), conn, params={"l":limite})
+    except: return pd.DataFrame()
+
+def cancelar_job(jid):
+    with conexao() as conn:
+        conn.execute(text("UPDATE disparo_jobs SET status='cancelado', concluido_em=NOW() WHERE id=:id AND status IN ('pendente','executando')"), {"id":jid})
+        conn.commit()
+
+def reivindicar_job(worker_id):
+    # Pega o próximo job pendente, ou um 'executando' cujo worker parou de dar heartbeat
+    with conexao() as conn:
+        row = conn.execute(text("""
+            UPDATE disparo_jobs SET status='executando', worker=:w, heartbeat=NOW()
+            WHERE id = (
+                SELECT id FROM disparo_jobs
+                WHERE status='pendente' OR (status='executando' AND (heartbeat IS NULL OR heartbeat < NOW() - make_interval(secs => :exp)))
+                ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED)
+            RETURNING id, template, custo, vendedora_id, midia_tipo, midia_id
+        """), {"w":worker_id, "exp":HEARTBEAT_EXPIRA}).fetchone()
+        if row:
+            conn.execute(text("UPDATE disparo_itens SET status='incerto', processado_em=NOW() WHERE job_id=:j AND status='enviando'"), {"j":row[0]})
+        conn.commit()
+        return row
+
+def _atualizar_progresso(jid, worker_id, taxa=None, final=False):
+    # Sem linha de volta = cancelado ou outro worker assumiu o job
+    with conexao() as conn:
+        row = conn.execute(text(f"""
+            UPDATE disparo_jobs j SET
+                enviados = (SELECT COUNT(*) FROM disparo_itens WHERE job_id=j.id AND status='enviado'),
+                falhas = (SELECT COUNT(*) FROM disparo_itens WHERE job_id=j.id AND status IN ('falha','incerto')),
+                taxa = COALESCE(:tx, j.taxa), heartbeat = NOW()
+                {", status = CASE WHEN j.status='executando' THEN 'concluido' ELSE j.status END, concluido_em = NOW()" if final else ""}
+            WHERE j.id=:id AND j.worker=:eu RETURNING j.status
+        """), {"id":jid, "eu":worker_id, "tx":taxa}).fetchone()
+        conn.commit()
+    return row[0] if row else 'cancelado'
+
+def _manter_heartbeat(jid, worker_id, parar, perdido):
+    while not parar.wait(HEARTBEAT_INTERVALO):
+        try:
+            with conexao() as conn:
+                vivo = conn.execute(text("UPDATE disparo_jobs SET heartbeat=NOW() WHERE id=:id AND worker=:eu AND status='executando' RETURNING id"),
+                                    {"id":jid, "eu":worker_id}).fetchone()
+                conn.commit()
+        except Exception:
+            logging.exception("disparo: heartbeat do job %s", jid)
+            continue
+        if not vivo:
+            perdido.set()
+            return
+
+def _marcar_janela(jid, worker_id, ids):
+    # Só o dono do job marca itens, e só os que ainda estão pendentes; o FOR SHARE faz o reivindicar_job
+    # de outro worker esperar este commit (e então virar 'incerto' o que ficou 'enviando' aqui)
+    with conexao() as conn:
+        if not conn.execute(text("SELECT 1 FROM disparo_jobs WHERE id=:j AND worker=:eu AND status='executando' FOR SHARE"),
+                            {"j":jid, "eu":worker_id}).fetchone(): return None
+        marcados = {r[0] for r in conn.execute(text("UPDATE disparo_itens SET status='enviando' WHERE id = ANY(:ids) AND status='pendente' RETURNING id"), {"ids":ids})}
+        conn.commit()
+    return marcados
+
+def executar_job(job, worker_id, taxa_meta=TAXA_META_PADRAO, workers=WORKERS_PADRAO):
+    jid, tpl, custo, vendedora_id, midia_tipo, midia_id = job
+    cabecalho = (midia_tipo, midia_id) if midia_id else None
+    limitador = LimitadorTaxa(taxa_meta)
+    enviar = lambda it: enviar_com_backoff(lambda: enviar_mensagem_api(it[1], "", "template", tpl, variaveis=it[2], cabecalho=cabecalho), limitador)[0] in [200, 201]
+    parar, perdido = threading.Event(), threading.Event()
+    threading.Thread(target=_manter_heartbeat, args=(jid, worker_id, parar, perdido), daemon=True, name=f"heartbeat-{jid}").start()
+    try:
+        while True:
+            with conexao() as conn:
+                lote = conn.execute(text("SELECT id, telefone, variaveis FROM disparo_itens WHERE job_id=:j AND status='pendente' ORDER BY linha LIMIT :n"),
+                                    {"j":jid, "n":LOTE_ITENS}).fetchall()
+            if not lote: break
+            tels = {r[0]: normalizar_telefone(r[1]) for r in lote}
+            contatos = resolver_contatos(tels.values(), vendedora_id)
+            itens = [(r[0], r[1], json.loads(r[2] or "[]"), contatos.get(tels[r[0]])) for r in lote]
+            for k in range(0, len(itens), JANELA_ENVIO):
+                # Perdeu o job (cancelado ou heartbeat vencido e outro worker assumiu): para antes de marcar mais itens
+                marcados = None if perdido.is_set() else _marcar_janela(jid, worker_id, [it[0] for it in itens[k:k + JANELA_ENVIO]])
+                if marcados is None: return
+                janela = [it for it in itens[k:k + JANELA_ENVIO] if it[0] in marcados]
+                validos = [it for it in janela if it[3]]
+                ok, falhas = [], [it[0] for it in janela if not it[3]]
+                taxa = None
+                for i, enviado, _, taxa, _ in executar_lote(validos, enviar, workers=workers):
+                    if enviado: ok.append((validos[i][0], validos[i][3], validos[i][2]))
+                    else: falhas.append(validos[i][0])
+                # O que foi marcado aqui já saiu para a Meta: grava mesmo que o job tenha mudado de dono no meio
+                with conexao() as conn:
+                    gravar_resultados(conn, ok, falhas, tpl, custo)
+                    conn.commit()
+                if _atualizar_progresso(jid, worker_id, taxa) == 'cancelado': return
+        _atualizar_progresso(jid, worker_id, final=True)
+    finally: parar.set()
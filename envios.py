@@ -0,0 +1,88 @@
+# Envios do chat (template e arquivo) em segundo plano: o agente não fica esperando a Meta.
+# Cada envio é um dict guardado na sessão que o criou; a thread só mexe nele para trocar o status
+# (pendente -> enviado | falha) e, no sucesso, anotar o id da mensagem gravada, para a conversa trocar
+# a bolha provisória pela real quando ela chegar no carregamento incremental.
+import logging
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import text
+from banco import conexao, segredo
+from meta_api import enviar_mensagem_api, enviar_midia
+
+_executor = ThreadPoolExecutor(max_workers=int(segredo("ENVIOS_WORKERS", 8)), thread_name_prefix="envio")
+
+
+class LeitorMemoria:
+    # Leitura sobre os bytes do UploadedFile (já em memória) sem copiá-los, com cursor próprio:
+    # dois cliques seguidos no mesmo arquivo não disputam seek/read
+    def __init__(self, buffer):
+        self._visao = memoryview(buffer).toreadonly()
+        self._pos = 0
+
+    def getbuffer(self): return self._visao
+    def tell(self): return self._pos
+
+    def seek(self, pos, onde=0):
+        self._pos = max(0, pos + (0, self._pos, len(self._visao))[onde])
+        return self._pos
+
+    def read(self, n=-1):
+        fim = len(self._visao) if n is None or n < 0 else min(len(self._visao), self._pos + n)
+        bloco = self._visao[self._pos:fim].tobytes()
+        self._pos = max(self._pos, fim)
+        return bloco
+
+    def liberar(self): self._visao.release()
+
+
+def _novo(cid, tipo, texto):
+    return {"id": uuid.uuid4().hex, "cid": cid, "tipo": tipo, "texto": texto, "status": "pendente",
+            "erro": None, "msg_id": None, "url_media": None, "data_envio": datetime.now(), "repetir": None}
+
+def _gravar(envio, custo=0, contexto=None):
+    with conexao() as conn:
+        row = conn.execute(text("""INSERT INTO mensagens (contato_id, remetente, texto, tipo, url_media, custo)
+                                   VALUES (:cid, 'empresa', :t, :tipo, :url, :c) RETURNING id, data_envio"""),
+                           {"cid": envio["cid"], "t": envio["texto"], "tipo": envio["tipo"], "url": envio["url_media"], "c": custo}).fetchone()
+        if contexto: conn.execute(text("UPDATE contatos SET contexto_bot = :ctx WHERE id = :id"), {"ctx": contexto, "id": envio["cid"]})
+        conn.commit()
+    envio["msg_id"], envio["data_envio"] = row
+
+def _executar(envio, enviar, gravar):
+    try: c, r = enviar()
+    except Exception as e:
+        logging.exception("envios: falha ao enviar %s", envio["id"])
+        c, r = 500, str(e)
+    if c not in (200, 201):
+        envio["erro"], envio["status"] = f"Erro Meta: {r}", "falha"
+        return
+    try: gravar()
+    except Exception as e:
+        # Já foi para o cliente: não oferece repetir, senão ele recebe duas vezes
+        logging.exception("envios: %s enviado mas não gravado", envio["id"])
+        envio["erro"], envio["repetir"], envio["status"] = f"Enviado, mas não ficou no histórico: {e}", None, "falha"
+        return
+    envio["status"] = "enviado"
+
+def enviar_template(cid, telefone, tpl, variaveis, custo):
+    envio = _novo(cid, "template", f"[TPL: {tpl}] Vars: {variaveis}")
+    envio["repetir"] = lambda: enviar_template(cid, telefone, tpl, variaveis, custo)
+    _executor.submit(_executar, envio, lambda: enviar_mensagem_api(telefone, "", "template", tpl, variaveis=variaveis),
+                     lambda: _gravar(envio, custo=custo, contexto=tpl))
+    return envio
+
+def enviar_arquivo(cid, telefone, arquivo, nome, mime, tipo):
+    dados = LeitorMemoria(arquivo.getbuffer())
+    envio = _novo(cid, tipo, f"Arq: {nome}")
+    envio["repetir"] = lambda: enviar_arquivo(cid, telefone, dados, nome, mime, tipo)
+    def enviar():
+        c, r, mid = enviar_midia(telefone, dados, nome, mime, tipo)
+        envio["url_media"] = mid
+        if c in (200, 201):
+            # Já está na Meta: sem repetir, a sessão não precisa mais segurar o arquivo
+            envio["repetir"] = None
+            dados.liberar()
+        return c, r
+    _executor.submit(_executar, envio, enviar, lambda: _gravar(envio))
+    return envio
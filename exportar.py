@@ -0,0 +1,114 @@
+import csv
+import datetime as dt
+import io
+import tempfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import text
+from banco import engine, segredo
+from fila import SQL_FILA
+from arquivo import mensagens_arquivadas
+
+# Exportações em CSV/Parquet lidas por cursor no servidor (stream_results) em blocos de LINHAS_POR_BLOCO e
+# escritas num arquivo temporário. O download_button do Streamlit carrega o arquivo pronto inteiro na memória
+# para servir, por isso a exportação tem teto (EXPORTAR_MAX_MB) e para com erro quando passa dele.
+LINHAS_POR_BLOCO = 10_000
+EXPORTAR_MAX_MB = int(segredo("EXPORTAR_MAX_MB", 200))
+
+# OID do Postgres -> tipo Arrow (o resto vira texto)
+TIPOS_ARROW = {16: pa.bool_(), 20: pa.int64(), 21: pa.int64(), 23: pa.int64(), 700: pa.float64(), 701: pa.float64(),
+               1700: pa.float64(), 1082: pa.date32(), 1114: pa.timestamp("us"), 1184: pa.timestamp("us", tz="UTC")}
+
+def _blocos(sql, params):
+    # (colunas, tipos, blocos de linhas) com cursor nomeado; conexão própria, fora da sessão do Streamlit
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=LINHAS_POR_BLOCO) as conn:
+        res = conn.execute(text(sql), params)
+        desc = res.cursor.description  # antes do primeiro fetchmany: resultado pequeno fecha o cursor junto
+        yield [d[0] for d in desc], [TIPOS_ARROW.get(d[1], pa.string()) for d in desc]
+        bloco = res.fetchmany(LINHAS_POR_BLOCO)
+        while bloco:
+            yield bloco
+            bloco = res.fetchmany(LINHAS_POR_BLOCO)
+
+def _celula_csv(v):
+    if isinstance(v, dt.datetime): return v.strftime("%Y-%m-%d %H:%M:%S")
+    return v
+
+def _coluna(valores, tipo):
+    if pa.types.is_floating(tipo): valores = [None if v is None else float(v) for v in valores]
+    elif pa.types.is_string(tipo): valores = [None if v is None else str(v) for v in valores]
+    return pa.array(valores, type=tipo)
+
+def _conferir_tamanho(saida):
+    if saida.tell() > EXPORTAR_MAX_MB * 1024 * 1024:
+        raise ValueError(f"Exportação passou de {EXPORTAR_MAX_MB} MB; reduza o período ou exporte por partes.")
+
+def _escrever(origem, formato):
+    # origem: gerador (colunas, tipos) seguido de blocos de tuplas. Devolve arquivo temporário posicionado no início.
+    saida = tempfile.TemporaryFile()
+    colunas, tipos = next(origem)
+    try:
+        if formato == "parquet":
+            schema = pa.schema(list(zip(colunas, tipos)))
+            with pq.ParquetWriter(saida, schema, compression="zstd") as w:
+                for bloco in origem:
+                    w.write_table(pa.Table.from_arrays([_coluna(col, t) for col, t in zip(zip(*bloco), tipos)], schema=schema))
+                    _conferir_tamanho(saida)
+        else:
+            texto = io.TextIOWrapper(saida, encoding="utf-8-sig", newline="", write_through=True)
+            w = csv.writer(texto, delimiter=";")
+            w.writerow(colunas)
+            for bloco in origem:
+                w.writerows([_celula_csv(v) for v in linha] for linha in bloco)
+                _conferir_tamanho(saida)
+            texto.flush(); texto.detach()
+    except Exception:
+        saida.close()
+        raise
+    finally:
+        origem.close()  # devolve a conexão do cursor também quando para no meio
+    saida.seek(0)
+    return saida
+
+def _com_arquivadas(cid, origem):
+    # Conversa completa: primeiro o que está arquivado em Parquet, depois o que está no banco
+    colunas, tipos = next(origem)
+    yield colunas, tipos
+    arq = mensagens_arquivadas(cid)
+    if not arq.empty:
+        arq = arq.astype(object).where(arq.notna(), None)
+        for i in range(0, len(arq), LINHAS_POR_BLOCO):
+            yield [tuple(r) for r in arq[colunas].iloc[i:i + LINHAS_POR_BLOCO].itertuples(index=False)]
+    yield from origem
+
+
+# --- CONSULTAS EXPORTÁVEIS ---
+def exportar_conversa(cid, formato="csv"):
+    sql = "SELECT id, contato_id, remetente, texto, tipo, url_media, data_envio, custo FROM mensagens WHERE contato_id = :c ORDER BY data_envio, id"
+    return _escrever(_com_arquivadas(cid, _blocos(sql, {"c": int(cid)})), formato)
+
+def exportar_mensagens(dias, formato="csv"):
+    # Só o que está no banco; conversas arquivadas já estão em Parquet (MSG_ARCHIVE_DIR)
+    return _escrever(_blocos("""
+        SELECT m.id, m.contato_id, c.nome AS contato, c.whatsapp_id, m.remetente, m.texto, m.tipo, m.url_media, m.data_envio, m.custo
+        FROM mensagens m JOIN contatos c ON c.id = m.contato_id
+        WHERE m.data_envio >= NOW() - make_interval(days => :d)
+        ORDER BY m.data_envio, m.id
+    """, {"d": int(dias)}), formato)
+
+def exportar_fila(formato="csv"):
+    return _escrever(_blocos(SQL_FILA, {}), formato)
+
+def exportar_contatos(formato="csv"):
+    return _escrever(_blocos("""
+        SELECT c.id, c.nome, c.whatsapp_id, c.codigo_cliente, c.cpf_cnpj, c.status_atendimento, u.nome AS vendedora, c.ultima_interacao
+        FROM contatos c LEFT JOIN usuarios u ON u.id = c.vendedora_id ORDER BY c.id
+    """, {}), formato)
+
+def exportar_custos(dias, formato="csv"):
+    return _escrever(_blocos("""
+        SELECT cd.dia, COALESCE(u.nome, '(sem vendedora)') AS vendedora, COALESCE(NULLIF(cd.template, ''), '(avulsas)') AS template, cd.qtd, cd.custo
+        FROM custos_diarios cd LEFT JOIN usuarios u ON u.id = cd.vendedora_id
+        WHERE cd.dia >= CURRENT_DATE - make_interval(days => :d)
+        ORDER BY cd.dia, vendedora, template
+    """, {"d": int(dias)}), formato)
@@ -0,0 +1,149 @@
+import logging
+import re
+import select
+import threading
+import time
+import pandas as pd
+from sqlalchemy import text
+from banco import engine, conexao
+from cache import assinar
+
+# Triggers em contatos/usuarios (migração 15) avisam neste canal; cada processo mantém um único snapshot da fila
+CANAL = "fila_contatos"
+INTERVALO_COMPLETO = 60    # recarga de segurança mesmo sem NOTIFY
+INTERVALO_SEM_LISTEN = 5   # enquanto o LISTEN estiver fora do ar
+DEBOUNCE = 1.0             # rajadas de NOTIFY viram uma recarga só
+
+SQL_FILA = """
+    SELECT c.id, c.nome, c.whatsapp_id, c.status_atendimento, u.nome as vendedora, c.codigo_cliente, c.vendedora_id
+    FROM contatos c
+    LEFT JOIN usuarios u ON c.vendedora_id = u.id
+    WHERE c.status_atendimento != 'encerrado'
+    ORDER BY c.ultima_interacao DESC
+"""
+
+class FilaCompartilhada:
+    def __init__(self):
+        self._df = pd.DataFrame()
+        self._trava = threading.Lock()
+        self._sujo = threading.Event()
+        self.ouvindo = False
+        self.atualizado_em = 0.0
+
+    def iniciar(self):
+        self.recarregar()
+        threading.Thread(target=self._ouvir, daemon=True, name="fila-listen").start()
+        threading.Thread(target=self._atualizador, daemon=True, name="fila-recarga").start()
+        assinar(self._invalidado)  # invalidações vindas de outras réplicas pelo backend de cache
+        return self
+
+    def recarregar(self):
+        with conexao() as conn: df = pd.read_sql(text(SQL_FILA), conn)
+        with self._trava:
+            self._df = df
+            self.atualizado_em = time.time()
+
+    def _invalidado(self, tabela):
+        if tabela in ("fila", "usuarios"): self._sujo.set()
+
+    def filtrar(self, admin=False, usuario_id=None):
+        with self._trava: df = self._df
+        if not admin: df = df[(df['vendedora_id'] == usuario_id) | df['vendedora_id'].isna()]
+        return df.drop(columns=['vendedora_id']).reset_index(drop=True)
+
+    def pagina(self, admin=False, usuario_id=None, status=None, pagina=0, por_pagina=50):
+        # Sem busca a página sai do snapshot em memória: nenhuma consulta por rerun
+        df = self.filtrar(admin, usuario_id)
+        contagem = df['status_atendimento'].value_counts().to_dict()
+        if status: df = df[df['status_atendimento'] == status]
+        return df.iloc[pagina * por_pagina:(pagina + 1) * por_pagina].reset_index(drop=True), len(df), contagem
+
+    def _atualizador(self):
+        while True:
+            avisado = self._sujo.wait(timeout=INTERVALO_COMPLETO if self.ouvindo else INTERVALO_SEM_LISTEN)
+            if avisado: time.sleep(max(0.0, DEBOUNCE - (time.time() - self.atualizado_em)))
+            self._sujo.clear()
+            try: self.recarregar()
+            except Exception: logging.exception("fila: erro ao recarregar"); time.sleep(2)
+
+    def _ouvir(self):
+        espera = 1
+        while True:
+            raw = None
+            try:
+                raw = engine.raw_connection()
+                pg = raw.driver_connection
+                raw.detach()  # conexão dedicada ao LISTEN, fora do pool
+                pg.autocommit = True
+                with pg.cursor() as cur: cur.execute(f"LISTEN {CANAL}")
+                self.ouvindo, espera = True, 1
+                self._sujo.set()  # pode ter perdido avisos enquanto estava desconectado
+                while True:
+                    if select.select([pg], [], [], 30) == ([], [], []):
+                        with pg.cursor() as cur: cur.execute("SELECT 1")  # detecta conexão morta
+                        continue
+                    pg.poll()
+                    if pg.notifies:
+                        pg.notifies.clear()
+                        self._sujo.set()
+            except Exception: logging.exception("fila: LISTEN caiu, reconectando")
+            finally:
+                self.ouvindo = False
+                try: raw.close()
+                except Exception: pass
+            time.sleep(espera)
+            espera = min(60, espera * 2)
+
+
+_trgm = None
+
+def tem_trgm():
+    global _trgm
+    if _trgm is None:
+        with conexao() as conn: _trgm = bool(conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).fetchone())
+    return _trgm
+
+def buscar_fila(termo, admin=False, usuario_id=None, status=None, pagina=0, por_pagina=50):
+    # Busca no servidor por nome, código ou telefone (índices da migração 7), já paginada: com pg_trgm acha
+    # qualquer trecho, sem ele só o começo.
+    # Devolve (página, total do filtro, {status: qtd} da busca).
+    termo = termo.strip()
+    digitos = re.sub(r"\D", "", termo)
+    conds = ["c.status_atendimento != 'encerrado'"]
+    params = {"lim": por_pagina, "off": pagina * por_pagina}
+    if tem_trgm():
+        busca = ["c.nome ILIKE :p", "c.codigo_cliente ILIKE :p", "c.whatsapp_id LIKE :d"]
+        params.update(p=f"%{termo}%", d=f"%{digitos}%")
+    else:
+        busca = ["lower(c.nome) LIKE :p", "lower(c.codigo_cliente) LIKE :p", "lower(c.whatsapp_id) LIKE :d"]
+        params.update(p=termo.lower() + "%", d=(digitos if digitos.startswith("55") else "55" + digitos) + "%")
+    if len(digitos) < 4: busca.pop()
+    conds.append("(" + " OR ".join(busca) + ")")
+    if not admin:
+        conds.append("(c.vendedora_id = :uid OR c.vendedora_id IS NULL)")
+        params["uid"] = usuario_id
+    where = " AND ".join(conds)
+    with conexao() as conn:
+        contagem = dict(conn.execute(text(f"SELECT c.status_atendimento, COUNT(*) FROM contatos c WHERE {where} GROUP BY 1"), params).fetchall())
+        if status:
+            where += " AND c.status_atendimento = :st"
+            params["st"] = status
+        df = pd.read_sql(text(f"""
+            SELECT c.id, c.nome, c.whatsapp_id, c.status_atendimento, u.nome as vendedora, c.codigo_cliente
+            FROM contatos c LEFT JOIN usuarios u ON c.vendedora_id = u.id
+            WHERE {where}
+            ORDER BY c.ultima_interacao DESC NULLS LAST, c.id DESC
+            LIMIT :lim OFFSET :off
+        """), conn, params=params)
+    total = contagem.get(status, 0) if status else sum(contagem.values())
+    return df, total, contagem
+
+
+_fila = None
+_fila_trava = threading.Lock()
+
+def fila_compartilhada():
+    global _fila
+    with _fila_trava:
+        if _fila is None: _fila = FilaCompartilhada().iniciar()
+    return _fila
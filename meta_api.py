@@ -0,0 +1,251 @@
+import hashlib
+import io
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sqlalchemy import text
+from banco import segredo, conexao
+from midia import CacheMidia, gerar_miniatura
+from metricas import metricas, medir
+
+GRAPH_URL = str(segredo("META_GRAPH_URL", "https://graph.facebook.com/v18.0")).rstrip('/')  # aponte para um Graph fake em testes
+TIMEOUT = (float(segredo("META_TIMEOUT_CONEXAO", 5)), float(segredo("META_TIMEOUT_LEITURA", 30)))
+
+
+class ClienteGraph:
+    # Uma Session por processo: conexões keep-alive reaproveitadas entre reruns, sessões e threads do disparo.
+    # Retry só em GET (idempotente) e em falha de conexão; POST /messages não é repetido aqui (o 429 é tratado no disparo).
+    def __init__(self, base_url=GRAPH_URL, pool=32, tentativas=3, timeout=TIMEOUT):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.sessao = requests.Session()
+        retry = Retry(total=tentativas, connect=tentativas, read=tentativas, status=tentativas,
+                      backoff_factor=0.3, backoff_jitter=0.3, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset({"GET", "HEAD"}), raise_on_status=False)
+        adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=pool, max_retries=retry)
+        self.sessao.mount("https://", adaptador)
+        self.sessao.mount("http://", adaptador)
+        self.latencias = {}
+        self._trava = threading.Lock()
+
+    def _registrar(self, endpoint, segundos, erro):
+        with self._trava:
+            e = self.latencias.setdefault(endpoint, {"chamadas": 0, "erros": 0, "total_s": 0.0, "max_s": 0.0})
+            e["chamadas"] += 1; e["erros"] += int(erro)
+            e["total_s"] += segundos; e["max_s"] = max(e["max_s"], segundos)
+        metricas.registrar_graph(endpoint, segundos, erro)
+
+    def requisicao(self, endpoint, metodo, url, **kw):
+        kw.setdefault("timeout", self.timeout)
+        kw.setdefault("headers", {})["Authorization"] = f"Bearer {segredo('META_TOKEN')}"
+        inicio, erro = time.perf_counter(), True
+        try:
+            resp = self.sessao.request(metodo, url if url.startswith("http") else f"{self.base_url}/{url.lstrip('/')}", **kw)
+            erro = resp.status_code >= 400
+            return resp
+        finally: self._registrar(endpoint, time.perf_counter() - inicio, erro)
+
+    def get(self, endpoint, url, **kw): return self.requisicao(endpoint, "GET", url, **kw)
+    def post(self, endpoint, url, **kw): return self.requisicao(endpoint, "POST", url, **kw)
+
+    def resumo_latencias(self):
+        with self._trava:
+            return [{"endpoint": k, "chamadas": v["chamadas"], "erros": v["erros"],
+                     "media_ms": round(1000 * v["total_s"] / v["chamadas"], 1), "max_ms": round(1000 * v["max_s"], 1)}
+                    for k, v in sorted(self.latencias.items())]
+
+
+cliente_graph = ClienteGraph(pool=int(segredo("META_POOL", 32)))
+cache_midia = CacheMidia(str(segredo("MEDIA_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "semprechat", "midia"))),
+                         limite_bytes=int(float(segredo("MEDIA_CACHE_MB", 512)) * 1024 * 1024),
+                         ttl_url=int(segredo("MEDIA_URL_TTL", 240)))
+
+
+# --- UPLOAD / REGISTRO DE MÍDIA ---
+# A Meta guarda a mídia enviada por 30 dias: o mesmo arquivo (mesmo hash) reaproveita o media_id enquanto valer.
+VALIDADE_MEDIA_ID = float(segredo("MEDIA_ID_VALIDADE_DIAS", 29))
+BLOCO = 1024 * 1024
+# Recusas Graph de um media_id reaproveitado que não vale mais: 131053 (mídia) e (#100) sobre o id do anexo
+CODIGOS_MIDIA_INVALIDA = {131053}
+SUBCODIGOS_MIDIA_INVALIDA = {2494102}
+
+class CorpoMultipart:
+    # multipart/form-data lido em blocos direto do arquivo, sem montar o corpo em memória:
+    # o requests usa len() para o Content-Length e o urllib3 envia chamando read() aos pedaços
+    def __init__(self, campos, nome, arquivo, mime, tamanho):
+        limite = uuid.uuid4().hex
+        nome = str(nome).replace('"', '%22')
+        pre = "".join(f'--{limite}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n' for k, v in campos.items())
+        pre += f'--{limite}\r\nContent-Disposition: form-data; name="file"; filename="{nome}"\r\nContent-Type: {mime}\r\n\r\n'
+        pos = f"\r\n--{limite}--\r\n".encode()
+        self._partes = [io.BytesIO(pre.encode()), arquivo, io.BytesIO(pos)]
+        self._tamanho = len(pre.encode()) + tamanho + len(pos)
+        self.content_type = f"multipart/form-data; boundary={limite}"
+
+    def __len__(self): return self._tamanho
+
+    def read(self, n=-1):
+        if n is None or n < 0: n = self._tamanho
+        pedacos = []
+        while self._partes and n > 0:
+            b = self._partes[0].read(n)
+            if not b: self._partes.pop(0); continue
+            pedacos.append(b); n -= len(b)
+        return b"".join(pedacos)
+
+def hash_arquivo(arquivo):
+    # sha256 em blocos; devolve o arquivo no início para o upload
+    h, tamanho = hashlib.sha256(), 0
+    arquivo.seek(0)
+    for bloco in iter(lambda: arquivo.read(BLOCO), b""): h.update(bloco); tamanho += len(bloco)
+    arquivo.seek(0)
+    return h.hexdigest(), tamanho
+
+def _subir(arquivo, nome, mime, tamanho):
+    corpo = CorpoMultipart({"messaging_product": "whatsapp", "type": mime}, nome, arquivo, mime, tamanho)
+    response = cliente_graph.post("media_upload", f"{segredo('META_PHONE_ID')}/media", data=corpo, headers={"Content-Type": corpo.content_type})
+    if response.status_code == 200: return response.json()['id']
+    return None
+
+_subindo = {}  # hash -> trava; uma por arquivo distinto enviado por este processo
+_subindo_trava = threading.Lock()
+
+def registrar_midia(arquivo, nome, mime, validade_minima_dias=1):
+    # (media_id, hash, reaproveitado). Uploads simultâneos do mesmo arquivo neste processo viram um só.
+    h, tamanho = hash_arquivo(arquivo)
+    with _subindo_trava: trava = _subindo.setdefault(h, threading.Lock())
+    with trava:
+        try:
+            with conexao() as conn:
+                row = conn.execute(text("SELECT media_id FROM midias_meta WHERE hash=:h AND expira_em > NOW() + :d * INTERVAL '1 day'"),
+                                   {"h": h, "d": validade_minima_dias}).fetchone()
+            if row: return row[0], h, True
+        except Exception: pass  # sem a tabela (migração 9) só não há reaproveitamento
+        mid = _subir(arquivo, nome, mime, tamanho)
+        if mid:
+            try:
+                with conexao() as conn:
+                    conn.execute(text("""
+                        INSERT INTO midias_meta (hash, media_id, mime, nome, tamanho, enviado_em, expira_em)
+                        VALUES (:h, :m, :t, :n, :s, NOW(), NOW() + :v * INTERVAL '1 day')
+                        ON CONFLICT (hash) DO UPDATE SET media_id=EXCLUDED.media_id, mime=EXCLUDED.mime, nome=EXCLUDED.nome,
+                            enviado_em=EXCLUDED.enviado_em, expira_em=EXCLUDED.expira_em
+                    """), {"h": h, "m": mid, "t": mime, "n": nome, "s": tamanho, "v": VALIDADE_MEDIA_ID})
+                    conn.commit()
+            except Exception: pass
+    return mid, h, False
+
+def esquecer_midia(h):
+    with conexao() as conn:
+        conn.execute(text("DELETE FROM midias_meta WHERE hash=:h"), {"h": h})
+        conn.commit()
+
+def upload_para_meta(uploaded_file, mime_type):
+    try: return registrar_midia(uploaded_file, uploaded_file.name, mime_type)[0]
+    except: return None
+
+def media_id_recusado(resp):
+    # Limite (130429) e outros 400 não se resolvem subindo o arquivo de novo
+    erro = (resp.get('error') or {}) if isinstance(resp, dict) else {}
+    if erro.get('code') in CODIGOS_MIDIA_INVALIDA: return True
+    return erro.get('code') == 100 and (erro.get('error_subcode') in SUBCODIGOS_MIDIA_INVALIDA or 'media' in str(erro.get('message', '')).lower())
+
+def enviar_midia(telefone, arquivo, nome, mime, tipo):
+    # Envia reaproveitando o media_id; se a Meta recusar um id reaproveitado (expirado/removido), sobe de novo uma vez
+    try: mid, h, reaproveitado = registrar_midia(arquivo, nome, mime)
+    except Exception as e: return 500, str(e), None
+    if not mid: return 500, "Falha no upload", None
+    c, r = enviar_mensagem_api(telefone, mid, tipo=tipo)
+    if reaproveitado and c == 400 and media_id_recusado(r):
+        esquecer_midia(h)
+        mid, h, _ = registrar_midia(arquivo, nome, mime)
+        if not mid: return 500, "Falha no upload", None
+        c, r = enviar_mensagem_api(telefone, mid, tipo=tipo)
+    return c, r, mid
+
+def info_midia(media_id):
+    # {url, mime_type, file_size, ...}; a URL da Meta vale ~5 min, daí o TTL curto
+    try: return cache_midia.info_url(str(media_id), lambda mid: cliente_graph.get("media_info", mid).json())
+    except: return None
+
+def _baixar_midia(media_id):
+    r = info_midia(media_id)
+    if r and 'url' in r:
+        resp = cliente_graph.get("media_download", r['url'])
+        if resp.status_code == 200: return resp.content
+    return None
+
+@medir("get_media_bytes")
+def get_media_bytes(media_id):
+    try: return cache_midia.obter(str(media_id), _baixar_midia)
+    except: return None
+
+# --- PRÉVIAS (miniatura + selo) ---
+# Geradas uma vez em segundo plano e guardadas no cache; a conversa nunca espera por elas.
+_previas = ThreadPoolExecutor(max_workers=4, thread_name_prefix="previa")
+_previas_pendentes = set()
+_previas_falhas = {}  # media_id -> quando falhou; só tenta de novo depois de PREVIA_REPETIR_S, nada vai para o disco
+_previas_trava = threading.Lock()
+PREVIA_REPETIR_S = 60
+
+def _gerar_previa(media_id, tipo):
+    ok = False
+    try:
+        info = info_midia(media_id)
+        if not info or 'error' in info: return  # falha da Graph (rede, 5xx, token): não grava metadado vazio
+        meta = {"mime_type": info.get("mime_type"), "file_size": info.get("file_size")}
+        if tipo == 'image':
+            dados = get_media_bytes(media_id)
+            if not dados: return
+            mini = gerar_miniatura(dados)  # None aqui é arquivo que não vira imagem: isso sim fica gravado
+            if mini: cache_midia.obter(f"thumb:{media_id}", lambda _: mini)
+            meta["miniatura"] = bool(mini)
+        cache_midia.salvar_meta(media_id, meta)
+        ok = True
+    finally:
+        with _previas_trava:
+            _previas_pendentes.discard(media_id)
+            if ok: _previas_falhas.pop(media_id, None)
+            else: _previas_falhas[media_id] = time.time()
+
+@medir("previa_midia")
+def previa_midia(media_id, tipo):
+    # Devolve (miniatura | None, metadados | None) só com o que já está em disco; o que faltar é agendado
+    mid = str(media_id)
+    meta = cache_midia.meta(mid)
+    mini = cache_midia.ler(f"thumb:{mid}") if tipo == 'image' and meta and meta.get("miniatura") else None
+    if meta is None or (meta.get("miniatura") and mini is None):
+        with _previas_trava:
+            if mid not in _previas_pendentes and time.time() - _previas_falhas.get(mid, 0) > PREVIA_REPETIR_S:
+                _previas_pendentes.add(mid)
+                _previas.submit(_gerar_previa, mid, tipo)
+    return mini, meta
+
+def enviar_mensagem_api(telefone, conteudo, tipo="text", template_name=None, variaveis=None, cabecalho=None):
+    tel = ''.join(filter(str.isdigit, str(telefone)))
+    if len(tel) == 13 and tel.startswith("55"): tel = tel[:4] + tel[5:]
+    
+    payload = {"messaging_product": "whatsapp", "to": tel, "type": tipo}
+    
+    if tipo == 'text': payload['text'] = {"body": conteudo}
+    elif tipo == 'template': 
+        components = []
+        if cabecalho:  # (tipo, media_id) para template com cabeçalho de mídia
+            components.append({"type": "header", "parameters": [{"type": cabecalho[0], cabecalho[0]: {"id": cabecalho[1]}}]})
+        if variaveis and len(variaveis) > 0:
+            params = [{"type": "text", "text": str(v)} for v in variaveis]
+            components.append({"type": "body", "parameters": params})
+        payload['template'] = {"name": template_name, "language": {"code": "pt_BR"}, "components": components}
+    elif tipo == 'image': payload['image'] = {"id": conteudo}
+    elif tipo == 'document': payload['document'] = {"id": conteudo, "filename": "Anexo"}
+    elif tipo == 'audio': payload['audio'] = {"id": conteudo}
+        
+    try:
+        resp = cliente_graph.post("messages", f"{segredo('META_PHONE_ID')}/messages", json=payload)
+        return resp.status_code, resp.json()
+    except Exception as e: return 500, str(e)
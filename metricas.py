@@ -0,0 +1,272 @@
+# Instrumentação do caminho quente: tempo de cada consulta SQL (eventos do engine), de cada chamada ao Graph
+# e de cada helper do app.py, agregado por rerun e por página. Exposto na aba "⏱️ Performance", em formato
+# Prometheus (arquivo e/ou endpoint HTTP) e num log de lentidão com limites configuráveis.
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import event
+from banco import engine, segredo, telemetria, _sessao_atual
+
+BALDES_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+AMOSTRAS = 512  # últimas observações por série, para p50/p95 na tela
+MAX_CONSULTAS = 300  # textos de SQL distintos guardados (o resto cai em "outras")
+LIMITES_MS = {
+    "sql": float(segredo("LENTO_SQL_MS", 250)),
+    "graph": float(segredo("LENTO_GRAPH_MS", 1500)),
+    "helper": float(segredo("LENTO_HELPER_MS", 500)),
+    "rerun": float(segredo("LENTO_RERUN_MS", 2000)),
+}
+FAMILIAS = {
+    # familia: (métrica Prometheus, rótulo, ajuda)
+    "rerun": ("semprechat_rerun_seconds", "pagina", "Duração de um rerun do app, por página"),
+    "helper": ("semprechat_helper_seconds", "helper", "Duração dos helpers de acesso a dados do app.py"),
+    "sql": ("semprechat_sql_seconds", "helper", "Duração das consultas SQL, pelo helper que as disparou"),
+    "graph": ("semprechat_graph_seconds", "endpoint", "Duração das chamadas à Graph API"),
+}
+
+
+class Serie:
+    def __init__(self):
+        self.baldes = [0] * (len(BALDES_S) + 1)
+        self.n = 0; self.soma = 0.0; self.maximo = 0.0; self.erros = 0
+        self.recentes = deque(maxlen=AMOSTRAS)
+
+    def observar(self, segundos, erro=False):
+        i = 0
+        while i < len(BALDES_S) and segundos > BALDES_S[i]: i += 1
+        self.baldes[i] += 1
+        self.n += 1; self.soma += segundos; self.maximo = max(self.maximo, segundos); self.erros += int(erro)
+        self.recentes.append(segundos)
+
+    def resumo(self):
+        v = sorted(self.recentes)
+        q = lambda p: round(1000 * v[min(len(v) - 1, int(p * len(v)))], 1) if v else 0.0
+        return {"n": self.n, "media_ms": round(1000 * self.soma / self.n, 1) if self.n else 0.0,
+                "p50_ms": q(0.5), "p95_ms": q(0.95), "max_ms": round(1000 * self.maximo, 1), "erros": self.erros}
+
+
+class Metricas:
+    def __init__(self):
+        self.trava = threading.Lock()
+        self.series = {}  # (familia, rótulo) -> Serie
+        self.consultas = {}  # texto normalizado -> Serie
+        self.reruns = deque(maxlen=300)  # decomposição dos últimos reruns (todas as sessões)
+        self.lentos = deque(maxlen=200)
+        self.lentos_total = dict.fromkeys(LIMITES_MS, 0)
+        self.abertos = {}  # session_id -> rerun em andamento
+        self.local = threading.local()  # pilha de helpers da thread atual
+
+    def observar(self, familia, rotulo, segundos, erro=False):
+        with self.trava:
+            s = self.series.get((familia, rotulo))
+            if s is None: s = self.series[(familia, rotulo)] = Serie()
+            s.observar(segundos, erro)
+
+    def lento(self, tipo, nome, segundos, detalhe=""):
+        ms = 1000 * segundos
+        if ms < LIMITES_MS[tipo]: return
+        with self.trava:
+            self.lentos_total[tipo] += 1
+            self.lentos.append({"quando": time.strftime("%H:%M:%S"), "tipo": tipo, "nome": nome, "ms": round(ms, 1), "detalhe": detalhe[:300]})
+        logging.warning("lento: %s %s %.0f ms %s", tipo, nome, ms, detalhe[:300])
+
+    # --- rerun ---
+    def _rerun(self):
+        sid = _sessao_atual()
+        return self.abertos.get(sid) if sid else None
+
+    def iniciar_rerun(self, pagina):
+        sid = _sessao_atual()
+        if sid is None: return
+        # O rerun anterior que terminou em st.rerun()/st.stop() não chegou ao finalizar: fecha agora
+        if sid in self.abertos: self.finalizar_rerun(interrompido=True)
+        self.abertos[sid] = {"pagina": pagina, "inicio": time.perf_counter(), "quando": time.strftime("%H:%M:%S"),
+                             "helpers": {}, "sql_s": 0.0, "sql_n": 0, "graph_s": 0.0, "graph_n": 0, "fora_s": 0.0}
+
+    def finalizar_rerun(self, interrompido=False):
+        r = self.abertos.pop(_sessao_atual(), None)
+        if r is None: return
+        total = time.perf_counter() - r["inicio"]
+        self.observar("rerun", r["pagina"], total)
+        self.lento("rerun", r["pagina"], total, " ".join(f"{k}={1000 * v:.0f}ms" for k, v in sorted(r["helpers"].items(), key=lambda x: -x[1])[:5]))
+        with self.trava:
+            self.reruns.append({
+                "quando": r["quando"], "pagina": r["pagina"], "total_ms": round(1000 * total, 1),
+                "helpers_ms": round(1000 * sum(r["helpers"].values()), 1),
+                "sql_ms": round(1000 * r["sql_s"], 1), "sql_n": r["sql_n"], "graph_ms": round(1000 * r["graph_s"], 1), "graph_n": r["graph_n"],
+                # o que não foi helper nem SQL/Graph solto é montagem da tela pelo Streamlit
+                "interface_ms": round(1000 * max(0.0, total - sum(r["helpers"].values()) - r["fora_s"]), 1),
+                "mais_lento": max(r["helpers"], key=r["helpers"].get) if r["helpers"] else "", "interrompido": interrompido,
+            })
+
+    def _somar(self, campo, segundos):
+        r = self._rerun()
+        if r is None: return
+        r[campo + "_s"] += segundos; r[campo + "_n"] += 1
+        if not getattr(self.local, "pilha", None): r["fora_s"] += segundos
+
+    # --- helpers ---
+    def medir(self, nome):
+        def decorador(fn):
+            @functools.wraps(fn)
+            def medido(*a, **kw):
+                pilha = self.local.__dict__.setdefault("pilha", [])
+                pilha.append(nome)
+                inicio = time.perf_counter()
+                try: return fn(*a, **kw)
+                finally:
+                    seg = time.perf_counter() - inicio
+                    pilha.pop()
+                    self.observar("helper", nome, seg)
+                    self.lento("helper", nome, seg)
+                    r = self._rerun()
+                    # só o helper mais externo conta no rerun, para não somar duas vezes
+                    if r is not None and not pilha: r["helpers"][nome] = r["helpers"].get(nome, 0.0) + seg
+            return medido
+        return decorador
+
+    def helper_atual(self):
+        pilha = getattr(self.local, "pilha", None)
+        return pilha[-1] if pilha else "-"
+
+    # --- SQL e Graph ---
+    def registrar_sql(self, sql, segundos, erro=False):
+        helper = self.helper_atual()
+        self.observar("sql", helper, segundos, erro)
+        chave = _normalizar(sql)
+        with self.trava:
+            s = self.consultas.get(chave)
+            if s is None:
+                if len(self.consultas) >= MAX_CONSULTAS: chave = "(outras)"
+                s = self.consultas.setdefault(chave, Serie())
+            s.observar(segundos, erro)
+        self._somar("sql", segundos)
+        self.lento("sql", helper, segundos, chave)
+
+    def registrar_graph(self, endpoint, segundos, erro):
+        self.observar("graph", endpoint, segundos, erro)
+        self._somar("graph", segundos)
+        self.lento("graph", endpoint, segundos, "erro" if erro else "")
+
+    # --- leitura ---
+    def tabela(self, familia):
+        with self.trava: itens = [(k[1], s.resumo()) for k, s in self.series.items() if k[0] == familia]
+        return sorted(({FAMILIAS[familia][1]: k, **v} for k, v in itens), key=lambda d: -d["n"] * d["media_ms"])
+
+    def top_consultas(self, n=20):
+        with self.trava: itens = [(k, s.resumo()) for k, s in self.consultas.items()]
+        return sorted(({"consulta": k, "total_ms": round(v["n"] * v["media_ms"], 1), **v} for k, v in itens), key=lambda d: -d["total_ms"])[:n]
+
+    def ultimos_reruns(self):
+        with self.trava: return list(self.reruns)
+
+    def ultimos_lentos(self):
+        with self.trava: return list(reversed(self.lentos))
+
+    def zerar(self):
+        with self.trava:
+            self.series.clear(); self.consultas.clear(); self.reruns.clear(); self.lentos.clear()
+            self.lentos_total = dict.fromkeys(LIMITES_MS, 0)
+
+    def texto_prometheus(self):
+        linhas = []
+        with self.trava:
+            for familia, (nome, rotulo, ajuda) in FAMILIAS.items():
+                linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} histogram"]
+                for (f, valor), s in sorted(self.series.items()):
+                    if f != familia: continue
+                    rot, acumulado = f'{rotulo}="{_escapar(valor)}"', 0
+                    for limite, qtd in zip(BALDES_S + ("+Inf",), s.baldes):
+                        acumulado += qtd
+                        linhas.append(f'{nome}_bucket{{{rot},le="{limite}"}} {acumulado}')
+                    linhas += [f"{nome}_sum{{{rot}}} {s.soma:.6f}", f"{nome}_count{{{rot}}} {s.n}"]
+                if familia in ("sql", "graph"):
+                    linhas += [f"# HELP {nome[:-8]}_erros_total Chamadas com erro", f"# TYPE {nome[:-8]}_erros_total counter"]
+                    linhas += [f'{nome[:-8]}_erros_total{{{rotulo}="{_escapar(v)}"}} {s.erros}' for (f, v), s in sorted(self.series.items()) if f == familia]
+            linhas += ["# HELP semprechat_lentos_total Eventos acima do limite de lentidão", "# TYPE semprechat_lentos_total counter"]
+            linhas += [f'semprechat_lentos_total{{tipo="{t}"}} {n}' for t, n in self.lentos_total.items()]
+        pool = telemetria.resumo()
+        linhas += ["# HELP semprechat_pool_conexoes Conexões do pool do SQLAlchemy", "# TYPE semprechat_pool_conexoes gauge"]
+        linhas += [f'semprechat_pool_conexoes{{estado="{k}"}} {pool[k]}' for k in ("em_uso", "ociosas", "overflow")]
+        return "\n".join(linhas) + "\n"
+
+
+def _normalizar(sql):
+    # Mesmo texto com números diferentes (LIMIT 50, ids em f-string) vira uma série só
+    return re.sub(r"\b\d+\b", "?", re.sub(r"\s+", " ", sql).strip())[:200]
+
+def _escapar(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+metricas = Metricas()
+medir = metricas.medir
+
+
+# --- EVENTOS DO ENGINE ---
+# Em before/after_cursor_execute: cobre pd.read_sql, conn.execute e os scripts fora do Streamlit
+@event.listens_for(engine, "before_cursor_execute")
+def _antes(conn, cursor, sql, params, context, executemany):
+    conn.info.setdefault("metricas_inicio", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _depois(conn, cursor, sql, params, context, executemany):
+    pilha = conn.info.get("metricas_inicio")
+    if pilha: metricas.registrar_sql(sql, time.perf_counter() - pilha.pop())
+
+@event.listens_for(engine, "handle_error")
+def _erro(ctx):
+    pilha = ctx.connection.info.get("metricas_inicio") if ctx.connection is not None else None
+    if not pilha: return
+    inicio = pilha.pop()
+    # Erro do driver antes de ir ao banco (ex.: pandas testando se o texto do SQL é nome de tabela): não conta
+    if getattr(ctx.original_exception, "pgcode", "") is None: return
+    metricas.registrar_sql(str(ctx.statement or ""), time.perf_counter() - inicio, erro=True)
+
+
+# --- EXPORTAÇÃO PROMETHEUS ---
+# METRICS_FILE: arquivo para o textfile collector do node_exporter ("{pid}" separa réplicas/worker);
+# METRICS_PORT: endpoint /metrics neste processo. Os dois são opcionais.
+_exportando = threading.Lock()
+_exportacao_iniciada = False
+
+def _gravar_arquivo(caminho, intervalo):
+    while True:
+        try:
+            tmp = f"{caminho}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f: f.write(metricas.texto_prometheus())
+            os.replace(tmp, caminho)
+        except Exception: logging.exception("metricas: não consegui gravar %s", caminho)
+        time.sleep(intervalo)
+
+class _Handler(BaseHTTPRequestHandler):
+    def log_message(self, *a): pass
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics": self.send_response(404); self.end_headers(); return
+        corpo = metricas.texto_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers(); self.wfile.write(corpo)
+
+def iniciar_exportacao():
+    global _exportacao_iniciada
+    with _exportando:
+        if _exportacao_iniciada: return
+        _exportacao_iniciada = True
+    caminho, porta = segredo("METRICS_FILE"), segredo("METRICS_PORT")
+    if caminho:
+        caminho = str(caminho).replace("{pid}", str(os.getpid()))
+        threading.Thread(target=_gravar_arquivo, args=(caminho, float(segredo("METRICS_INTERVALO", 15))), daemon=True, name="metricas-arquivo").start()
+    if porta:
+        try:
+            srv = ThreadingHTTPServer(("0.0.0.0", int(porta)), _Handler)
+            threading.Thread(target=srv.serve_forever, daemon=True, name="metricas-http").start()
+        except OSError: logging.warning("metricas: porta %s ocupada, endpoint /metrics não iniciado neste processo", porta)
+
+iniciar_exportacao()
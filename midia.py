@@ -0,0 +1,124 @@
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import closing
+from PIL import Image
+
+
+class CacheMidia:
+    # Cache de mídia em disco, compartilhado por todas as sessões (e processos da mesma máquina):
+    #  - conteúdo por media_id, limitado em bytes com despejo LRU;
+    #  - resultado da consulta da URL (GET /{media_id}) à parte, com TTL próprio, pois a URL da Meta expira;
+    #  - pedidos simultâneos do mesmo media_id viram um único download (single-flight).
+    def __init__(self, pasta, limite_bytes=512 * 1024 * 1024, ttl_url=240):
+        self.pasta = pasta
+        self.limite = limite_bytes
+        self.ttl_url = ttl_url
+        self._indice = os.path.join(pasta, "indice.sqlite3")
+        self._trava = threading.Lock()
+        self._em_voo = {}
+        os.makedirs(pasta, exist_ok=True)
+        with closing(self._conn()) as c:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("CREATE TABLE IF NOT EXISTS arquivos (chave TEXT PRIMARY KEY, tamanho INTEGER, acesso REAL)")
+            c.execute("CREATE INDEX IF NOT EXISTS idx_arquivos_acesso ON arquivos (acesso)")
+            c.execute("CREATE TABLE IF NOT EXISTS urls (chave TEXT PRIMARY KEY, info TEXT, expira REAL)")
+            c.execute("CREATE TABLE IF NOT EXISTS metadados (chave TEXT PRIMARY KEY, info TEXT)")
+
+    def _conn(self):
+        return sqlite3.connect(self._indice, timeout=10, isolation_level=None)
+
+    def _caminho(self, chave):
+        h = hashlib.sha1(chave.encode()).hexdigest()
+        return os.path.join(self.pasta, h[:2], h)
+
+    def ler(self, chave):
+        with closing(self._conn()) as c:
+            if not c.execute("SELECT 1 FROM arquivos WHERE chave=?", (chave,)).fetchone(): return None
+            try:
+                with open(self._caminho(chave), "rb") as f: dados = f.read()
+            except OSError:
+                c.execute("DELETE FROM arquivos WHERE chave=?", (chave,))
+                return None
+            c.execute("UPDATE arquivos SET acesso=? WHERE chave=?", (time.time(), chave))
+            return dados
+
+    def _gravar(self, chave, dados):
+        caminho = self._caminho(chave)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        tmp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f: f.write(dados)
+        os.replace(tmp, caminho)
+        with closing(self._conn()) as c:
+            c.execute("INSERT OR REPLACE INTO arquivos (chave, tamanho, acesso) VALUES (?, ?, ?)", (chave, len(dados), time.time()))
+            self._despejar(c)
+
+    def _despejar(self, c):
+        total = c.execute("SELECT COALESCE(SUM(tamanho), 0) FROM arquivos").fetchone()[0]
+        while total > self.limite:
+            antigos = c.execute("SELECT chave, tamanho FROM arquivos ORDER BY acesso LIMIT 50").fetchall()
+            if not antigos: break
+            for chave, tamanho in antigos:
+                if total <= self.limite: break
+                try: os.remove(self._caminho(chave))
+                except OSError: pass
+                c.execute("DELETE FROM arquivos WHERE chave=?", (chave,))
+                total -= tamanho
+
+    def obter(self, chave, baixar):
+        # baixar(chave) -> bytes | None; só é chamado se não estiver em disco e ninguém estiver baixando
+        dados = self.ler(chave)
+        if dados is not None: return dados
+        with self._trava:
+            fut = self._em_voo.get(chave)
+            dono = fut is None
+            if dono: fut = self._em_voo[chave] = Future()
+        if not dono: return fut.result()
+        try:
+            dados = self.ler(chave)
+            if dados is None:
+                dados = baixar(chave)
+                if dados: self._gravar(chave, dados)
+            fut.set_result(dados)
+            return dados
+        except Exception as e:
+            fut.set_exception(e)
+            raise
+        finally:
+            with self._trava: self._em_voo.pop(chave, None)
+
+    def info_url(self, chave, consultar):
+        # consultar(chave) -> dict da Graph ({url, mime_type, file_size, ...}); guardado por ttl_url segundos
+        with closing(self._conn()) as c:
+            row = c.execute("SELECT info FROM urls WHERE chave=? AND expira>?", (chave, time.time())).fetchone()
+            if row: return json.loads(row[0])
+        info = consultar(chave)
+        if info and 'url' in info:
+            with closing(self._conn()) as c:
+                c.execute("INSERT OR REPLACE INTO urls (chave, info, expira) VALUES (?, ?, ?)", (chave, json.dumps(info), time.time() + self.ttl_url))
+        return info
+
+    def meta(self, chave):
+        # Metadados permanentes e pequenos (tipo, tamanho) para os selos da conversa; fora do LRU
+        with closing(self._conn()) as c:
+            row = c.execute("SELECT info FROM metadados WHERE chave=?", (chave,)).fetchone()
+            return json.loads(row[0]) if row else None
+
+    def salvar_meta(self, chave, info):
+        with closing(self._conn()) as c:
+            c.execute("INSERT OR REPLACE INTO metadados (chave, info) VALUES (?, ?)", (chave, json.dumps(info)))
+
+
+def gerar_miniatura(dados, lado=240):
+    try:
+        img = Image.open(io.BytesIO(dados))
+        img.thumbnail((lado, lado))
+        saida = io.BytesIO()
+        img.convert("RGB").save(saida, format="JPEG", quality=75, optimize=True)
+        return saida.getvalue()
+    except Exception: return None
@@ -0,0 +1,372 @@
+# Migrações versionadas do schema. Rodam uma vez por banco, em ordem, sob advisory lock (várias réplicas/worker).
+#   python migracoes.py            (aplica as pendentes)
+#   python migracoes.py --verificar (só confere índices e planos)
+import datetime as dt
+import json
+import logging
+import re
+import sys
+from contextlib import contextmanager
+import pandas as pd
+from sqlalchemy import text, bindparam
+from banco import engine, conexao, segredo
+from arquivo import garantir_particoes, inicio_mes, particionada
+from custos import SQL_TEMPLATE, SQL_VENDEDORA, TRAVA_CUSTOS
+from fila import CANAL
+
+TRAVA_MIGRACOES = 72_310_001
+LIMIAR_SEQ_SCAN = 10_000   # Seq Scan em tabela menor que isso é normal
+FATOR_REGRESSAO = 2.0      # custo estimado acima de 2x a referência vira alerta
+CUSTO_MINIMO = 100         # ...desde que a diferença passe disso (planos de tabela pequena oscilam)
+# Sem statement_timeout nas migrações (índice e backfill em tabela grande passam dos 30s do app), mas sem ficar
+# indefinidamente na fila de um lock: o ALTER esperando trava todo mundo que chega depois dele
+LOCK_TIMEOUT_MIGRACAO = f"{int(segredo('MIGRACAO_LOCK_TIMEOUT_MS', 60000))}ms"
+_INDICE_CONCORRENTE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)", re.I)
+
+def _executar(conn, sql):
+    # CREATE INDEX CONCURRENTLY que cai no meio deixa um índice inválido, e o IF NOT EXISTS da próxima tentativa
+    # pularia ele: derruba o inválido antes e confere depois; inválido levanta erro e a migração não é registrada
+    m = _INDICE_CONCORRENTE.search(sql)
+    if m and conn.execute(text("SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:n)"), {"n": m.group(1)}).scalar():
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {m.group(1)}"))
+    conn.execute(text(sql))
+    if m and not conn.execute(text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:n)"), {"n": m.group(1)}).scalar():
+        raise RuntimeError(f"migracoes: índice {m.group(1)} ficou inválido")
+
+def _whatsapp_id(conn):
+    # Único quando possível (ON CONFLICT do disparo); com duplicados antigos, pelo menos o índice comum
+    try: _executar(conn, "CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS idx_contatos_whatsapp_id ON contatos (whatsapp_id)")
+    except Exception:
+        logging.warning("migracoes: whatsapp_id com duplicados, criando índice não único")
+        conn.execute(text("DROP INDEX CONCURRENTLY IF EXISTS idx_contatos_whatsapp_id"))
+        _executar(conn, "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_contatos_whatsapp_id ON contatos (whatsapp_id)")
+
+def _busca_fila(conn):
+    # Trigram atende ILIKE '%termo%'; sem permissão para a extensão, ficam índices de prefixo
+    try: conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm")); trgm = True
+    except Exception:
+        logging.warning("migracoes: pg_trgm indisponível, busca da fila só por prefixo")
+        trgm = False
+    for col in ("nome", "codigo_cliente", "whatsapp_id"):
+        if trgm: _executar(conn, f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_contatos_{col}_trgm ON contatos USING gin ({col} gin_trgm_ops)")
+        else: _executar(conn, f"CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_contatos_{col}_prefixo ON contatos (lower({col}) text_pattern_ops)")
+
+def _busca_mensagens(conn):
+    # Coluna comum + trigger em vez de coluna gerada: ADD COLUMN gerada reescreveria mensagens inteira sob lock.
+    # O preenchimento do histórico vai em lotes curtos para não segurar o chat.
+    conn.execute(text("ALTER TABLE mensagens ADD COLUMN IF NOT EXISTS texto_busca tsvector"))
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION atualizar_texto_busca() RETURNS trigger AS $$
+        BEGIN NEW.texto_busca := to_tsvector('portuguese', COALESCE(NEW.texto, '')); RETURN NEW; END; $$ LANGUAGE plpgsql
+    """))
+    if not conn.execute(text("SELECT 1 FROM pg_trigger WHERE tgname = 'trg_texto_busca'")).fetchone():
+        conn.execute(text("CREATE TRIGGER trg_texto_busca BEFORE INSERT OR UPDATE OF texto ON mensagens FOR EACH ROW EXECUTE FUNCTION atualizar_texto_busca()"))
+    # Keyset por id: cada lote começa onde o anterior parou, sem revarrer o que já foi preenchido
+    ultimo = 0
+    while (fim := conn.execute(text("SELECT MAX(id) FROM (SELECT id FROM mensagens WHERE id > :u ORDER BY id LIMIT 5000) x"), {"u": ultimo}).scalar()):
+        conn.execute(text("""
+            UPDATE mensagens SET texto_busca = to_tsvector('portuguese', COALESCE(texto, ''))
+            WHERE id > :u AND id <= :f AND texto_busca IS NULL
+        """), {"u": ultimo, "f": fim})
+        ultimo = fim
+    _executar(conn, "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mensagens_texto_busca ON mensagens USING gin (texto_busca)")
+
+# Índices de mensagens que passam a existir na tabela particionada (e em cada partição)
+INDICES_MENSAGENS = {
+    "idx_mensagens_id": "(id)",
+    "idx_mensagens_contato_data": "(contato_id, data_envio, id)",
+    "idx_mensagens_remetente_data": "(remetente, data_envio)",
+    "idx_mensagens_texto_busca": "USING gin (texto_busca)",
+}
+
+def _particionar_mensagens(conn):
+    # A tabela atual vira a partição 'mensagens_legado' (até o fim deste mês) sem copiar dados:
+    # o CHECK validado antes permite o ATTACH sem varrer, e o lock exclusivo dura só a troca de nomes.
+    # Requer PostgreSQL 13+ (trigger BEFORE por linha em tabela particionada).
+    if conn.execute(text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('mensagens')")).fetchone(): return
+    limite = inicio_mes(dt.date.today(), 1)
+    # data_envio é a chave da partição e fica NOT NULL: não inventa data para o que veio sem, para e mostra quantas são
+    sem_data = conn.execute(text("SELECT count(*) FROM mensagens WHERE data_envio IS NULL")).scalar()
+    if sem_data: raise RuntimeError(f"migracoes: {sem_data} mensagens sem data_envio; preencha ou remova antes de particionar")
+    _executar(conn, "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mensagens_id ON mensagens (id)")
+    conn.execute(text("ALTER TABLE mensagens DROP CONSTRAINT IF EXISTS mensagens_legado_faixa"))
+    conn.execute(text(f"ALTER TABLE mensagens ADD CONSTRAINT mensagens_legado_faixa CHECK (data_envio IS NOT NULL AND data_envio < '{limite}') NOT VALID"))
+    conn.execute(text("ALTER TABLE mensagens VALIDATE CONSTRAINT mensagens_legado_faixa"))
+    with engine.begin() as tx:
+        tx.execute(text("SET LOCAL statement_timeout = 0"))
+        tx.execute(text("SELECT set_config('lock_timeout', :t, true)"), {"t": LOCK_TIMEOUT_MIGRACAO})
+        tx.execute(text("LOCK TABLE mensagens IN ACCESS EXCLUSIVE MODE"))
+        # Gatilhos saem da partição e voltam no pai como estavam (a definição cita 'mensagens', que passa a ser o pai)
+        gatilhos = dict(tx.execute(text("SELECT tgname, pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = to_regclass('mensagens') AND NOT tgisinternal")).fetchall())
+        # Chaves estrangeiras também: ficam na partição e voltam no pai com o mesmo nome e definição
+        fks = tx.execute(text("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass('mensagens') AND contype = 'f'")).fetchall()
+        seq = tx.execute(text("SELECT pg_get_serial_sequence('mensagens', 'id')")).scalar()
+        tx.execute(text("ALTER TABLE mensagens RENAME TO mensagens_legado"))
+        for nome in INDICES_MENSAGENS: tx.execute(text(f"ALTER INDEX IF EXISTS {nome} RENAME TO {nome}_legado"))
+        for g in gatilhos: tx.execute(text(f"DROP TRIGGER {g} ON mensagens_legado"))
+        tx.execute(text("ALTER TABLE mensagens_legado ALTER COLUMN data_envio SET NOT NULL"))
+        tx.execute(text("CREATE TABLE mensagens (LIKE mensagens_legado INCLUDING DEFAULTS) PARTITION BY RANGE (data_envio)"))
+        if seq: tx.execute(text(f"ALTER SEQUENCE {seq} OWNED BY mensagens.id"))
+        tx.execute(text(f"ALTER TABLE mensagens ATTACH PARTITION mensagens_legado FOR VALUES FROM (MINVALUE) TO ('{limite}')"))
+        for nome, definicao in INDICES_MENSAGENS.items():
+            tx.execute(text(f"CREATE INDEX {nome} ON ONLY mensagens {definicao}"))
+            if tx.execute(text("SELECT to_regclass(:n)"), {"n": f"{nome}_legado"}).scalar():
+                tx.execute(text(f"ALTER INDEX {nome} ATTACH PARTITION {nome}_legado"))
+        # No pai o Postgres reaproveita a FK igual que já existe na partição (sem revalidar); NOT VALID não é aceito em particionada
+        for nome, definicao in fks: tx.exec_driver_sql(f"ALTER TABLE mensagens ADD CONSTRAINT {nome} {definicao.replace(' NOT VALID', '')}")
+        for definicao in gatilhos.values(): tx.exec_driver_sql(definicao)
+        if "trg_texto_busca" not in gatilhos:
+            tx.execute(text("CREATE TRIGGER trg_texto_busca BEFORE INSERT OR UPDATE OF texto ON mensagens FOR EACH ROW EXECUTE FUNCTION atualizar_texto_busca()"))
+    garantir_particoes()
+
+def _particao_padrao(conn):
+    # Bancos particionados antes da partição DEFAULT existir
+    if particionada(): garantir_particoes()
+
+def _rollup_custos(conn):
+    # Antes criado pelo custos.py na primeira consulta da aba Custos; o histórico é somado pelo worker (custos.backfill)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS custos_diarios (
+            dia DATE NOT NULL, vendedora_id INTEGER NOT NULL DEFAULT 0, template TEXT NOT NULL DEFAULT '',
+            qtd INTEGER NOT NULL DEFAULT 0, custo NUMERIC NOT NULL DEFAULT 0,
+            PRIMARY KEY (dia, vendedora_id, template))
+    """))
+    # Vendedora do contato no momento do envio (mensagens anteriores à coluna ficam com a vendedora atual)
+    conn.execute(text("ALTER TABLE mensagens ADD COLUMN IF NOT EXISTS vendedora_id INTEGER"))
+    conn.execute(text("""
+        CREATE OR REPLACE FUNCTION anotar_vendedora_envio() RETURNS trigger AS $$
+        BEGIN
+            IF NEW.vendedora_id IS NULL THEN
+                NEW.vendedora_id := COALESCE((SELECT vendedora_id FROM contatos WHERE id = NEW.contato_id), 0);
+            END IF;
+            RETURN NEW;
+        END; $$ LANGUAGE plpgsql
+    """))
+    if not conn.execute(text("SELECT 1 FROM pg_trigger WHERE tgname = 'trg_vendedora_envio'")).fetchone():
+        conn.execute(text("""CREATE TRIGGER trg_vendedora_envio BEFORE INSERT ON mensagens FOR EACH ROW
+                             WHEN (NEW.remetente = 'empresa' AND NEW.custo > 0) EXECUTE FUNCTION anotar_vendedora_envio()"""))
+    # Mesma regra e mesma trava por dia do custos.reconciliar() (compartilhada aqui, exclusiva lá)
+    conn.exec_driver_sql(f"""
+        CREATE OR REPLACE FUNCTION somar_custos_diarios() RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_advisory_xact_lock_shared({TRAVA_CUSTOS}, d - DATE '2000-01-01')
+            FROM (SELECT DISTINCT data_envio::date AS d FROM novas WHERE remetente = 'empresa' AND custo > 0 ORDER BY 1) x;
+            INSERT INTO custos_diarios AS cd (dia, vendedora_id, template, qtd, custo)
+            SELECT m.data_envio::date, {SQL_VENDEDORA}, {SQL_TEMPLATE}, COUNT(*), SUM(m.custo)
+            FROM novas m LEFT JOIN contatos c ON c.id = m.contato_id
+            WHERE m.remetente = 'empresa' AND m.custo > 0
+            GROUP BY 1, 2, 3
+            ON CONFLICT (dia, vendedora_id, template)
+            DO UPDATE SET qtd = cd.qtd + EXCLUDED.qtd, custo = cd.custo + EXCLUDED.custo;
+            RETURN NULL;
+        END; $$ LANGUAGE plpgsql
+    """)
+    if not conn.execute(text("SELECT 1 FROM pg_trigger WHERE tgname = 'trg_custos_diarios'")).fetchone():
+        conn.execute(text("CREATE TRIGGER trg_custos_diarios AFTER INSERT ON mensagens REFERENCING NEW TABLE AS novas FOR EACH STATEMENT EXECUTE FUNCTION somar_custos_diarios()"))
+
+def _notificacoes_fila(conn):
+    # Antes criados pelo fila.py a cada processo; avisam o LISTEN da fila de cada réplica
+    conn.execute(text(f"""
+        CREATE OR REPLACE FUNCTION notificar_fila() RETURNS trigger AS $$
+        BEGIN PERFORM pg_notify('{CANAL}', TG_TABLE_NAME); RETURN NULL; END; $$ LANGUAGE plpgsql
+    """))
+    existentes = {r[0] for r in conn.execute(text("SELECT tgname FROM pg_trigger WHERE tgname IN ('trg_fila_contatos', 'trg_fila_usuarios')"))}
+    if 'trg_fila_contatos' not in existentes:
+        conn.execute(text("CREATE TRIGGER trg_fila_contatos AFTER INSERT OR UPDATE OR DELETE ON contatos FOR EACH STATEMENT EXECUTE FUNCTION notificar_fila()"))
+    if 'trg_fila_usuarios' not in existentes:
+        conn.execute(text("CREATE TRIGGER trg_fila_usuarios AFTER UPDATE OF nome OR DELETE ON usuarios FOR EACH STATEMENT EXECUTE FUNCTION notificar_fila()"))
+
+# (versão, nome, passos). Passo = SQL ou função(conn). Índices com CONCURRENTLY para não travar o chat.
+MIGRACOES = [
+    (1, "bot_regras e contexto_bot", [
+        "CREATE TABLE IF NOT EXISTS bot_regras (id SERIAL PRIMARY KEY, template_gatilho TEXT UNIQUE, resposta_texto TEXT)",
+        "ALTER TABLE contatos ADD COLUMN IF NOT EXISTS contexto_bot TEXT",
+    ]),
+    (2, "índice da conversa", ["CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mensagens_contato_data ON mensagens (contato_id, data_envio, id)"]),
+    (3, "índices da fila", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_contatos_status_interacao ON contatos (status_atendimento, ultima_interacao DESC)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_contatos_fila_aberta ON contatos (ultima_interacao DESC) WHERE status_atendimento <> 'encerrado'",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_contatos_vendedora ON contatos (vendedora_id)",
+    ]),
+    (4, "busca por whatsapp_id", [_whatsapp_id]),
+    (5, "filtro de custos", ["CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_mensagens_remetente_data ON mensagens (remetente, data_envio)"]),
+    (6, "referência dos planos", ["CREATE TABLE IF NOT EXISTS saude_planos (consulta TEXT PRIMARY KEY, custo REAL NOT NULL, registrado_em TIMESTAMP DEFAULT NOW())"]),
+    (7, "busca da fila", [_busca_fila]),
+    (8, "busca textual nas mensagens", [_busca_mensagens]),
+    (9, "registro de mídia enviada à Meta", [
+        """CREATE TABLE IF NOT EXISTS midias_meta (hash TEXT PRIMARY KEY, media_id TEXT NOT NULL, mime TEXT, nome TEXT,
+               tamanho BIGINT, enviado_em TIMESTAMP DEFAULT NOW(), expira_em TIMESTAMP NOT NULL)""",
+    ]),
+    (10, "mensagens particionada por mês", [_particionar_mensagens]),
+    (11, "índice do arquivo de mensagens", [
+        """CREATE TABLE IF NOT EXISTS arquivo_mensagens (contato_id INTEGER NOT NULL, caminho TEXT NOT NULL, qtd INTEGER,
+               primeira TIMESTAMP, ultima TIMESTAMP, arquivado_em TIMESTAMP DEFAULT NOW(), PRIMARY KEY (contato_id, caminho))""",
+    ]),
+    (12, "partição padrão de mensagens", [_particao_padrao]),
+    # Antes criadas pelo disparo.py a cada enfileiramento; IF NOT EXISTS cobre os bancos onde já existem
+    (13, "fila de disparos", [
+        """CREATE TABLE IF NOT EXISTS disparo_jobs (
+               id SERIAL PRIMARY KEY, template TEXT NOT NULL, custo NUMERIC DEFAULT 0, vendedora_id INTEGER,
+               criado_por INTEGER, status TEXT NOT NULL DEFAULT 'pendente', total INTEGER DEFAULT 0,
+               enviados INTEGER DEFAULT 0, falhas INTEGER DEFAULT 0, taxa REAL DEFAULT 0, worker TEXT,
+               heartbeat TIMESTAMP, criado_em TIMESTAMP DEFAULT NOW(), concluido_em TIMESTAMP)""",
+        """CREATE TABLE IF NOT EXISTS disparo_itens (
+               id BIGSERIAL PRIMARY KEY, job_id INTEGER NOT NULL REFERENCES disparo_jobs(id) ON DELETE CASCADE,
+               linha INTEGER NOT NULL, telefone TEXT NOT NULL, variaveis TEXT, status TEXT NOT NULL DEFAULT 'pendente',
+               processado_em TIMESTAMP)""",
+        "ALTER TABLE disparo_jobs ADD COLUMN IF NOT EXISTS midia_tipo TEXT, ADD COLUMN IF NOT EXISTS midia_id TEXT",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_disparo_itens_job_status ON disparo_itens (job_id, status, linha)",
+    ]),
+    (14, "rollup diário de custos", [_rollup_custos]),
+    (15, "avisos da fila", [_notificacoes_fila]),
+]
+
+# Índices que as consultas quentes esperam: nome -> tabela
+INDICES_ESPERADOS = {
+    "idx_mensagens_contato_data": "mensagens", "idx_mensagens_remetente_data": "mensagens",
+    "idx_contatos_status_interacao": "contatos", "idx_contatos_fila_aberta": "contatos",
+    "idx_contatos_vendedora": "contatos", "idx_contatos_whatsapp_id": "contatos",
+    "idx_mensagens_texto_busca": "mensagens",
+}
+
+# Consultas quentes com parâmetros de exemplo para o EXPLAIN
+CONSULTAS_QUENTES = {
+    "conversa (última página)": ("SELECT id FROM mensagens WHERE contato_id = :cid ORDER BY data_envio DESC, id DESC LIMIT 50", {"cid": 1}),
+    "conversa (novas)": ("SELECT id FROM mensagens WHERE contato_id = :cid AND id > :i ORDER BY data_envio, id", {"cid": 1, "i": 0}),
+    "fila": ("SELECT c.id FROM contatos c LEFT JOIN usuarios u ON c.vendedora_id = u.id WHERE c.status_atendimento != 'encerrado' ORDER BY c.ultima_interacao DESC", {}),
+    "contatos da vendedora": ("SELECT id FROM contatos WHERE vendedora_id = :v", {"v": 1}),
+    "busca na fila": ("SELECT id FROM contatos WHERE status_atendimento != 'encerrado' AND (nome ILIKE :p OR codigo_cliente ILIKE :p) ORDER BY ultima_interacao DESC LIMIT 50", {"p": "%silva%"}),
+    "busca nas mensagens": ("SELECT id FROM mensagens WHERE texto_busca @@ websearch_to_tsquery('portuguese', :q) LIMIT 20", {"q": "pedido"}),
+    "garantir_contato": ("SELECT id FROM contatos WHERE whatsapp_id = :w", {"w": "5511999999999"}),
+    "reconciliar custos": ("SELECT COUNT(*) FROM mensagens WHERE remetente = 'empresa' AND data_envio >= CURRENT_DATE - 2", {}),
+}
+
+
+@contextmanager
+def _conn_autocommit():
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("SET statement_timeout = 0"))
+        conn.execute(text("SELECT set_config('lock_timeout', :t, false)"), {"t": LOCK_TIMEOUT_MIGRACAO})
+        try: yield conn
+        finally:
+            # Volta ao padrão da conexão (options do banco.py) antes de devolver ao pool
+            try: conn.execute(text("RESET statement_timeout")); conn.execute(text("RESET lock_timeout"))
+            except Exception: conn.invalidate()
+
+def _garantir_controle(conn):
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_migracoes (versao INTEGER PRIMARY KEY, nome TEXT, aplicada_em TIMESTAMP DEFAULT NOW())"))
+
+def versao_atual():
+    with conexao() as conn:
+        existe = conn.execute(text("SELECT to_regclass('schema_migracoes')")).scalar()
+        return conn.execute(text("SELECT COALESCE(MAX(versao), 0) FROM schema_migracoes")).scalar() if existe else 0
+
+def pendentes():
+    atual = versao_atual()
+    return [(v, n) for v, n, _ in MIGRACOES if v > atual]
+
+def aplicar_migracoes():
+    # Devolve a lista de (versão, nome) aplicadas agora
+    aplicadas = []
+    with _conn_autocommit() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": TRAVA_MIGRACOES})
+        try:
+            _garantir_controle(conn)
+            feitas = {r[0] for r in conn.execute(text("SELECT versao FROM schema_migracoes"))}
+            for versao, nome, passos in MIGRACOES:
+                if versao in feitas: continue
+                logging.info("migracoes: aplicando %s (%s)", versao, nome)
+                for passo in passos:
+                    if callable(passo): passo(conn)
+                    else: _executar(conn, passo)
+                conn.execute(text("INSERT INTO schema_migracoes (versao, nome) VALUES (:v, :n)"), {"v": versao, "n": nome})
+                aplicadas.append((versao, nome))
+        finally: conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": TRAVA_MIGRACOES})
+    return aplicadas
+
+def verificar_indices():
+    # CREATE INDEX CONCURRENTLY interrompido deixa índice inválido: aparece aqui e reparar_indices() refaz
+    with conexao() as conn:
+        rows = conn.execute(text("""
+            SELECT c.relname, i.indisvalid, pg_relation_size(c.oid) FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+            WHERE c.relname = ANY(:nomes)
+        """), {"nomes": list(INDICES_ESPERADOS)}).fetchall()
+    achados = {r[0]: r for r in rows}
+    return pd.DataFrame([{
+        "indice": nome, "tabela": tabela,
+        "status": "ok" if nome in achados and achados[nome][1] else ("inválido" if nome in achados else "ausente"),
+        "tamanho_kb": round(achados[nome][2] / 1024) if nome in achados else None,
+    } for nome, tabela in INDICES_ESPERADOS.items()])
+
+def _indice_particionado(conn, nome, definicao):
+    # Em tabela particionada não há CONCURRENTLY: índice ON ONLY no pai + CONCURRENTLY em cada partição que faltar
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS {nome} ON ONLY mensagens {definicao}"))
+    faltando = [r[0] for r in conn.execute(text("""
+        SELECT p.relname FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('mensagens') AND NOT EXISTS (
+            SELECT 1 FROM pg_inherits ii JOIN pg_index x ON x.indexrelid = ii.inhrelid
+            WHERE ii.inhparent = to_regclass(:n) AND x.indrelid = p.oid)
+    """), {"n": nome})]
+    for particao in faltando:
+        filho = f"{particao}_{nome[4:]}"[:63]
+        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {filho}"))
+        _executar(conn, f"CREATE INDEX CONCURRENTLY {filho} ON {particao} {definicao}")
+        conn.execute(text(f"ALTER INDEX {nome} ATTACH PARTITION {filho}"))
+
+def reparar_indices():
+    ruins = verificar_indices().query("status != 'ok'")['indice'].tolist()
+    with _conn_autocommit() as conn:
+        part = conn.execute(text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('mensagens')")).fetchone()
+        resto = []
+        for nome in ruins:
+            if part and nome in INDICES_MENSAGENS: _indice_particionado(conn, nome, INDICES_MENSAGENS[nome])
+            else: conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {nome}")); resto.append(nome)
+        if resto:
+            # Reaplica as migrações que criam esses índices (só as de tabelas não particionadas)
+            conn.execute(text("DELETE FROM schema_migracoes WHERE versao IN :v").bindparams(bindparam("v", expanding=True)),
+                         {"v": [3, 4, 7] if part else [2, 3, 4, 5, 7, 8]})
+    return ruins + [n for _, n in aplicar_migracoes()]
+
+def _nos(plano):
+    yield plano
+    for filho in plano.get("Plans", []): yield from _nos(filho)
+
+def checar_planos(analisar=False):
+    # EXPLAIN de cada consulta quente: Seq Scan em tabela grande ou custo muito acima da referência vira alerta
+    opcoes = "ANALYZE, BUFFERS, FORMAT JSON" if analisar else "FORMAT JSON"
+    linhas = []
+    with conexao() as conn:
+        referencia = dict(conn.execute(text("SELECT consulta, custo FROM saude_planos")).fetchall()) if conn.execute(text("SELECT to_regclass('saude_planos')")).scalar() else {}
+        for nome, (sql, params) in CONSULTAS_QUENTES.items():
+            plano = conn.execute(text(f"EXPLAIN ({opcoes}) {sql}"), params).scalar()
+            plano = (json.loads(plano) if isinstance(plano, str) else plano)[0]["Plan"]
+            seq = [(n["Relation Name"], n.get("Plan Rows", 0)) for n in _nos(plano) if n["Node Type"] == "Seq Scan"]
+            tamanhos = {t: conn.execute(text("SELECT reltuples FROM pg_class WHERE relname = :t"), {"t": t}).scalar() or 0 for t, _ in seq}
+            grandes = [t for t, _ in seq if tamanhos[t] >= LIMIAR_SEQ_SCAN]
+            ref = referencia.get(nome)
+            alertas = [f"Seq Scan em {t}" for t in grandes]
+            if ref and plano["Total Cost"] > max(ref * FATOR_REGRESSAO, ref + CUSTO_MINIMO): alertas.append(f"custo {plano['Total Cost']:.0f} vs referência {ref:.0f}")
+            linhas.append({
+                "consulta": nome, "status": "⚠️ alerta" if alertas else "ok", "detalhe": "; ".join(alertas),
+                "nó_raiz": plano["Node Type"], "custo": round(plano["Total Cost"], 1), "referencia": ref,
+                "tempo_ms": round(plano["Actual Total Time"], 2) if analisar else None,
+                "seq_scans": ", ".join(f"{t} (~{int(tamanhos[t])} linhas)" for t, _ in seq),
+            })
+    return pd.DataFrame(linhas)
+
+def salvar_referencia(df):
+    # Custos atuais viram a referência para detectar regressão
+    with conexao() as conn:
+        conn.execute(text("""
+            INSERT INTO saude_planos (consulta, custo) VALUES (:c, :v)
+            ON CONFLICT (consulta) DO UPDATE SET custo = EXCLUDED.custo, registrado_em = NOW()
+        """), [{"c": r.consulta, "v": float(r.custo)} for r in df.itertuples()])
+        conn.commit()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    if "--verificar" not in sys.argv:
+        for v, n in aplicar_migracoes(): print(f"aplicada {v}: {n}")
+    print(verificar_indices().to_string(index=False))
+    print(checar_planos().to_string(index=False))
@@ -0,0 +1,53 @@
+# Worker dos disparos em massa: roda fora do Streamlit e sobrevive a recarga de página.
+#   python worker.py            (loop contínuo)
+#   python worker.py --uma-vez  (processa o que houver na fila e sai)
+import logging
+import os
+import socket
+import sys
+import time
+from banco import segredo
+from migracoes import aplicar_migracoes
+from arquivo import garantir_particoes, arquivar, particionada
+from custos import backfill, reconciliar
+from disparo import reivindicar_job, executar_job, TAXA_META_PADRAO, WORKERS_PADRAO
+
+INTERVALO_OCIOSO = 5
+INTERVALO_CUSTOS = 600  # reconciliação do rollup de custos
+INTERVALO_ARQUIVO = 24 * 3600  # partições à frente + arquivamento das encerradas
+ARQUIVO_LOTES_POR_VOLTA = 4
+
+def main(uma_vez=False):
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    taxa = float(segredo("META_MPS", TAXA_META_PADRAO))
+    workers = int(segredo("DISPARO_WORKERS", WORKERS_PADRAO))
+    for v, n in aplicar_migracoes(): logging.info("migração %s aplicada (%s)", v, n)
+    # Histórico do rollup de custos antes dos jobs; se cair no meio, continua na próxima reconciliação
+    try: backfill()
+    except Exception: logging.exception("custos: backfill do histórico interrompido; continua na próxima reconciliação")
+    ultima_reconciliacao = time.time()
+    ultimo_arquivo = 0
+    logging.info("worker %s iniciado (%.0f msg/s, %d threads)", worker_id, taxa, workers)
+    while True:
+        try:
+            if time.time() - ultima_reconciliacao > INTERVALO_CUSTOS:
+                backfill(); reconciliar(); ultima_reconciliacao = time.time()
+            if time.time() - ultimo_arquivo > INTERVALO_ARQUIVO:
+                # Poucos lotes por volta para não atrasar os jobs; só dá o dia por encerrado quando não sobra nada
+                if particionada(): garantir_particoes()
+                n = arquivar(max_lotes=ARQUIVO_LOTES_POR_VOLTA)
+                if n: logging.info("%d mensagens arquivadas", n)
+                else: ultimo_arquivo = time.time()
+            job = reivindicar_job(worker_id)
+            if job:
+                logging.info("job %s (%s) iniciado/retomado", job[0], job[1])
+                executar_job(job, worker_id, taxa_meta=taxa, workers=workers)
+                logging.info("job %s finalizado", job[0])
+                continue
+        except Exception: logging.exception("erro no worker")
+        if uma_vez: break
+        time.sleep(INTERVALO_OCIOSO)
+
+if __name__ == "__main__":
+    main(uma_vez="--uma-vez" in sys.argv)